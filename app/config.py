@@ -11,26 +11,161 @@ class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     TELEGRAM_GROUP_ID = os.getenv('TELEGRAM_GROUP_ID')
     
+    # Target Groups (GROUPS_FILE overrides TELEGRAM_GROUP_ID; 0 reload interval disables hot reload)
+    GROUPS_FILE = os.getenv('GROUPS_FILE', '')
+    GROUPS_RELOAD_SECONDS = float(os.getenv('GROUPS_RELOAD_SECONDS', 30))
+    
+    # Bot API Server (TELEGRAM_API_URL: a self-hosted telegram-bot-api; local mode reads files from its disk)
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+    TELEGRAM_LOCAL_MODE = os.getenv('TELEGRAM_LOCAL_MODE', 'false').lower() == 'true'
+    TELEGRAM_MAX_DOWNLOAD_MB = int(os.getenv('TELEGRAM_MAX_DOWNLOAD_MB', 2000 if TELEGRAM_LOCAL_MODE else 20))
+    TELEGRAM_FILE_TIMEOUT_SECONDS = float(os.getenv('TELEGRAM_FILE_TIMEOUT_SECONDS', 300))
+    
+    # Update Delivery ('polling' or 'webhook')
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+    
     # OpenAI Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+    OPENAI_MAX_IN_FLIGHT = int(os.getenv('OPENAI_MAX_IN_FLIGHT', 8))
+    OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 16))
+    OPENAI_KEEPALIVE_SECONDS = float(os.getenv('OPENAI_KEEPALIVE_SECONDS', 60))
+    OPENAI_TIMEOUT_SECONDS = float(os.getenv('OPENAI_TIMEOUT_SECONDS', 60))
+    OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o')
+    
+    # Token Budgets (per group and UTC day, prompt plus completion tokens; 0 means unlimited)
+    DAILY_TOKEN_BUDGET = int(os.getenv('DAILY_TOKEN_BUDGET', 0))
+    BUDGET_ECONOMY_AT = float(os.getenv('BUDGET_ECONOMY_AT', 0.8))
+    BUDGET_ECONOMY_MODEL = os.getenv('BUDGET_ECONOMY_MODEL', 'gpt-4o-mini')
+    BUDGET_ECONOMY_DETAIL = os.getenv('BUDGET_ECONOMY_DETAIL', 'low')
+    
+    # OpenAI Call Policy (OPENAI_HEDGE_AFTER_SECONDS=0 disables hedging, OPENAI_BREAKER_FAILURES=0 the breaker)
+    OPENAI_FALLBACK_MODEL = os.getenv('OPENAI_FALLBACK_MODEL', '')
+    OPENAI_MAX_ATTEMPTS = int(os.getenv('OPENAI_MAX_ATTEMPTS', 3))
+    OPENAI_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv('OPENAI_ATTEMPT_TIMEOUT_SECONDS', 45))
+    OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv('OPENAI_BACKOFF_BASE_SECONDS', 0.5))
+    OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv('OPENAI_BACKOFF_MAX_SECONDS', 8))
+    OPENAI_HEDGE_AFTER_SECONDS = float(os.getenv('OPENAI_HEDGE_AFTER_SECONDS', 0))
+    OPENAI_BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', 5))
+    OPENAI_BREAKER_COOLDOWN_SECONDS = float(os.getenv('OPENAI_BREAKER_COOLDOWN_SECONDS', 30))
+    
+    # Vision Payload Settings (IMAGE_DETAIL: auto, low or high)
+    IMAGE_PREPROCESS = os.getenv('IMAGE_PREPROCESS', 'true').lower() == 'true'
+    IMAGE_TARGET_SHORT_SIDE = int(os.getenv('IMAGE_TARGET_SHORT_SIDE', 512))
+    IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 80))
+    IMAGE_DETAIL = os.getenv('IMAGE_DETAIL', 'auto')
     
     # File Paths
     VIDEOS_DIR = os.getenv('VIDEOS_DIR', 'data/videos')
     IMAGES_DIR = os.getenv('IMAGES_DIR', 'data/images')
     LOGS_DIR = os.getenv('LOGS_DIR', 'data/logs')
+    DATABASE_DIR = os.getenv('DATABASE_DIR', 'data/database')
+    
+    # Storage Lifecycle (0 disables a quota; STORAGE_SWEEP_SECONDS=0 disables the background sweep)
+    STORAGE_SWEEP_SECONDS = float(os.getenv('STORAGE_SWEEP_SECONDS', 600))
+    STORAGE_MAX_AGE_HOURS = float(os.getenv('STORAGE_MAX_AGE_HOURS', 24))
+    STORAGE_MAX_VIDEOS_MB = float(os.getenv('STORAGE_MAX_VIDEOS_MB', 2048))
+    STORAGE_MAX_IMAGES_MB = float(os.getenv('STORAGE_MAX_IMAGES_MB', 512))
+    STORAGE_GRACE_SECONDS = float(os.getenv('STORAGE_GRACE_SECONDS', 600))
+    DELETE_VIDEO_AFTER_EXTRACT = os.getenv('DELETE_VIDEO_AFTER_EXTRACT', 'false').lower() == 'true'
+    
+    # Metrics (METRICS_PORT=0 disables the endpoint; ADMIN_USER_IDS may use /stats)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 9464))
+    ADMIN_USER_IDS = [int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()]
+    
+    # Logging (LOG_DEBUG_CATEGORIES: comma-separated, '*' for all; LOG_SAMPLE_RATES: category=rate pairs, e.g. video=0.1)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', 7))
+    LOG_DEBUG_CATEGORIES = os.getenv('LOG_DEBUG_CATEGORIES', '')
+    LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
     
     # Bot Settings
     MAX_VIDEO_SIZE_MB = int(os.getenv('MAX_VIDEO_SIZE_MB', 50))
     SUPPORTED_VIDEO_FORMATS = os.getenv('SUPPORTED_VIDEO_FORMATS', 'mp4,avi,mov,mkv,webm').split(',')
+    MAX_VIDEO_DURATION_SECONDS = int(os.getenv('MAX_VIDEO_DURATION_SECONDS', 0))
+    MAX_VIDEO_DIMENSION = int(os.getenv('MAX_VIDEO_DIMENSION', 0))
+    
+    # ffmpeg Settings (0 concurrency = one process per CPU core)
+    FFMPEG_CONCURRENCY = int(os.getenv('FFMPEG_CONCURRENCY', 0))
+    FFMPEG_TIMEOUT_SECONDS = float(os.getenv('FFMPEG_TIMEOUT_SECONDS', 60))
+    COVER_SEEK_SECONDS = float(os.getenv('COVER_SEEK_SECONDS', 0))
+    
+    # Cover Selection ('first' frame, 'best' of several sampled frames, or a 'contact_sheet' grid)
+    COVER_MODE = os.getenv('COVER_MODE', 'first')
+    COVER_SAMPLING = os.getenv('COVER_SAMPLING', 'keyframe')
+    COVER_CANDIDATES = int(os.getenv('COVER_CANDIDATES', 8))
+    COVER_SAMPLE_INTERVAL_SECONDS = float(os.getenv('COVER_SAMPLE_INTERVAL_SECONDS', 1.0))
+    CONTACT_SHEET_COLUMNS = int(os.getenv('CONTACT_SHEET_COLUMNS', 3))
+    CONTACT_SHEET_ROWS = int(os.getenv('CONTACT_SHEET_ROWS', 2))
+    CONTACT_SHEET_TILE_SIZE = int(os.getenv('CONTACT_SHEET_TILE_SIZE', 384))
+    
+    # Thumbnail Fast Path
+    THUMBNAIL_FAST_PATH = os.getenv('THUMBNAIL_FAST_PATH', 'false').lower() == 'true'
+    THUMBNAIL_MIN_SIZE = int(os.getenv('THUMBNAIL_MIN_SIZE', 320))
+    
+    # Analysis Cache Settings
+    CACHE_TTL_HOURS = float(os.getenv('CACHE_TTL_HOURS', 24 * 30))
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 50000))
+    PHASH_ENABLED = os.getenv('PHASH_ENABLED', 'true').lower() == 'true'
+    PHASH_SIMILARITY = float(os.getenv('PHASH_SIMILARITY', 0.9))
+    
+    # Album/Burst Coalescing (0 window disables)
+    COALESCE_WINDOW_SECONDS = float(os.getenv('COALESCE_WINDOW_SECONDS', 2.0))
+    COALESCE_MAX_BATCH = int(os.getenv('COALESCE_MAX_BATCH', 4))
+    
+    # Durable Job Store
+    JOB_STORE_RETENTION_HOURS = float(os.getenv('JOB_STORE_RETENTION_HOURS', 72))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+    
+    # Process Roles ('all' in one process, or an 'ingest' process feeding 'worker' processes over the job queue)
+    PROCESS_ROLE = os.getenv('PROCESS_ROLE', 'all')
+    QUEUE_HOST = os.getenv('QUEUE_HOST', '127.0.0.1')
+    QUEUE_PORT = int(os.getenv('QUEUE_PORT', 9470))
+    QUEUE_URL = os.getenv('QUEUE_URL') or f"http://{QUEUE_HOST}:{QUEUE_PORT}"
+    QUEUE_TOKEN = os.getenv('QUEUE_TOKEN', '')
+    QUEUE_LEASE_SECONDS = float(os.getenv('QUEUE_LEASE_SECONDS', 120))
+    QUEUE_RETRY_SECONDS = float(os.getenv('QUEUE_RETRY_SECONDS', 2))
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 0))
+    
+    # Job Queue Settings
+    WORKER_COUNT = int(os.getenv('WORKER_COUNT', 4))
+    JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', 100))
+    DOWNLOAD_CONCURRENCY = int(os.getenv('DOWNLOAD_CONCURRENCY', 4))
+    EXTRACT_CONCURRENCY = int(os.getenv('EXTRACT_CONCURRENCY', os.cpu_count() or 2))
+    ANALYSIS_CONCURRENCY = int(os.getenv('ANALYSIS_CONCURRENCY', 4))
+    REPLY_CONCURRENCY = int(os.getenv('REPLY_CONCURRENCY', 8))
+    
+    # Telegram Flood Limits
+    TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+    TELEGRAM_GROUP_MESSAGES_PER_MINUTE = float(os.getenv('TELEGRAM_GROUP_MESSAGES_PER_MINUTE', 20))
+    TELEGRAM_GROUP_BURST = float(os.getenv('TELEGRAM_GROUP_BURST', 3))
+    TELEGRAM_PRIVATE_RATE = float(os.getenv('TELEGRAM_PRIVATE_RATE', 1))
+    
+    # Streaming Replies (partial text is edited into the processing message as the model writes it)
+    STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
+    STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv('STREAM_EDIT_INTERVAL_SECONDS', 3))
+    STREAM_MIN_CHARS = int(os.getenv('STREAM_MIN_CHARS', 60))
     
     @classmethod
-    def validate(cls):
+    def validate(cls, role: str = None):
         """Validate that all required configuration is present"""
+        role = role or cls.PROCESS_ROLE
+        if role not in ('all', 'ingest', 'worker'):
+            raise ValueError(f"Invalid PROCESS_ROLE '{role}', expected 'all', 'ingest' or 'worker'")
+        
         required_vars = [
             'TELEGRAM_BOT_TOKEN',
-            'TELEGRAM_GROUP_ID', 
             'OPENAI_API_KEY'
         ]
+        # Workers get each job's group settings from the ingest process
+        if not cls.GROUPS_FILE and role != 'worker':
+            required_vars.insert(1, 'TELEGRAM_GROUP_ID')
         
         missing_vars = []
         for var in required_vars:
@@ -40,4 +175,14 @@ class Config:
         if missing_vars:
             raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
         
+        if cls.TELEGRAM_LOCAL_MODE and not cls.TELEGRAM_API_URL:
+            raise ValueError("TELEGRAM_LOCAL_MODE requires TELEGRAM_API_URL pointing at a local Bot API server")
+        
+        if cls.BOT_MODE not in ('polling', 'webhook'):
+            raise ValueError(f"Invalid BOT_MODE '{cls.BOT_MODE}', expected 'polling' or 'webhook'")
+        
+        # Without it PTB would register its own listen address, which Telegram rejects
+        if cls.BOT_MODE == 'webhook' and role != 'worker' and not cls.WEBHOOK_URL:
+            raise ValueError("BOT_MODE=webhook requires WEBHOOK_URL, the public HTTPS base URL Telegram posts to")
+        
         return True 
\ No newline at end of file
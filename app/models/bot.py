@@ -1,42 +1,186 @@
+import asyncio
 import os
+import shutil
+import time
 import tempfile
-from typing import Optional
+from typing import Dict, List, Optional, Set, Union
+import aiofiles
+import httpx
 from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from app.config import Config
 from app.services.video_processor import VideoProcessor
 from app.services.ai_analyzer import AIAnalyzer
-from app.utils.logger import logger
+from app.services.admission import AdmissionPolicy
+from app.services.analysis_cache import AnalysisCache
+from app.services.coalescer import Coalescer
+from app.services.group_registry import GroupRegistry
+from app.services.job_queue import BatchJob, JobQueue, VideoJob
+from app.services.job_store import JobStore, MessageRef, StoredFile
+from app.services.shared_queue import QueueClient, QueueServer, RemoteJobStore
+from app.services.storage_manager import StorageManager
+from app.services.usage_ledger import CACHE_ONLY, ECONOMY, NORMAL
+from app.services.message_scheduler import MessageScheduler
+from app.services.metrics import MetricsServer, metrics
+from app.models.worker import QueueWorker
+from app.utils.logger import debug_enabled, log_debug, log_event, logger
+
+# Size of each read when streaming a download to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Telegram rejects messages longer than 4096 characters
+MAX_MESSAGE_LENGTH = 4096
+
+OVER_BUDGET_MESSAGE = "💸 This group's daily analysis budget is used up. Please try again tomorrow."
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into Telegram-sized chunks, preferring paragraph boundaries"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n\n', 0, limit)
+        if cut <= 0:
+            cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    chunks.append(text)
+    return chunks
 
 class ViralTelegramBot:
     """Main Telegram bot class for viral video analysis"""
     
-    def __init__(self):
+    def __init__(self, role: Optional[str] = None):
         self.config = Config
+        # 'all' runs everything here; 'ingest' only acknowledges videos and
+        # serves the job queue; 'worker' processes jobs leased from the queue
+        self.role = role or self.config.PROCESS_ROLE
         self.video_processor = VideoProcessor()
         self.ai_analyzer = AIAnalyzer()
-        self.application = Application.builder().token(self.config.TELEGRAM_BOT_TOKEN).build()
+        self.analysis_cache = AnalysisCache()
+        self.job_store = RemoteJobStore(QueueClient()) if self.role == 'worker' else JobStore()
+        self.storage = StorageManager()
+        self.admission = AdmissionPolicy()
+        self.groups = GroupRegistry()
+        self.queue_server = None
+        if self.role == 'ingest':
+            self.queue_server = QueueServer(self.job_store, lambda chat_id: self.groups.by_id.get(chat_id))
+        self.job_queue = JobQueue(self.process_video_job)
+        self.coalescer = Coalescer(self.dispatch_videos)
+        self.outbound = MessageScheduler()
+        # Jobs waiting for their "queued" acknowledgement to be sent
+        self.ack_tasks: Set[asyncio.Task] = set()
+        # File downloads are streamed to disk with our own client: PTB's download_to_drive buffers the whole file
+        self.file_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.config.TELEGRAM_FILE_TIMEOUT_SECONDS, connect=10.0)
+        )
+        self.metrics_server = MetricsServer(metrics)
+        metrics.queue_depth.set_function(self.job_queue.depth)
+        metrics.in_flight.set_function(lambda: self.job_queue.in_flight)
+        metrics.outbound_pending.set_function(self.outbound.pending)
+        builder = (
+            Application.builder()
+            .token(self.config.TELEGRAM_BOT_TOKEN)
+            .post_init(self._on_startup)
+            .post_shutdown(self._on_shutdown)
+        )
+        if self.config.TELEGRAM_API_URL:
+            # Self-hosted Bot API server; in local mode get_file returns a path on its disk
+            api_url = self.config.TELEGRAM_API_URL.rstrip('/')
+            builder = (
+                builder.base_url(f"{api_url}/bot")
+                .base_file_url(f"{api_url}/file/bot")
+                .local_mode(self.config.TELEGRAM_LOCAL_MODE)
+            )
+        self.application = builder.build()
         
         # Validate configuration
-        self.config.validate()
+        self.config.validate(self.role)
+        if self.role == 'worker':
+            # Updates are received by the ingest process
+            return
+        
+        # Admin-only statistics command
+        if self.config.ADMIN_USER_IDS:
+            self.application.add_handler(
+                CommandHandler('stats', self.handle_stats_command, filters.User(user_id=self.config.ADMIN_USER_IDS))
+            )
         
+        # Only messages from target groups reach the video handlers
+        target_groups = self.groups.filter()
         # Add message handler for videos (higher priority)
         self.application.add_handler(
-            MessageHandler(filters.VIDEO, self.handle_video_message)
+            MessageHandler(filters.VIDEO & target_groups, self.handle_video_message)
         )
         # Add message handler for video notes
         self.application.add_handler(
-            MessageHandler(filters.VIDEO_NOTE, self.handle_video_message)
+            MessageHandler(filters.VIDEO_NOTE & target_groups, self.handle_video_message)
         )
         # Add message handler for documents (video files)
         self.application.add_handler(
-            MessageHandler(filters.Document.VIDEO, self.handle_video_message)
+            MessageHandler(filters.Document.VIDEO & target_groups, self.handle_video_message)
         )
         
         # Add message handler for ALL other messages (for debugging) - lower priority
-        self.application.add_handler(
-            MessageHandler(filters.ALL, self.handle_all_messages)
-        )
+        if debug_enabled('messages'):
+            self.application.add_handler(
+                MessageHandler(filters.ALL, self.handle_all_messages)
+            )
+
+    def run(self):
+        """Start receiving updates with long polling or a webhook server"""
+        if self.role == 'worker':
+            asyncio.run(QueueWorker(self, self.job_store.client).run())
+            return
+        if self.config.BOT_MODE == 'webhook':
+            path = self.config.WEBHOOK_PATH.strip('/')
+            webhook_url = f"{self.config.WEBHOOK_URL.rstrip('/')}/{path}"
+            logger.info(
+                f"Starting webhook server on {self.config.WEBHOOK_LISTEN}:{self.config.WEBHOOK_PORT}/{path}"
+            )
+            self.application.run_webhook(
+                listen=self.config.WEBHOOK_LISTEN,
+                port=self.config.WEBHOOK_PORT,
+                url_path=path,
+                webhook_url=webhook_url,
+                secret_token=self.config.WEBHOOK_SECRET_TOKEN,
+                allowed_updates=None
+            )
+        else:
+            self.application.run_polling(allowed_updates=None)
+
+    async def _on_startup(self, application: Application):
+        """Start background workers once the application is initialized"""
+        await self.groups.start()
+        if self.queue_server:
+            await self.queue_server.start()
+        else:
+            await self.job_queue.start()
+        await self.resume_jobs()
+        await self.metrics_server.start()
+        if not self.queue_server:
+            await self.storage.start()
+
+    async def _on_shutdown(self, application: Application):
+        """Stop background workers when the application shuts down"""
+        await self.groups.stop()
+        if self.queue_server:
+            await self.queue_server.stop()
+        await self.metrics_server.stop()
+        await self.storage.stop()
+        await self.coalescer.flush_all()
+        if self.ack_tasks:
+            # Unacknowledged jobs are dispatched again on the next start
+            _, pending = await asyncio.wait(self.ack_tasks, timeout=5.0)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await self.job_queue.stop()
+        await self.outbound.stop()
+        await self.ai_analyzer.close()
+        await self.file_client.aclose()
+        self.analysis_cache.close()
+        self.job_store.close()
 
     async def handle_all_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle all messages for debugging"""
@@ -61,48 +205,83 @@ class ViralTelegramBot:
             elif message.video_note:
                 message_type = "video_note"
             
-            logger.info(f"🔍 DEBUG: Received {message_type} message in chat: {chat_id}")
-            logger.info(f"🔍 DEBUG: Message: {message}")
-            logger.info(f"🔍 DEBUG: Target group ID: {self.config.TELEGRAM_GROUP_ID}")
-            
-            if hasattr(message.chat, 'title'):
-                logger.info(f"🔍 DEBUG: Chat title: {message.chat.title}")
-            if hasattr(message.chat, 'username'):
-                logger.info(f"🔍 DEBUG: Chat username: {message.chat.username}")
-                
+            log_debug(
+                'messages', "Received %s message in chat %s", message_type, chat_id,
+                chat_id=chat_id,
+                chat_title=getattr(message.chat, 'title', None),
+                chat_username=getattr(message.chat, 'username', None),
+                target_group=self.groups.lookup(message.chat) is not None,
+                message=message.to_dict()
+            )
         except Exception as e:
             logger.error(f"Error in handle_all_messages: {e}")
 
+    async def handle_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Reply to an admin's /stats with queue, stage latency and cache figures"""
+        await update.message.reply_text(self.format_stats())
+
+    def format_stats(self) -> str:
+        """Human-readable snapshot of the metrics for the /stats command"""
+        uptime = time.time() - metrics.started_at
+        videos = metrics.videos.values
+        if self.queue_server:
+            stages = self.job_store.stats()['stages']
+            queue = ", ".join(f"{stage} {count}" for stage, count in sorted(stages.items())) or "empty"
+            queue = f"Shared queue: {queue}; {self.outbound.pending()} outbound"
+        else:
+            queue = (f"Queue: {self.job_queue.depth()} waiting, {self.job_queue.in_flight} in flight, "
+                     f"{self.outbound.pending()} outbound")
+        lines = [
+            f"📊 Uptime {uptime / 3600:.1f}h",
+            queue,
+            "Videos: " + (", ".join(f"{key[0]} {int(value)}" for key, value in sorted(videos.items())) or "none"),
+            "",
+            "Stage  count  p50  p95  errors",
+        ]
+        for stage, count, p50, p95, errors in metrics.stage_summary():
+            lines.append(f"{stage}  {count}  {p50:.2f}s  {p95:.2f}s  {errors}")
+        cache = self.analysis_cache.stats()
+        lines.append("")
+        lines.append(f"Cache: {cache['hit_total']} hits, {cache['miss_total']} misses")
+        tokens = metrics.tokens.values
+        if tokens:
+            lines.append("Tokens: " + ", ".join(f"{key[0]} {int(value)}" for key, value in sorted(tokens.items())))
+        prefix_calls = self.ai_analyzer.prefix_calls
+        if prefix_calls:
+            calls = sum(prefix_calls.values())
+            prompt_tokens = metrics.tokens.get(kind='prompt')
+            cached_share = metrics.tokens.get(kind='cached') / prompt_tokens if prompt_tokens else 0.0
+            lines.append(
+                f"Prompt prefix: {calls - len(prefix_calls)} of {calls} calls reused one of "
+                f"{len(prefix_calls)} prefixes, {cached_share:.0%} of prompt tokens cached"
+            )
+        for group_key, model, calls, prompt, completion, cached in self.ai_analyzer.ledger.report():
+            lines.append(f"Today {group_key} {model}: {calls} calls, {prompt} prompt ({cached} cached), {completion} completion")
+        for group in self.groups.by_id.values():
+            if group.token_budget:
+                spent = self.ai_analyzer.ledger.spent(group.key)
+                mode = self.ai_analyzer.ledger.mode(group.key, group.token_budget)
+                lines.append(f"Budget {group.label}: {spent}/{group.token_budget} tokens ({mode})")
+        admission = self.admission.stats()
+        lines.append(f"Admission: {admission['admitted']} admitted, {sum(admission['rejected'].values())} rejected")
+        storage = self.storage.stats()
+        if storage:
+            lines.append("Storage: " + ", ".join(
+                f"{name} {result.files} files {result.bytes / (1024 * 1024):.0f}MB" for name, result in storage.items()
+            ))
+        return "\n".join(lines)
+
+    @metrics.timed('ingest', none_is_error=False)
     async def handle_video_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             message = update.message
             chat_id = message.chat_id
             
-            logger.info(f"🎬 VIDEO HANDLER: Processing video message in chat: {chat_id}")
-            logger.info(f"🎬 VIDEO HANDLER: Target group ID: {self.config.TELEGRAM_GROUP_ID}")
-            
-            if hasattr(message.chat, 'title'):
-                logger.info(f"🎬 VIDEO HANDLER: Chat title: {message.chat.title}")
-            if hasattr(message.chat, 'username'):
-                logger.info(f"🎬 VIDEO HANDLER: Chat username: {message.chat.username}")
-            # Check if message is from the target group
-            target_group_id = self.config.TELEGRAM_GROUP_ID
-            logger.info(f"🎬 DEBUG: Comparing chat_id '{chat_id}' with target_group_id '{target_group_id}'")
-            
-            # Check if target_group_id is numeric (starts with -)
-            if target_group_id.startswith('-'):
-                logger.info(f"🎬 DEBUG: Using numeric comparison: '{str(chat_id)}' == '{target_group_id}'")
-                if str(chat_id) != target_group_id:
-                    logger.info(f"Ignoring message from non-target group: {chat_id}")
-                    return
-            else:
-                logger.info(f"🎬 DEBUG: Using username comparison")
-                group_username = target_group_id.replace('@', '')
-                if not hasattr(message.chat, 'username') or message.chat.username != group_username:
-                    logger.info(f"Ignoring message from non-target group: {chat_id}")
-                    return
-            logger.info(f"Processing video message from group: {chat_id}")
-            logger.info(f"Group title: {message.chat.title if hasattr(message.chat, 'title') else 'Unknown'}")
+            group = self.groups.lookup(message.chat)
+            if group is None:
+                return
+            log_event('video', "Processing video message from group %s", group.label,
+                      chat_id=chat_id, message_id=message.message_id)
             # Get video file
             video_file = None
             video_info = {}
@@ -128,62 +307,422 @@ class ViralTelegramBot:
             if not video_file:
                 logger.warning("No video file found in message")
                 return
-            # Send processing message
-            processing_msg = await context.bot.send_message(
+            # Telegram may deliver the same update again after a restart or timeout
+            if not self.job_store.begin(chat_id, message.message_id, video_file, video_info, message.media_group_id):
+                return
+            # Reject from metadata before spending bandwidth or disk
+            rejection = self.admission.check(video_file, group)
+            if rejection:
+                self.job_store.advance(chat_id, message.message_id, 'failed', error=rejection)
+                metrics.videos.inc(outcome='rejected')
+                self.outbound.send_message(context.bot, chat_id, rejection)
+                return
+            # Reply straight from the cache for reposts of a known file
+            cached_analysis = self.analysis_cache.get_by_file_id(
+                getattr(video_file, 'file_unique_id', None), group.namespace
+            )
+            if cached_analysis:
+                metrics.videos.inc(outcome='cached')
+                reply = await self.ai_analyzer.generate_response_message(cached_analysis, video_info)
+                self.send_reply(context.bot, chat_id, reply)
+                self.job_store.advance(chat_id, message.message_id, 'done', analysis=cached_analysis)
+                log_event('video', "Served cached analysis for video %s", video_file.file_id, chat_id=chat_id)
+                return
+            job = VideoJob(
                 chat_id=chat_id,
-                text="🔄 Processing video... Please wait."
+                message_id=message.message_id,
+                video_file=video_file,
+                video_info=video_info,
+                bot=context.bot,
+                media_group_id=message.media_group_id,
+                group=group
             )
-            try:
-                # Download video file
-                file_path = await self.download_telegram_file(video_file, context.bot)
-                if not file_path:
-                    await self.update_processing_message(context.bot, processing_msg, "❌ Failed to download video file.")
-                    return
-                # Process video
-                video_path, image_path = await self.video_processor.process_video(
-                    str(video_file.file_id), file_path
-                )
-                if not video_path or not image_path:
-                    await self.update_processing_message(context.bot, processing_msg, "❌ Failed to process video or extract cover image.")
+            await self.coalescer.add(job, message.media_group_id)
+        except Exception as e:
+            metrics.stage_errors.inc(stage='ingest')
+            logger.error(f"Error handling video message: {e}")
+
+    async def dispatch_videos(self, jobs: List[VideoJob]):
+        """Acknowledge a single video or a coalesced batch and put it on the queue
+
+        The acknowledgement is rate limited per chat, and PTB handles updates
+        one at a time, so the job is queued once the message is sent instead
+        of holding up every other chat's updates until then.
+        """
+        first = jobs[0]
+        # Send processing message
+        if len(jobs) == 1:
+            text = "🔄 Video queued for processing... Please wait."
+        else:
+            text = f"🔄 {len(jobs)} videos queued for processing... Please wait."
+        ack = self.outbound.send_message(first.bot, first.chat_id, text)
+        task = asyncio.create_task(self._enqueue_acknowledged(jobs, ack))
+        self.ack_tasks.add(task)
+        task.add_done_callback(self.ack_tasks.discard)
+
+    async def _enqueue_acknowledged(self, jobs: List[VideoJob], ack: asyncio.Future):
+        """Record the processing message once it is sent, then queue the job"""
+        try:
+            first = jobs[0]
+            bot = first.bot
+            processing_msg = await ack
+            if not processing_msg:
+                logger.error(f"Could not acknowledge {len(jobs)} video(s) in chat {first.chat_id}")
+                for job in jobs:
+                    self.record(job, 'failed', error='could not acknowledge')
+                return
+            for job in jobs:
+                self.job_store.update(job.chat_id, job.message_id, processing_message_id=processing_msg.message_id)
+            if self.queue_server:
+                # A worker process leases the job from the store
+                self.queue_server.notify()
+                log_event('video', "Queued %d video(s) for workers", len(jobs), chat_id=first.chat_id)
+                return
+            if len(jobs) == 1:
+                first.processing_msg = processing_msg
+                job = first
+            else:
+                job = BatchJob(chat_id=first.chat_id, jobs=jobs, bot=bot, processing_msg=processing_msg, group=first.group)
+            if not self.job_queue.submit(job):
+                for queued in jobs:
+                    self.record(queued, 'failed', error='queue full')
+                metrics.videos.inc(len(jobs), outcome='busy')
+                self.update_processing_message(bot, processing_msg, "⏳ Bot is busy right now, please try again later.")
+                return
+            log_event('video', "Queued %d video(s)", len(jobs), chat_id=first.chat_id, queue_depth=self.job_queue.depth())
+        except Exception as e:
+            metrics.stage_errors.inc(stage='ingest')
+            logger.error(f"Error queueing {len(jobs)} video(s) in chat {jobs[0].chat_id}: {e}")
+
+    async def prepare_cover(self, job: VideoJob) -> Optional[str]:
+        """Produce the cover image for a job; returns an error message on failure"""
+        bot = job.bot
+        video_file = job.video_file
+        # A resumed job may already have its cover or video on disk
+        if job.image_path and os.path.exists(job.image_path):
+            return None
+        job.image_path = None
+        if job.video_path and not os.path.exists(job.video_path):
+            job.video_path = None
+        # Fast path: analyze the thumbnail Telegram already generated
+        if self.config.THUMBNAIL_FAST_PATH and not job.video_path:
+            job.image_path = await self.fetch_thumbnail(video_file, bot)
+        if not job.image_path:
+            # Download video file
+            if not job.video_path:
+                error = await self.fetch_video(job)
+                if error:
+                    return error
+                if job.video_path:
+                    self.record(job, 'downloaded', video_path=job.video_path)
+            # Extract cover image
+            if job.video_path:
+                async with self.job_queue.stage('extract'):
+                    job.image_path = await self.video_processor.extract_cover_image(
+                        job.video_path, job.video_info.get('duration')
+                    )
+            if not job.video_path or not job.image_path:
+                return "❌ Failed to process video or extract cover image."
+            # Everything after this point works from the cover alone
+            if self.config.DELETE_VIDEO_AFTER_EXTRACT and self.video_processor.is_stored(job.video_path):
+                await self.storage.discard(job.video_path)
+                job.video_path = None
+        self.record(job, 'extracted', video_path=job.video_path, image_path=job.image_path)
+        return None
+
+    async def fetch_video(self, job: VideoJob) -> Optional[str]:
+        """Get a job's video onto local disk; returns an error message on failure"""
+        video_file = job.video_file
+        # Same limit admission applied, so a group allowed larger videos keeps them
+        max_size_mb = getattr(job.group, 'max_video_size_mb', None)
+        async with self.job_queue.stage('download'):
+            destination = self.video_processor.allocate_video_path(str(video_file.file_id))
+            path = await self.download_telegram_file(video_file, job.bot, destination)
+            if not path:
+                return "❌ Failed to download video file."
+            if path == destination:
+                job.file_path = path
+                job.video_path = await self.video_processor.download_video(str(video_file.file_id), path, max_size_mb)
+            else:
+                # Local Bot API server: read the video where the server stored it
+                job.video_path = await self.video_processor.open_in_place(path, max_size_mb)
+        return None
+
+    def budget_mode(self, group) -> str:
+        """How to serve a group given today's token spend against its budget"""
+        if group is None:
+            return self.ai_analyzer.ledger.mode(None, self.config.DAILY_TOKEN_BUDGET)
+        mode = self.ai_analyzer.ledger.mode(group.key, group.token_budget)
+        if mode != NORMAL:
+            log_event('video', "Group %s is in %s mode", group.label, mode, group=group.key, mode=mode)
+        return mode
+
+    def record(self, job: VideoJob, stage: str, **fields):
+        """Persist a job's progress so it can resume after a restart"""
+        self.job_store.advance(job.chat_id, job.message_id, stage, **fields)
+
+    async def resume_jobs(self):
+        """Re-queue jobs that the previous run did not finish
+
+        Jobs acknowledged in one processing message, such as a coalesced
+        album, are rebuilt into a single BatchJob so they share one reply.
+        """
+        bot = self.application.bot
+        # With separate workers, acknowledged jobs are simply leased again
+        records = self.job_store.unacknowledged() if self.queue_server else self.job_store.interrupted()
+        acknowledged: Dict[tuple, List[VideoJob]] = {}
+        for record in records:
+            group = self.groups.by_id.get(record['chat_id'])
+            if group is None:
+                self.job_store.advance(record['chat_id'], record['message_id'], 'failed', error='not a target group')
+                continue
+            job = VideoJob(
+                chat_id=record['chat_id'],
+                message_id=record['message_id'],
+                video_file=StoredFile.from_record(record),
+                video_info=record['video_info'],
+                bot=bot,
+                media_group_id=record['media_group_id'],
+                group=group,
+                video_path=record['video_path'],
+                image_path=record['image_path'],
+                analysis=record['analysis']
+            )
+            log_event('video', "Resuming job %s from stage %s", record['job_key'], record['stage'],
+                      chat_id=job.chat_id)
+            if not record['processing_message_id']:
+                await self.dispatch_videos([job])
+                continue
+            acknowledged.setdefault((job.chat_id, record['processing_message_id']), []).append(job)
+        for (chat_id, processing_message_id), jobs in acknowledged.items():
+            jobs.sort(key=lambda job: job.message_id)
+            processing_msg = MessageRef(chat_id, processing_message_id)
+            if len(jobs) == 1:
+                job = jobs[0]
+                job.processing_msg = processing_msg
+            else:
+                job = BatchJob(chat_id=chat_id, jobs=jobs, bot=bot, processing_msg=processing_msg, group=jobs[0].group)
+            if self.job_queue.submit(job):
+                self.update_processing_message(bot, processing_msg, "🔄 Resuming after restart... Please wait.", final=False)
+            else:
+                for queued in jobs:
+                    self.record(queued, 'failed', error='queue full')
+                self.update_processing_message(bot, processing_msg, "⏳ Bot is busy right now, please try again later.")
+
+    async def find_cached_analysis(self, job: VideoJob) -> Optional[str]:
+        """Reuse an earlier analysis of an identical or near-identical cover"""
+        namespace = job.group.namespace if job.group else None
+        job.cover_hash = await asyncio.to_thread(AnalysisCache.hash_file, job.image_path)
+        analysis = self.analysis_cache.get_by_cover_hash(job.cover_hash, namespace)
+        if not analysis and self.analysis_cache.phash_enabled:
+            job.cover_phash = await asyncio.to_thread(self.video_processor.compute_cover_phash, job.image_path)
+            analysis = self.analysis_cache.get_near_duplicate(job.cover_phash, namespace)
+        return analysis
+
+    def store_analysis(self, job: VideoJob, analysis: str):
+        self.analysis_cache.put(
+            analysis, getattr(job.video_file, 'file_unique_id', None), job.cover_hash, job.cover_phash,
+            job.group.namespace if job.group else None
+        )
+
+    def cleanup_job_files(self, job: VideoJob):
+        """Remove a download that never made it into storage"""
+        if job.file_path and job.file_path != job.video_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+            log_debug('pipeline', "Cleaned up rejected download %s", job.file_path)
+
+    async def process_video_job(self, job: Union[VideoJob, BatchJob]):
+        """Run the download, extraction, analysis and reply stages for a queued video"""
+        if isinstance(job, BatchJob):
+            await self.process_batch_job(job)
+            return
+        bot = job.bot
+        processing_msg = job.processing_msg
+        outcome = 'failed'
+        try:
+            analysis = job.analysis
+            if not analysis:
+                error = await self.prepare_cover(job)
+                if error:
+                    self.record(job, 'failed', error=error)
+                    self.update_processing_message(bot, processing_msg, error)
                     return
+                analysis = await self.find_cached_analysis(job)
+            mode = self.budget_mode(job.group)
+            if not analysis and mode == CACHE_ONLY:
+                outcome = 'over_budget'
+                self.record(job, 'failed', error='over budget')
+                self.update_processing_message(bot, processing_msg, OVER_BUDGET_MESSAGE)
+                return
+            if not analysis:
                 # Analyze with AI
-                await self.update_processing_message(context.bot, processing_msg, "🤖 Analyzing video content...")
-                analysis_result = await self.ai_analyzer.get_video_insights(image_path, video_info)
-                if not analysis_result:
-                    await self.update_processing_message(context.bot, processing_msg, "❌ Failed to analyze video content.")
+                self.update_processing_message(bot, processing_msg, "🤖 Analyzing video content...", final=False)
+                # Show the copy as it is written instead of after the whole completion
+                stream = None
+                if self.config.STREAM_RESPONSES:
+                    stream = self.outbound.stream_edits(bot, processing_msg.chat_id, processing_msg.message_id)
+                async with self.job_queue.stage('analysis'):
+                    analysis = await self.ai_analyzer.analyze_image(
+                        job.image_path,
+                        self.video_processor.contact_sheet_layout(job.image_path),
+                        job.group.prompt if job.group else None,
+                        stream.feed if stream else None,
+                        job.group.key if job.group else None,
+                        mode == ECONOMY
+                    )
+                if not analysis:
+                    self.record(job, 'failed', error='analysis failed')
+                    self.update_processing_message(bot, processing_msg, "❌ Failed to analyze video content.")
                     return
-                # Send analysis result
-                await self.update_processing_message(context.bot, processing_msg, analysis_result)
-                logger.info(f"Successfully processed video: {video_file.file_id}")
-            except Exception as e:
-                logger.error(f"Error processing video message: {e}")
-                await self.update_processing_message(context.bot, processing_msg, f"❌ Error processing video: {str(e)}")
-            finally:
-                if 'file_path' in locals() and os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Cleaned up temporary file: {file_path}")
+            self.store_analysis(job, analysis)
+            self.record(job, 'analyzed', analysis=analysis)
+            analysis_result = await self.ai_analyzer.generate_response_message(analysis, job.video_info)
+            # Send analysis result
+            self.send_reply(bot, processing_msg.chat_id, analysis_result, processing_msg)
+            self.record(job, 'done')
+            outcome = 'processed'
+            log_event('video', "Successfully processed video %s", job.video_file.file_id,
+                      chat_id=job.chat_id, seconds=round(time.monotonic() - job.enqueued_at, 3))
         except Exception as e:
-            logger.error(f"Error handling video message: {e}")
+            logger.error(f"Error processing video message: {e}")
+            self.record(job, 'failed', error=str(e))
+            self.update_processing_message(bot, processing_msg, f"❌ Error processing video: {str(e)}")
+        finally:
+            metrics.videos.inc(outcome=outcome)
+            metrics.stage_seconds.observe(time.monotonic() - job.enqueued_at, stage='total')
+            self.cleanup_job_files(job)
 
-    async def download_telegram_file(self, file, bot) -> Optional[str]:
+    async def process_batch_job(self, batch: BatchJob):
+        """Process a coalesced batch with one multi-image request and one combined reply"""
+        bot = batch.bot
+        processing_msg = batch.processing_msg
+        jobs = batch.jobs
+        errors: List[Optional[str]] = ["❌ Error processing videos."] * len(jobs)
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-                file_path = tmp_file.name
-            file_obj = await bot.get_file(file.file_id)
-            await file_obj.download_to_drive(file_path)
-            logger.info(f"Downloaded file to: {file_path}")
-            return file_path
+            analyses: List[Optional[str]] = [job.analysis for job in jobs]
+            errors = list(await asyncio.gather(*(
+                self.prepare_cover(job) if not job.analysis else asyncio.sleep(0) for job in jobs
+            )))
+            for index, job in enumerate(jobs):
+                if not errors[index] and not analyses[index]:
+                    analyses[index] = await self.find_cached_analysis(job)
+            pending = [index for index in range(len(jobs)) if not errors[index] and not analyses[index]]
+            mode = self.budget_mode(batch.group)
+            if pending and mode == CACHE_ONLY:
+                for index in pending:
+                    errors[index] = OVER_BUDGET_MESSAGE
+                pending = []
+            if pending:
+                # Analyze with AI
+                self.update_processing_message(bot, processing_msg, f"🤖 Analyzing {len(pending)} videos...", final=False)
+                async with self.job_queue.stage('analysis'):
+                    results = await self.ai_analyzer.analyze_images(
+                        [jobs[index].image_path for index in pending],
+                        [self.video_processor.contact_sheet_layout(jobs[index].image_path) for index in pending],
+                        batch.group.prompt if batch.group else None,
+                        batch.group.key if batch.group else None,
+                        mode == ECONOMY
+                    )
+                for position, index in enumerate(pending):
+                    if results and results[position]:
+                        analyses[index] = results[position]
+                        self.store_analysis(jobs[index], results[position])
+                        self.record(jobs[index], 'analyzed', analysis=results[position])
+                    else:
+                        errors[index] = "❌ Failed to analyze video content."
+            sections = []
+            for index, job in enumerate(jobs):
+                header = f"🎬 **视频 {index + 1}/{len(jobs)}**\n"
+                if errors[index]:
+                    sections.append(header + errors[index])
+                else:
+                    sections.append(header + await self.ai_analyzer.generate_response_message(analyses[index], job.video_info))
+            self.send_reply(bot, processing_msg.chat_id, "\n\n".join(sections), processing_msg)
+            log_event('video', "Successfully processed batch of %d videos", len(jobs),
+                      chat_id=batch.chat_id, seconds=round(time.monotonic() - batch.enqueued_at, 3))
         except Exception as e:
-            logger.error(f"Error downloading Telegram file: {e}")
+            logger.error(f"Error processing video batch: {e}")
+            self.update_processing_message(bot, processing_msg, f"❌ Error processing videos: {str(e)}")
+        finally:
+            for index, job in enumerate(jobs):
+                if errors[index]:
+                    self.record(job, 'failed', error=errors[index])
+                else:
+                    self.record(job, 'done')
+                metrics.videos.inc(outcome='failed' if errors[index] else 'processed')
+                self.cleanup_job_files(job)
+            metrics.stage_seconds.observe(time.monotonic() - batch.enqueued_at, stage='total')
+
+    def send_reply(self, bot, chat_id: int, text: str, processing_msg=None):
+        """Deliver a result, spilling into follow-up messages past Telegram's limit"""
+        chunks = split_message(text)
+        if processing_msg:
+            self.update_processing_message(bot, processing_msg, chunks.pop(0))
+        for chunk in chunks:
+            self.outbound.send_message(bot, chat_id, chunk, parse_mode='Markdown')
+
+    async def fetch_thumbnail(self, video_file, bot) -> Optional[str]:
+        """Download Telegram's own thumbnail if it is large enough to analyze"""
+        thumbnail = getattr(video_file, 'thumbnail', None)
+        if not thumbnail:
             return None
+        if max(thumbnail.width or 0, thumbnail.height or 0) < self.config.THUMBNAIL_MIN_SIZE:
+            log_debug('pipeline', "Thumbnail too small (%sx%s), using full download", thumbnail.width, thumbnail.height)
+            return None
+        destination = self.video_processor.allocate_thumbnail_path(str(video_file.file_id))
+        async with self.job_queue.stage('download'):
+            path = await self.download_telegram_file(thumbnail, bot, destination)
+        if path and path != destination:
+            # A local Bot API server owns its copy; the pipeline writes payloads next to
+            # the cover and sweeps it later, so keep our own in IMAGES_DIR
+            try:
+                await asyncio.to_thread(shutil.copyfile, path, destination)
+            except OSError as e:
+                logger.error(f"Error copying thumbnail from the Bot API server: {e}")
+                return None
+            path = destination
+        return path
 
-    async def update_processing_message(self, bot, message, new_text: str):
+    @metrics.timed('download')
+    async def download_telegram_file(self, file, bot, destination: Optional[str] = None) -> Optional[str]:
+        """Download a file to ``destination``, or return the path a local Bot API server stored it at"""
         try:
-            await bot.edit_message_text(
-                chat_id=message.chat_id,
-                message_id=message.message_id,
-                text=new_text,
-                parse_mode='Markdown'
-            )
+            # A local Bot API server fetches the file itself before answering
+            file_obj = await bot.get_file(file.file_id, read_timeout=self.config.TELEGRAM_FILE_TIMEOUT_SECONDS)
+            if self.config.TELEGRAM_LOCAL_MODE and file_obj.file_path and os.path.isfile(file_obj.file_path):
+                metrics.bytes.inc(os.path.getsize(file_obj.file_path), kind='opened_in_place')
+                log_debug('pipeline', "Using file in place at %s", file_obj.file_path)
+                return file_obj.file_path
+            if destination:
+                file_path = destination
+            else:
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
+                    file_path = tmp_file.name
+            # Write to a partial file and rename so readers never see a truncated video
+            partial_path = f"{file_path}.part"
+            # Stream in fixed-size chunks so memory stays flat however large the video is
+            async with self.file_client.stream('GET', file_obj.file_path) as response:
+                response.raise_for_status()
+                async with aiofiles.open(partial_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+            os.replace(partial_path, file_path)
+            metrics.bytes.inc(os.path.getsize(file_path), kind='downloaded')
+            log_debug('pipeline', "Downloaded file to %s", file_path)
+            return file_path
         except Exception as e:
-            logger.error(f"Error updating processing message: {e}") 
\ No newline at end of file
+            logger.error(f"Error downloading Telegram file: {e}")
+            if 'partial_path' in locals() and os.path.exists(partial_path):
+                os.remove(partial_path)
+            return None
+
+    def update_processing_message(self, bot, message, new_text: str, final: bool = True):
+        """Queue an edit of the processing message; intermediate statuses may be coalesced"""
+        self.outbound.edit_message(
+            bot,
+            message.chat_id,
+            message.message_id,
+            new_text,
+            final=final,
+            parse_mode='Markdown'
+        )
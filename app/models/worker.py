@@ -0,0 +1,162 @@
+import asyncio
+import signal
+from typing import Any, Dict, List, Optional, Set
+import httpx
+from app.config import Config
+from app.services.group_registry import GroupSettings
+from app.services.job_queue import BatchJob, VideoJob
+from app.services.job_store import MessageRef, StoredFile
+from app.services.shared_queue import QueueClient
+from app.utils.logger import log_event, logger
+
+class QueueWorker:
+    """Worker process loop: lease jobs from the ingest process and run the pipeline
+
+    Up to WORKER_COUNT job groups run at once. Leases are renewed while a job
+    runs; if this process dies, its jobs are handed to another worker once
+    their lease expires. Progress is reported back through RemoteJobStore,
+    and replies go straight to Telegram with this process's own Bot client.
+    SIGTERM or SIGINT stops leasing, cancels running jobs and hands their
+    leases back, so another worker takes them over without losing an attempt.
+    """
+
+    LEASE_WAIT_SECONDS = 20.0
+
+    def __init__(self, bot, client: QueueClient):
+        self.bot = bot
+        self.client = client
+        self.lease_seconds = Config.QUEUE_LEASE_SECONDS
+        self.retry_seconds = Config.QUEUE_RETRY_SECONDS
+        self.slots = asyncio.Semaphore(Config.WORKER_COUNT)
+        self.held: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self.stopping = False
+
+    async def run(self):
+        """Serve jobs until cancelled"""
+        application = self.bot.application
+        await application.initialize()
+        self.bot.job_store.start()
+        await self.bot.metrics_server.start()
+        await self.bot.storage.start()
+        heartbeat = asyncio.create_task(self._heartbeat(), name="lease-heartbeat")
+        lease_loop = asyncio.create_task(self._lease_loop(), name="lease-loop")
+        self._handle_signals(lease_loop)
+        logger.info(f"Worker {self.client.worker_id} serving {self.client.url} with {Config.WORKER_COUNT} slots")
+        try:
+            await lease_loop
+        except asyncio.CancelledError:
+            if not self.stopping:
+                raise
+            logger.info(f"Worker {self.client.worker_id} stopping")
+        finally:
+            lease_loop.cancel()
+            heartbeat.cancel()
+            held = list(self.held)
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(heartbeat, *self.tasks, return_exceptions=True)
+            # Stage updates go first, so the next worker resumes from the latest stage
+            await self.bot.job_store.flush(timeout=5.0)
+            if held:
+                try:
+                    await self.client.release(held)
+                except httpx.HTTPError as e:
+                    logger.warning(f"Error releasing job leases: {e}")
+            self.bot.job_store.close()
+            await self.client.close()
+            await self.bot.storage.stop()
+            await self.bot.metrics_server.stop()
+            await self.bot.outbound.stop()
+            await self.bot.ai_analyzer.close()
+            await self.bot.file_client.aclose()
+            self.bot.analysis_cache.close()
+            await application.shutdown()
+
+    def _handle_signals(self, lease_loop: asyncio.Task):
+        """Stop on SIGTERM/SIGINT by cancelling the lease loop instead of exiting on the spot"""
+        def stop():
+            self.stopping = True
+            lease_loop.cancel()
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows event loops have no signal handlers
+                pass
+
+    async def _lease_loop(self):
+        while True:
+            await self.slots.acquire()
+            try:
+                records = await self.client.lease(self.LEASE_WAIT_SECONDS)
+            except httpx.HTTPError as e:
+                self.slots.release()
+                logger.warning(f"Error leasing jobs from {self.client.url}: {e}")
+                await asyncio.sleep(self.retry_seconds)
+                continue
+            job = self.build_job(records) if records else None
+            if job is None:
+                self.slots.release()
+                continue
+            keys = [record['job_key'] for record in records]
+            self.held.update(keys)
+            task = asyncio.create_task(self._execute(job, keys))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def build_job(self, records: List[Dict[str, Any]]) -> Optional[Any]:
+        """VideoJob or BatchJob for job records leased together"""
+        settings = records[0].get('group')
+        if settings is None:
+            for record in records:
+                self.bot.job_store.advance(record['chat_id'], record['message_id'], 'failed', error='not a target group')
+            return None
+        group = GroupSettings(**settings)
+        bot = self.bot.application.bot
+        processing_msg = MessageRef(records[0]['chat_id'], records[0]['processing_message_id'])
+        jobs = [
+            VideoJob(
+                chat_id=record['chat_id'],
+                message_id=record['message_id'],
+                video_file=StoredFile.from_record(record),
+                video_info=record['video_info'],
+                bot=bot,
+                processing_msg=processing_msg,
+                media_group_id=record['media_group_id'],
+                group=group,
+                video_path=record['video_path'],
+                image_path=record['image_path'],
+                analysis=record['analysis']
+            )
+            for record in records
+        ]
+        if any(record['attempts'] for record in records):
+            log_event('video', "Resuming job %s from stage %s", records[0]['job_key'], records[0]['stage'],
+                      chat_id=group.chat_id)
+            self.bot.update_processing_message(bot, processing_msg, "🔄 Resuming after restart... Please wait.", final=False)
+        if len(jobs) == 1:
+            return jobs[0]
+        return BatchJob(chat_id=jobs[0].chat_id, jobs=jobs, bot=bot, processing_msg=processing_msg, group=group)
+
+    async def _execute(self, job: Any, keys: List[str]):
+        try:
+            await self.bot.process_video_job(job)
+        except Exception as e:
+            logger.error(f"Worker failed on job for chat {job.chat_id}: {e}")
+        finally:
+            self.held.difference_update(keys)
+            self.slots.release()
+
+    async def _heartbeat(self):
+        """Renew leases well before they expire"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not self.held:
+                continue
+            try:
+                await self.client.renew(list(self.held))
+            except httpx.HTTPError as e:
+                logger.warning(f"Error renewing job leases: {e}")
@@ -0,0 +1,87 @@
+import mimetypes
+import os
+from typing import Any, Dict, Optional
+from app.config import Config
+from app.utils.logger import log_event
+
+# Telegram reports MIME types; SUPPORTED_VIDEO_FORMATS lists container extensions
+MIME_EXTENSIONS = {
+    'video/mp4': 'mp4',
+    'video/x-msvideo': 'avi',
+    'video/avi': 'avi',
+    'video/quicktime': 'mov',
+    'video/x-matroska': 'mkv',
+    'video/webm': 'webm',
+}
+
+class AdmissionPolicy:
+    """Decide from Telegram metadata alone whether a video is worth downloading"""
+
+    REASONS = ('size', 'duration', 'format', 'resolution')
+
+    def __init__(self):
+        self.max_size_bytes = Config.MAX_VIDEO_SIZE_MB * 1024 * 1024
+        self.max_duration = Config.MAX_VIDEO_DURATION_SECONDS
+        self.max_dimension = Config.MAX_VIDEO_DIMENSION
+        self.supported_formats = {fmt.strip().lower().lstrip('.') for fmt in Config.SUPPORTED_VIDEO_FORMATS if fmt.strip()}
+        self.rejections: Dict[str, int] = {reason: 0 for reason in self.REASONS}
+        self.admitted = 0
+
+    def _video_format(self, video_file: Any) -> Optional[str]:
+        """Best guess at the container format, or None when Telegram doesn't say"""
+        file_name = getattr(video_file, 'file_name', None)
+        if file_name:
+            extension = os.path.splitext(file_name)[1].lower().lstrip('.')
+            if extension:
+                return extension
+        mime_type = getattr(video_file, 'mime_type', None)
+        if mime_type:
+            mime_type = mime_type.lower()
+            if mime_type in MIME_EXTENSIONS:
+                return MIME_EXTENSIONS[mime_type]
+            guessed = mimetypes.guess_extension(mime_type)
+            return guessed.lstrip('.') if guessed else mime_type.split('/')[-1]
+        return None
+
+    def check(self, video_file: Any, group: Any = None) -> Optional[str]:
+        """Return a user-facing rejection message, or None if the video is admitted
+
+        ``group`` may override the size and duration limits for its chat.
+        """
+        reason, message = None, None
+        max_size_mb = getattr(group, 'max_video_size_mb', None) or Config.MAX_VIDEO_SIZE_MB
+        # Bot API servers refuse to hand out larger files
+        max_size_mb = min(max_size_mb, Config.TELEGRAM_MAX_DOWNLOAD_MB)
+        max_size_bytes = max_size_mb * 1024 * 1024
+        max_duration = getattr(group, 'max_video_duration_seconds', None) or self.max_duration
+
+        file_size = getattr(video_file, 'file_size', None)
+        duration = getattr(video_file, 'duration', None)
+        width = getattr(video_file, 'width', None) or getattr(video_file, 'length', None)
+        height = getattr(video_file, 'height', None) or getattr(video_file, 'length', None)
+        video_format = self._video_format(video_file)
+
+        if file_size and file_size > max_size_bytes:
+            reason = 'size'
+            message = f"❌ Video too large: {file_size / (1024 * 1024):.2f}MB > {max_size_mb}MB"
+        elif max_duration and duration and duration > max_duration:
+            reason = 'duration'
+            message = f"❌ Video too long: {duration}s > {max_duration}s"
+        elif video_format and self.supported_formats and video_format not in self.supported_formats:
+            reason = 'format'
+            message = f"❌ Unsupported video format: {video_format}"
+        elif self.max_dimension and width and height and max(width, height) > self.max_dimension:
+            reason = 'resolution'
+            message = f"❌ Video resolution too high: {width}x{height}"
+
+        if reason:
+            self.rejections[reason] += 1
+            log_event('video', "Rejected video %s before download: %s",
+                      getattr(video_file, 'file_id', '?'), reason, reason=reason)
+            return message
+        self.admitted += 1
+        return None
+
+    def stats(self) -> dict:
+        """Admission and per-reason rejection counters"""
+        return {'admitted': self.admitted, 'rejected': dict(self.rejections)}
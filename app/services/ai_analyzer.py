@@ -1,41 +1,25 @@
+import asyncio
 import base64
+import hashlib
 import os
-from typing import Optional
-from openai import OpenAI
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI
+from openai.types import CompletionUsage
 from app.config import Config
-from app.utils.logger import logger
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.metrics import metrics
+from app.services.resilience import ResilientCaller
+from app.services.usage_ledger import UsageLedger, cached_tokens
+from app.utils.logger import log_debug, log_event, logger
 
-class AIAnalyzer:
-    """Service for analyzing images using OpenAI's GPT-4 Vision"""
-    
-    def __init__(self):
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
-        self.model = "gpt-4o"
-    
-    def encode_image_to_base64(self, image_path: str) -> Optional[str]:
-        """Encode image to base64 for OpenAI API"""
-        try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
-        except Exception as e:
-            logger.error(f"Error encoding image to base64: {e}")
-            return None
-    
-    async def analyze_image(self, image_path: str) -> Optional[str]:
-        """Analyze image using GPT-4 Vision and return analysis"""
-        try:
-            # Check if image exists
-            if not os.path.exists(image_path):
-                logger.error(f"Image file not found: {image_path}")
-                return None
-            
-            # Encode image
-            base64_image = self.encode_image_to_base64(image_path)
-            if not base64_image:
-                return None
-            
-            # Prepare the analysis prompt for 小红书 content generation
-            analysis_prompt = """
+# The API scales the short side of high-detail images to 768 px
+CONTACT_SHEET_SHORT_SIDE = 768
+
+# Prepare the analysis prompt for 小红书 content generation
+ANALYSIS_PROMPT = """
             你是 sgdaily (新加坡每日推荐) 博主助理，主要工作是写小红书文案。
             
             请分析这个视频封面图片，并生成3-4个不同风格的小红书文案版本。要求：
@@ -64,40 +48,293 @@ class AIAnalyzer:
             - 文案要分段清晰
             
             请生成3-4个不同版本的文案，每个都要有标题、正文、互动话题和话题标签。
+"""
+
+CONTACT_SHEET_PROMPT = """
+            注意：这张图片不是单张封面，而是从同一个视频中按时间顺序截取的画面拼成的 {rows} 行 × {columns} 列网格，
+            每个画面左上角标有序号，按从左到右、从上到下的顺序播放。请结合所有画面理解整个视频的内容再写文案。
             """
+
+BATCH_PROMPT = """
+            下面依次给出 {count} 个不同视频的封面，每张封面前都标有 "=== 视频 N ===" 。
+            请分别为每个视频完成系统指令中的任务，并在每个视频的文案前原样输出对应的 "=== 视频 N ===" 标记。
+            """
+
+BATCH_MARKER = "=== 视频 {index} ==="
+BATCH_MAX_TOKENS = 4000
+# Reply length the per-attempt deadline is sized for; longer replies get proportionally longer
+DEADLINE_MAX_TOKENS = 1000
+
+def split_batch_reply(reply: str, count: int) -> Optional[List[str]]:
+    """Split a multi-video reply on its "=== 视频 N ===" markers"""
+    sections = re.split(r'=+\s*视频\s*(\d+)\s*=+', reply or '')
+    analyses = {}
+    for index in range(1, len(sections) - 1, 2):
+        text = sections[index + 1].strip()
+        if text:
+            analyses[int(sections[index])] = text
+    if sorted(analyses) != list(range(1, count + 1)):
+        return None
+    return [analyses[index] for index in range(1, count + 1)]
+
+class AIAnalyzer:
+    """Service for analyzing images using OpenAI's GPT-4 Vision"""
+    
+    def __init__(self):
+        # Shared connection pool so concurrent analyses reuse keep-alive connections
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=Config.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.OPENAI_MAX_CONNECTIONS,
+                keepalive_expiry=Config.OPENAI_KEEPALIVE_SECONDS
+            ),
+            timeout=httpx.Timeout(Config.OPENAI_TIMEOUT_SECONDS, connect=10.0)
+        )
+        self.client = AsyncOpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL,
+            http_client=self.http_client,
+            # Retries are handled by the call policy below
+            max_retries=0
+        )
+        self.model = Config.OPENAI_MODEL
+        self.caller = ResilientCaller(self.model, Config.OPENAI_FALLBACK_MODEL)
+        # Used for groups that are close to their daily token budget
+        self.economy_caller = ResilientCaller(Config.BUDGET_ECONOMY_MODEL) if Config.BUDGET_ECONOMY_MODEL else self.caller
+        self.economy_detail = Config.BUDGET_ECONOMY_DETAIL
+        self.ledger = UsageLedger()
+        # Calls per static instruction prefix, to see how often the cacheable prefix is reused
+        self.prefix_calls: Dict[str, int] = {}
+        self.request_limit = asyncio.Semaphore(Config.OPENAI_MAX_IN_FLIGHT)
+        self.preprocessor = ImagePreprocessor() if Config.IMAGE_PREPROCESS else None
+    
+    async def close(self):
+        """Close the pooled HTTP connections and the usage ledger"""
+        await self.http_client.aclose()
+        self.ledger.close()
+    
+    def encode_image_to_base64(self, image_path: str) -> Optional[str]:
+        """Encode image to base64 for OpenAI API"""
+        try:
+            with open(image_path, "rb") as image_file:
+                return base64.b64encode(image_file.read()).decode('utf-8')
+        except Exception as e:
+            logger.error(f"Error encoding image to base64: {e}")
+            return None
+    
+    @metrics.timed('encode')
+    async def _image_part(self, image_path: str, short_side: Optional[int] = None,
+                          detail: Optional[str] = None) -> Optional[dict]:
+        """Build the image_url content part for one image"""
+        # Check if image exists
+        if not os.path.exists(image_path):
+            logger.error(f"Image file not found: {image_path}")
+            return None
+        
+        # Encode image, downscaled to the model's tile grid when enabled
+        detail = detail or 'auto'
+        if self.preprocessor:
+            payload = await asyncio.to_thread(self.preprocessor.prepare, image_path, short_side, detail)
+            base64_image, detail = payload if payload else (None, detail)
+        else:
+            base64_image = await asyncio.to_thread(self.encode_image_to_base64, image_path)
+        if not base64_image:
+            return None
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{base64_image}",
+                "detail": detail
+            }
+        }
+    
+    @metrics.timed('openai')
+    async def _complete(self, content: List[dict], max_tokens: int = 1000,
+                        on_text: Optional[Callable[[str], None]] = None, instructions: str = ANALYSIS_PROMPT,
+                        group_key: Optional[str] = None, economy: bool = False) -> str:
+        """Send one user message to the chat completions API and return the reply text
+
+        The static ``instructions`` go first as the system message so every
+        request for a group starts with the same prefix, which the API can
+        serve from its prompt cache; only the user message varies. With
+        ``on_text`` the reply is streamed and each new piece of text is
+        passed to it as it arrives. Usage is recorded against ``group_key``.
+        The attempt deadline grows with ``max_tokens`` beyond DEADLINE_MAX_TOKENS.
+        """
+        request = dict(
+            messages=[
+                {
+                    "role": "system",
+                    "content": instructions
+                },
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            max_tokens=max_tokens,
+            temperature=0.7
+        )
+        prefix = hashlib.sha1(instructions.encode('utf-8')).hexdigest()[:12]
+        self.prefix_calls[prefix] = self.prefix_calls.get(prefix, 0) + 1
+        caller = self.economy_caller if economy else self.caller
+        models = []
+        streamed = []
+        
+        def show(delta: str):
+            streamed.append(delta)
+            on_text(delta)
+        
+        async def attempt(model: str):
+            models.append(model)
+            if on_text:
+                return await self._stream(dict(request, model=model), show)
+            response = await self.client.chat.completions.create(**request, model=model)
+            return response.choices[0].message.content, response.usage
+        
+        async with self.request_limit:
+            # Streamed text is already on screen, so it is never hedged or repeated by a retry
+            reply, usage = await caller.call(
+                attempt, hedge=not on_text, can_retry=lambda: not streamed,
+                timeout_scale=max(1.0, max_tokens / DEADLINE_MAX_TOKENS)
+            )
+        if usage:
+            metrics.tokens.inc(usage.prompt_tokens, kind='prompt')
+            metrics.tokens.inc(usage.completion_tokens, kind='completion')
+            self.ledger.record(group_key, models[-1], usage)
+        images = sum(1 for part in content if part.get('type') == 'image_url')
+        log_event(
+            'video', "Completion received (%d image(s), %s prompt tokens)",
+            images, usage.prompt_tokens if usage else '?',
+            images=images,
+            model=models[-1],
+            group=group_key,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+            cached_tokens=cached_tokens(usage) if usage else None
+        )
+        return reply
+    
+    async def _stream(self, request: dict, on_text: Callable[[str], None]):
+        """Stream a completion, returning the full reply text and its usage"""
+        started = time.perf_counter()
+        stream = await self.client.chat.completions.create(
+            **request,
+            stream=True,
+            # Ask for a final usage chunk so token accounting still works
+            extra_body={"stream_options": {"include_usage": True}}
+        )
+        parts = []
+        usage = None
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+                # Older client versions leave the field as an untyped dict
+                if isinstance(usage, dict):
+                    usage = CompletionUsage.construct(**usage)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if not parts:
+                metrics.stage_seconds.observe(time.perf_counter() - started, stage='openai_first_token')
+            parts.append(delta)
+            on_text(delta)
+        return ''.join(parts), usage
+    
+    async def analyze_image(self, image_path: str, layout: Optional[Tuple[int, int]] = None,
+                            prompt: Optional[str] = None,
+                            on_text: Optional[Callable[[str], None]] = None,
+                            group_key: Optional[str] = None, economy: bool = False) -> Optional[str]:
+        """Analyze image using GPT-4 Vision and return analysis
+
+        ``layout`` is the (rows, columns) grid when the image is a contact sheet
+        of frames rather than a single cover. ``prompt`` replaces the default
+        analysis prompt, e.g. for a group with its own house style. ``on_text``
+        streams the reply, receiving each new piece of text as it is generated.
+        Usage is charged to ``group_key``; ``economy`` switches to the cheaper
+        model and image detail used once a group nears its budget.
+        """
+        try:
+            # Contact sheets need more pixels per frame than a single cover
+            image_part = await self._image_part(
+                image_path, CONTACT_SHEET_SHORT_SIDE if layout else None, self.economy_detail if economy else None
+            )
+            if not image_part:
+                return None
+            
+            content = [image_part]
+            if layout:
+                rows, columns = layout
+                content.insert(0, {"type": "text", "text": CONTACT_SHEET_PROMPT.format(rows=rows, columns=columns)})
             
             # Make API call
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": analysis_prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000,
-                temperature=0.7
+            analysis = await self._complete(
+                content, on_text=on_text, instructions=prompt or ANALYSIS_PROMPT,
+                group_key=group_key, economy=economy
             )
-            
-            analysis = response.choices[0].message.content
-            logger.info(f"Image analysis completed successfully")
+            log_debug('pipeline', "Image analysis completed successfully")
             return analysis
             
         except Exception as e:
             logger.error(f"Error analyzing image: {e}")
             return None
     
+    async def analyze_images(self, image_paths: List[str], layouts: Optional[List[Optional[Tuple[int, int]]]] = None,
+                             prompt: Optional[str] = None, group_key: Optional[str] = None,
+                             economy: bool = False) -> Optional[List[Optional[str]]]:
+        """Analyze several covers in one request and return one analysis per cover
+
+        ``layouts`` gives each cover's (rows, columns) grid, or None, as for
+        ``analyze_image``. If the reply cannot be split into one section per
+        cover, each cover is analyzed on its own instead; a cover whose
+        analysis fails gets None.
+        """
+        try:
+            layouts = layouts or [None] * len(image_paths)
+            if len(image_paths) == 1:
+                analysis = await self.analyze_image(
+                    image_paths[0], layouts[0], prompt=prompt, group_key=group_key, economy=economy
+                )
+                return [analysis] if analysis else None
+            
+            detail = self.economy_detail if economy else None
+            # Contact sheets need more pixels per frame than a single cover
+            image_parts = await asyncio.gather(*(
+                self._image_part(path, CONTACT_SHEET_SHORT_SIDE if layout else None, detail)
+                for path, layout in zip(image_paths, layouts)
+            ))
+            if not all(image_parts):
+                return None
+            
+            content = [{"type": "text", "text": BATCH_PROMPT.format(count=len(image_paths))}]
+            for index, (image_part, layout) in enumerate(zip(image_parts, layouts), start=1):
+                content.append({"type": "text", "text": BATCH_MARKER.format(index=index)})
+                if layout:
+                    rows, columns = layout
+                    content.append({"type": "text", "text": CONTACT_SHEET_PROMPT.format(rows=rows, columns=columns)})
+                content.append(image_part)
+            
+            # Make API call
+            reply = await self._complete(
+                content, max_tokens=min(1000 * len(image_paths), BATCH_MAX_TOKENS),
+                instructions=prompt or ANALYSIS_PROMPT, group_key=group_key, economy=economy
+            )
+            analyses = split_batch_reply(reply, len(image_paths))
+            if not analyses:
+                logger.warning("Batch reply did not contain one section per video, analyzing each separately")
+                analyses = await asyncio.gather(*(
+                    self.analyze_image(path, layout, prompt=prompt, group_key=group_key, economy=economy)
+                    for path, layout in zip(image_paths, layouts)
+                ))
+                return analyses if any(analyses) else None
+            log_debug('pipeline', "Batch analysis of %d images completed successfully", len(image_paths))
+            return analyses
+            
+        except Exception as e:
+            logger.error(f"Error analyzing images: {e}")
+            return None
+    
+    @metrics.timed('format')
     async def generate_response_message(self, analysis: str, video_info: dict = None) -> str:
         """Generate a formatted response message for Telegram with 小红书 content"""
         try:
@@ -129,6 +366,7 @@ class AIAnalyzer:
             logger.error(f"Error generating response message: {e}")
             return "❌ Error generating analysis report."
     
+    @metrics.timed('insights')
     async def get_video_insights(self, image_path: str, video_info: dict = None) -> Optional[str]:
         """Get comprehensive video insights from cover image"""
         try:
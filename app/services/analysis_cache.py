@@ -0,0 +1,244 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from app.config import Config
+from app.services.metrics import metrics
+from app.services.perceptual_index import HASH_BITS, PerceptualIndex
+from app.utils.logger import logger
+
+def _to_signed(value: int) -> int:
+    """Map an unsigned 64-bit hash onto SQLite's signed INTEGER range"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+def _key(kind: str, value: str, namespace: Optional[str] = None) -> str:
+    """Cache key; analyses made with a custom prompt live in their own namespace"""
+    return f"{namespace}/{kind}:{value}" if namespace else f"{kind}:{value}"
+
+def _namespace_of(key: str) -> Optional[str]:
+    prefix = key.split(':', 1)[0]
+    return prefix.rsplit('/', 1)[0] if '/' in prefix else None
+
+class AnalysisCache:
+    """Persistent SQLite cache of AI analyses keyed on Telegram file ids and cover hashes"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(Config.DATABASE_DIR, 'analysis_cache.db')
+        self.ttl_seconds = Config.CACHE_TTL_HOURS * 3600
+        self.max_entries = Config.CACHE_MAX_ENTRIES
+        self.hits: Dict[str, int] = {'file_id': 0, 'cover_hash': 0, 'phash': 0}
+        self.misses: Dict[str, int] = {'file_id': 0, 'cover_hash': 0, 'phash': 0}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            '''CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                analysis TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )'''
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_analyses_accessed ON analyses (accessed_at)')
+        # Each namespace keeps its own row for a hash ('' is the default namespace)
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(cover_phashes)')}
+        legacy = []
+        if columns and 'namespace' not in columns:
+            legacy = self.conn.execute('SELECT phash, key FROM cover_phashes').fetchall()
+            self.conn.execute('DROP TABLE cover_phashes')
+        self.conn.execute(
+            '''CREATE TABLE IF NOT EXISTS cover_phashes (
+                phash INTEGER NOT NULL,
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (phash, namespace)
+            )'''
+        )
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO cover_phashes (phash, namespace, key) VALUES (?, ?, ?)',
+            [(phash, _namespace_of(key) or '', key) for phash, key in legacy]
+        )
+        self.conn.commit()
+
+        # Near-duplicate indexes, one per namespace so a search only sees matches
+        # it may use; rebuilt from disk on startup
+        self.phash_enabled = Config.PHASH_ENABLED
+        self.max_distance = int(HASH_BITS * (1 - Config.PHASH_SIMILARITY))
+        self.phash_indexes: Dict[Optional[str], PerceptualIndex] = {}
+        if self.phash_enabled:
+            count = 0
+            for phash, namespace, key in self.conn.execute('SELECT phash, namespace, key FROM cover_phashes'):
+                self._phash_index(namespace or None).add(_to_unsigned(phash), key)
+                count += 1
+            logger.info(f"Loaded {count} perceptual hashes (max distance {self.max_distance})")
+
+    def _phash_index(self, namespace: Optional[str]) -> PerceptualIndex:
+        index = self.phash_indexes.get(namespace)
+        if index is None:
+            index = self.phash_indexes[namespace] = PerceptualIndex(self.max_distance)
+        return index
+
+    @staticmethod
+    def hash_file(path: str) -> Optional[str]:
+        """Return the SHA-256 hex digest of a file's contents"""
+        try:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            return digest.hexdigest()
+        except Exception as e:
+            logger.error(f"Error hashing file {path}: {e}")
+            return None
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT analysis, created_at FROM analyses WHERE key = ?', (key,)
+            ).fetchone()
+            if not row:
+                return None
+            analysis, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self.conn.execute('DELETE FROM analyses WHERE key = ?', (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute('UPDATE analyses SET accessed_at = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            return analysis
+
+    def _lookup(self, kind: str, value: Optional[str], namespace: Optional[str] = None) -> Optional[str]:
+        if not value:
+            return None
+        try:
+            analysis = self._get(_key(kind, value, namespace))
+        except Exception as e:
+            logger.error(f"Error reading analysis cache: {e}")
+            analysis = None
+        if analysis is None:
+            self.misses[kind] += 1
+        else:
+            self.hits[kind] += 1
+        metrics.cache_lookups.inc(kind=kind, result='miss' if analysis is None else 'hit')
+        return analysis
+
+    def get_by_file_id(self, file_unique_id: Optional[str], namespace: Optional[str] = None) -> Optional[str]:
+        """Look up a cached analysis by Telegram file_unique_id"""
+        return self._lookup('file_id', file_unique_id, namespace)
+
+    def get_by_cover_hash(self, cover_hash: Optional[str], namespace: Optional[str] = None) -> Optional[str]:
+        """Look up a cached analysis by the content hash of the cover image"""
+        return self._lookup('cover_hash', cover_hash, namespace)
+
+    def get_near_duplicate(self, phash: Optional[int], namespace: Optional[str] = None) -> Optional[str]:
+        """Look up a cached analysis whose cover is perceptually similar"""
+        if phash is None or not self.phash_enabled:
+            return None
+        analysis = None
+        index = self.phash_indexes.get(namespace)
+        match = index.nearest(phash) if index else None
+        if match:
+            matched_hash, key, distance = match
+            try:
+                analysis = self._get(key)
+                if analysis is None:
+                    # The analysis behind this hash expired or was evicted
+                    self._drop_phash(matched_hash, key)
+            except Exception as e:
+                logger.error(f"Error reading analysis cache: {e}")
+            if analysis is not None:
+                logger.info(f"Near-duplicate cover found (distance {distance})")
+        if analysis is None:
+            self.misses['phash'] += 1
+        else:
+            self.hits['phash'] += 1
+        metrics.cache_lookups.inc(kind='phash', result='miss' if analysis is None else 'hit')
+        return analysis
+
+    def _drop_phash(self, phash: int, key: str):
+        namespace = _namespace_of(key)
+        self._phash_index(namespace).remove(phash)
+        with self._lock:
+            self.conn.execute(
+                'DELETE FROM cover_phashes WHERE phash = ? AND namespace = ?', (_to_signed(phash), namespace or '')
+            )
+            self.conn.commit()
+
+    def put(self, analysis: str, file_unique_id: Optional[str] = None, cover_hash: Optional[str] = None,
+            phash: Optional[int] = None, namespace: Optional[str] = None):
+        """Store an analysis under every key that is known for the video"""
+        keys = []
+        if file_unique_id:
+            keys.append(_key('file_id', file_unique_id, namespace))
+        if cover_hash:
+            keys.append(_key('cover_hash', cover_hash, namespace))
+        if not keys:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO analyses (key, analysis, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                    [(key, analysis, now, now) for key in keys]
+                )
+                if phash is not None and self.phash_enabled:
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO cover_phashes (phash, namespace, key) VALUES (?, ?, ?)',
+                        (_to_signed(phash), namespace or '', keys[-1])
+                    )
+                    self._phash_index(namespace).add(phash, keys[-1])
+                self._evict(now)
+                self.conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing analysis cache: {e}")
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the least recently used ones above the size limit
+
+        Perceptual hashes pointing at evicted analyses are dropped in the same
+        pass, from both the table and the in-memory index.
+        """
+        evicted = 0
+        if self.ttl_seconds:
+            evicted += self.conn.execute(
+                'DELETE FROM analyses WHERE created_at < ?', (now - self.ttl_seconds,)
+            ).rowcount
+        if self.max_entries:
+            evicted += self.conn.execute(
+                '''DELETE FROM analyses WHERE key IN (
+                    SELECT key FROM analyses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )''',
+                (self.max_entries,)
+            ).rowcount
+        if not evicted:
+            return
+        orphans = self.conn.execute(
+            '''SELECT phash, namespace FROM cover_phashes
+               WHERE NOT EXISTS (SELECT 1 FROM analyses WHERE analyses.key = cover_phashes.key)'''
+        ).fetchall()
+        for phash, namespace in orphans:
+            self._phash_index(namespace or None).remove(_to_unsigned(phash))
+        self.conn.executemany('DELETE FROM cover_phashes WHERE phash = ? AND namespace = ?', orphans)
+
+    def stats(self) -> dict:
+        """Hit/miss counters per key type"""
+        return {
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'hit_total': sum(self.hits.values()),
+            'miss_total': sum(self.misses.values()),
+        }
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,66 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, List, Set
+from app.config import Config
+from app.services.job_queue import VideoJob
+from app.utils.logger import logger
+
+class Coalescer:
+    """Group the videos of an album into a single batch
+
+    Videos sharing a ``media_group_id`` are grouped together and flushed when
+    the wait window closes or the batch reaches the maximum size. A video
+    sent on its own has nothing to wait for and is flushed immediately.
+    """
+
+    def __init__(self, flush: Callable[[List[VideoJob]], Awaitable[None]]):
+        self.flush = flush
+        self.window = Config.COALESCE_WINDOW_SECONDS
+        self.max_batch = Config.COALESCE_MAX_BATCH
+        self.pending: Dict[Hashable, List[VideoJob]] = {}
+        self.timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        # The loop only keeps weak references to tasks; hold flushes until they finish
+        self.tasks: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    async def add(self, job: VideoJob, media_group_id: str = None):
+        """Buffer a job until its batch is flushed"""
+        if not self.enabled or not media_group_id:
+            await self.flush([job])
+            return
+        key = (job.chat_id, media_group_id)
+        batch = self.pending.setdefault(key, [])
+        batch.append(job)
+        if len(batch) >= self.max_batch:
+            await self._flush_key(key)
+            return
+        # Each new arrival extends the window so a slow album upload stays together
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self.timers[key] = loop.call_later(self.window, self._schedule_flush, key)
+
+    def _schedule_flush(self, key: Hashable):
+        task = asyncio.create_task(self._flush_key(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _flush_key(self, key: Hashable):
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self.pending.pop(key, None)
+        if not batch:
+            return
+        try:
+            await self.flush(batch)
+        except Exception as e:
+            logger.error(f"Error flushing batch of {len(batch)} videos: {e}")
+
+    async def flush_all(self):
+        """Flush every pending batch immediately"""
+        for key in list(self.pending):
+            await self._flush_key(key)
@@ -0,0 +1,60 @@
+from typing import List, Optional
+import numpy as np
+from PIL import Image
+from app.utils.logger import logger
+
+# Frames are scored on a small copy; relative sharpness survives downscaling
+SCORING_SIZE = (256, 256)
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+def load_frame(image_path: str) -> Optional[np.ndarray]:
+    """Load a candidate frame as a float32 RGB array at scoring resolution"""
+    try:
+        with Image.open(image_path) as image:
+            image.draft('RGB', SCORING_SIZE)
+            image = image.convert('RGB')
+            image.thumbnail(SCORING_SIZE)
+            return np.asarray(image, dtype=np.float32)
+    except Exception as e:
+        logger.error(f"Error loading frame {image_path}: {e}")
+        return None
+
+def frame_metrics(frame: np.ndarray) -> np.ndarray:
+    """Return [sharpness, brightness, colorfulness] for one RGB frame"""
+    gray = frame @ LUMA_WEIGHTS
+    # Variance of the 4-neighbour Laplacian
+    laplacian = (
+        4 * gray[1:-1, 1:-1]
+        - gray[:-2, 1:-1] - gray[2:, 1:-1]
+        - gray[1:-1, :-2] - gray[1:-1, 2:]
+    )
+    sharpness = laplacian.var()
+    brightness = gray.mean()
+    # Hasler & Suesstrunk colorfulness
+    r, g, b = frame[..., 0], frame[..., 1], frame[..., 2]
+    rg = r - g
+    yb = 0.5 * (r + g) - b
+    colorfulness = np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean())
+    return np.array([sharpness, brightness, colorfulness], dtype=np.float64)
+
+def score_frames(frames: List[np.ndarray]) -> np.ndarray:
+    """Score candidate frames; higher is a better cover"""
+    metrics = np.stack([frame_metrics(frame) for frame in frames])
+    sharpness, brightness, colorfulness = metrics.T
+    # Normalise against the best candidate so weights are comparable
+    sharpness_score = sharpness / max(sharpness.max(), 1e-6)
+    colorfulness_score = colorfulness / max(colorfulness.max(), 1e-6)
+    # Prefer mid-tones; near-black and blown-out frames score close to zero
+    brightness_score = np.clip(1 - np.abs(brightness - 128) / 128, 0, 1)
+    scores = 0.45 * sharpness_score + 0.25 * colorfulness_score + 0.30 * brightness_score
+    scores[brightness < 16] = 0
+    return scores
+
+def pick_best_frame(image_paths: List[str]) -> Optional[str]:
+    """Return the path of the highest-scoring candidate"""
+    loaded = [(path, load_frame(path)) for path in image_paths]
+    loaded = [(path, frame) for path, frame in loaded if frame is not None]
+    if not loaded:
+        return None
+    scores = score_frames([frame for _, frame in loaded])
+    return loaded[int(np.argmax(scores))][0]
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from telegram.ext import filters
+from app.config import Config
+from app.utils.logger import logger
+
+@dataclass
+class GroupSettings:
+    """Per-group limits and prompt; unset limits fall back to the global Config"""
+    chat_id: Optional[int] = None
+    username: Optional[str] = None
+    name: Optional[str] = None
+    max_concurrency: int = 0
+    max_video_size_mb: Optional[int] = None
+    max_video_duration_seconds: Optional[int] = None
+    prompt: Optional[str] = None
+    daily_token_budget: Optional[int] = None
+    slots: asyncio.Semaphore = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.username:
+            self.username = self.username.lstrip('@').lower()
+        self.slots = asyncio.Semaphore(self.max_concurrency or Config.WORKER_COUNT)
+
+    @property
+    def label(self) -> str:
+        return self.name or (f"@{self.username}" if self.username else str(self.chat_id))
+
+    @property
+    def key(self) -> str:
+        """Stable identifier for usage accounting"""
+        return f"@{self.username}" if self.username else str(self.chat_id)
+
+    @property
+    def token_budget(self) -> int:
+        return Config.DAILY_TOKEN_BUDGET if self.daily_token_budget is None else self.daily_token_budget
+
+    @property
+    def namespace(self) -> Optional[str]:
+        """Cache namespace, so groups with their own prompt don't share analyses"""
+        if not self.prompt:
+            return None
+        return 'prompt_' + hashlib.sha1(self.prompt.encode('utf-8')).hexdigest()[:12]
+
+class GroupRegistry:
+    """Target groups loaded at startup, with O(1) lookup by chat id
+
+    Groups come from GROUPS_FILE (JSON) when it exists, otherwise from the
+    comma-separated TELEGRAM_GROUP_ID. Groups configured by username are
+    bound to their numeric id the first time a message from them arrives.
+    """
+
+    def __init__(self, groups_file: Optional[str] = None):
+        self.groups_file = groups_file if groups_file is not None else Config.GROUPS_FILE
+        self.by_id: Dict[int, GroupSettings] = {}
+        self.by_username: Dict[str, GroupSettings] = {}
+        self.loaded_mtime: Optional[float] = None
+        self.reload_task: Optional[asyncio.Task] = None
+        self.load()
+
+    def _read_groups(self) -> List[GroupSettings]:
+        if self.groups_file and os.path.exists(self.groups_file):
+            with open(self.groups_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries = data.get('groups', []) if isinstance(data, dict) else data
+            return [GroupSettings(**entry) for entry in entries]
+        groups = []
+        for value in (Config.TELEGRAM_GROUP_ID or '').split(','):
+            value = value.strip()
+            if not value:
+                continue
+            if value.lstrip('-').isdigit():
+                groups.append(GroupSettings(chat_id=int(value)))
+            else:
+                groups.append(GroupSettings(username=value))
+        return groups
+
+    def load(self):
+        """(Re)load the group list, keeping quota semaphores of unchanged groups"""
+        groups = self._read_groups()
+        previous = list(self.by_id.values()) + list(self.by_username.values())
+        by_id: Dict[int, GroupSettings] = {}
+        by_username: Dict[str, GroupSettings] = {}
+        for group in groups:
+            for old in previous:
+                same_group = (
+                    (group.chat_id is not None and old.chat_id == group.chat_id)
+                    or (group.username and old.username == group.username)
+                )
+                if same_group:
+                    # Keep in-flight accounting across reloads when the quota is unchanged
+                    if old.max_concurrency == group.max_concurrency:
+                        group.slots = old.slots
+                    if group.chat_id is None:
+                        group.chat_id = old.chat_id
+                    break
+            if group.chat_id is not None:
+                by_id[group.chat_id] = group
+            if group.username:
+                by_username[group.username] = group
+        self.by_id, self.by_username = by_id, by_username
+        if self.groups_file and os.path.exists(self.groups_file):
+            self.loaded_mtime = os.path.getmtime(self.groups_file)
+        logger.info(f"Loaded {len(groups)} target group(s): {', '.join(group.label for group in groups)}")
+
+    def lookup(self, chat: Any) -> Optional[GroupSettings]:
+        """Return the settings for a chat, or None if it is not a target group"""
+        if chat is None:
+            return None
+        group = self.by_id.get(chat.id)
+        if group is not None:
+            return group
+        username = getattr(chat, 'username', None)
+        if username and self.by_username:
+            group = self.by_username.get(username.lower())
+            if group is not None:
+                # Bind the username to its id so later lookups are a single dict hit
+                group.chat_id = chat.id
+                self.by_id[chat.id] = group
+            return group
+        return None
+
+    def reload_if_changed(self):
+        """Reload GROUPS_FILE if it changed on disk"""
+        if not self.groups_file or not os.path.exists(self.groups_file):
+            return
+        mtime = os.path.getmtime(self.groups_file)
+        if mtime != self.loaded_mtime:
+            try:
+                self.load()
+            except Exception as e:
+                # Keep serving the previous configuration
+                self.loaded_mtime = mtime
+                logger.error(f"Error reloading {self.groups_file}: {e}")
+
+    async def start(self):
+        """Watch GROUPS_FILE for changes"""
+        if self.groups_file and Config.GROUPS_RELOAD_SECONDS > 0:
+            self.reload_task = asyncio.create_task(self._watch(), name="group-registry-reload")
+
+    async def stop(self):
+        if self.reload_task:
+            self.reload_task.cancel()
+            await asyncio.gather(self.reload_task, return_exceptions=True)
+            self.reload_task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(Config.GROUPS_RELOAD_SECONDS)
+            self.reload_if_changed()
+
+    def filter(self) -> filters.MessageFilter:
+        """Handler filter that only lets messages from target groups through"""
+        return _TargetGroupFilter(self)
+
+class _TargetGroupFilter(filters.MessageFilter):
+    def __init__(self, registry: GroupRegistry):
+        super().__init__(name='TargetGroupFilter')
+        self.registry = registry
+
+    def filter(self, message) -> bool:
+        return self.registry.lookup(message.chat) is not None
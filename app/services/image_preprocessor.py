@@ -0,0 +1,105 @@
+import base64
+import io
+import math
+import os
+from typing import Dict, Optional, Tuple
+from PIL import Image
+from app.config import Config
+from app.services.metrics import metrics
+from app.services.storage_manager import mark_used
+from app.utils.logger import log_debug, logger
+
+# GPT-4o vision pricing: a fixed base cost plus a per-512px-tile cost in high detail
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+def estimate_image_tokens(width: int, height: int, detail: str = 'high') -> int:
+    """Estimate the image tokens the vision model bills for an image"""
+    if detail == 'low':
+        return BASE_TOKENS
+    # The API fits the image in 2048x2048, then scales the short side down to 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_TOKENS + TILE_TOKENS * tiles
+
+class ImagePreprocessor:
+    """Resize and re-encode covers before they are sent to the vision model"""
+
+    def __init__(self):
+        self.short_side = Config.IMAGE_TARGET_SHORT_SIDE
+        self.quality = Config.IMAGE_JPEG_QUALITY
+        self.detail = Config.IMAGE_DETAIL
+        self.totals: Dict[str, int] = {
+            'images': 0,
+            'original_bytes': 0,
+            'sent_bytes': 0,
+            'original_tokens': 0,
+            'sent_tokens': 0,
+        }
+
+    def _target_size(self, width: int, height: int, short_side: int, detail: str) -> Tuple[int, int]:
+        """Scale so the short side lands on a tile boundary, never upscaling"""
+        target = TILE_SIZE if detail == 'low' else short_side
+        scale = min(1.0, target / min(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def _payload_path(self, image_path: str, short_side: int, detail: Optional[str] = None) -> str:
+        """Encoded payloads are cached next to the cover, keyed on the settings"""
+        return f"{image_path}.{short_side}_{self.quality}_{detail or self.detail}.b64"
+
+    def prepare(self, image_path: str, short_side: Optional[int] = None,
+                detail: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """Return the base64 JPEG payload and detail level for an image"""
+        try:
+            short_side = short_side or self.short_side
+            # 'auto' is the caller's default; the configured detail applies then
+            detail = detail if detail and detail != 'auto' else self.detail
+            payload_path = self._payload_path(image_path, short_side, detail)
+            if os.path.exists(payload_path) and os.path.getmtime(payload_path) >= os.path.getmtime(image_path):
+                mark_used(payload_path)
+                with open(payload_path, 'r') as f:
+                    return f.read(), detail
+
+            original_bytes = os.path.getsize(image_path)
+            with Image.open(image_path) as image:
+                width, height = image.size
+                new_size = self._target_size(width, height, short_side, detail)
+                image.draft('RGB', new_size)
+                image = image.convert('RGB')
+                if image.size != new_size:
+                    image = image.resize(new_size, Image.LANCZOS)
+                buffer = io.BytesIO()
+                image.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+            encoded = base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+            partial_path = f"{payload_path}.{os.getpid()}.{id(buffer)}.part"
+            with open(partial_path, 'w') as f:
+                f.write(encoded)
+            os.replace(partial_path, payload_path)
+
+            original_tokens = estimate_image_tokens(width, height, 'high')
+            sent_tokens = estimate_image_tokens(new_size[0], new_size[1], detail)
+            self.totals['images'] += 1
+            self.totals['original_bytes'] += original_bytes
+            self.totals['sent_bytes'] += buffer.tell()
+            self.totals['original_tokens'] += original_tokens
+            self.totals['sent_tokens'] += sent_tokens
+            metrics.bytes.inc(original_bytes, kind='cover_original')
+            metrics.bytes.inc(buffer.tell(), kind='cover_sent')
+            log_debug(
+                'pipeline', "Preprocessed cover %dx%d -> %dx%d: %d -> %d bytes, ~%d -> ~%d image tokens",
+                width, height, new_size[0], new_size[1], original_bytes, buffer.tell(),
+                original_tokens, sent_tokens
+            )
+            return encoded, detail
+        except Exception as e:
+            logger.error(f"Error preprocessing image {image_path}: {e}")
+            return None
+
+    def stats(self) -> dict:
+        """Cumulative bytes and estimated image tokens before and after preprocessing"""
+        return dict(self.totals)
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Union
+from app.config import Config
+from app.services.metrics import metrics
+from app.utils.logger import logger
+
+@dataclass
+class VideoJob:
+    """A single video waiting to be processed by a worker"""
+    chat_id: int
+    message_id: int
+    video_file: Any
+    video_info: dict
+    bot: Any
+    processing_msg: Any = None
+    media_group_id: Optional[str] = None
+    group: Any = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Filled in by the worker as the job moves through the pipeline
+    file_path: Optional[str] = None
+    video_path: Optional[str] = None
+    image_path: Optional[str] = None
+    cover_hash: Optional[str] = None
+    cover_phash: Optional[int] = None
+    analysis: Optional[str] = None
+
+@dataclass
+class BatchJob:
+    """Several videos from one chat processed with a single model request"""
+    chat_id: int
+    jobs: List[VideoJob]
+    bot: Any
+    processing_msg: Any = None
+    group: Any = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+class JobQueue:
+    """Bounded in-process job queue served by a pool of asyncio workers
+
+    Jobs carrying a group are also bounded by that group's quota. A job whose
+    group is already at its quota is parked instead of holding a worker, and
+    runs as soon as one of the group's jobs finishes.
+    """
+
+    STAGES = ('download', 'extract', 'analysis')
+
+    def __init__(self, handler: Callable[[Union[VideoJob, BatchJob]], Awaitable[None]]):
+        self.handler = handler
+        self.worker_count = Config.WORKER_COUNT
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=Config.JOB_QUEUE_SIZE)
+        self.stage_limits = {
+            'download': Config.DOWNLOAD_CONCURRENCY,
+            'extract': Config.EXTRACT_CONCURRENCY,
+            'analysis': Config.ANALYSIS_CONCURRENCY,
+        }
+        self.stage_semaphores: Dict[str, asyncio.Semaphore] = {
+            name: asyncio.Semaphore(limit) for name, limit in self.stage_limits.items()
+        }
+        self.workers: List[asyncio.Task] = []
+        self.in_flight = 0
+        # Jobs waiting for a group slot, keyed on the group's semaphore
+        self.parked: Dict[asyncio.Semaphore, Deque[Union[VideoJob, BatchJob]]] = {}
+
+    async def start(self):
+        """Start the worker tasks"""
+        if self.workers:
+            return
+        for index in range(self.worker_count):
+            self.workers.append(asyncio.create_task(self._worker(index), name=f"video-worker-{index}"))
+        logger.info(f"Job queue started with {self.worker_count} workers (limits: {self.stage_limits})")
+
+    async def stop(self):
+        """Cancel the worker tasks and wait for them to exit"""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info("Job queue stopped")
+
+    def submit(self, job: Union[VideoJob, BatchJob]) -> bool:
+        """Enqueue a job without waiting; returns False when the queue is full"""
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Job queue full ({self.queue.qsize()}), rejecting video in chat {job.chat_id}")
+            return False
+
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker or a group slot"""
+        return self.queue.qsize() + sum(len(jobs) for jobs in self.parked.values())
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        """Hold the concurrency slot for a pipeline stage"""
+        async with self.stage_semaphores[name]:
+            yield
+
+    async def _worker(self, index: int):
+        """Pull jobs off the queue and run them one at a time"""
+        while True:
+            job = await self.queue.get()
+            slots = getattr(job.group, 'slots', None)
+            if slots is not None and slots.locked():
+                self.parked.setdefault(slots, deque()).append(job)
+                continue
+            while job is not None:
+                await self._run(index, job, slots)
+                job = self._unpark(slots)
+
+    def _unpark(self, slots: Optional[asyncio.Semaphore]) -> Optional[Union[VideoJob, BatchJob]]:
+        """Next job that was waiting for the slot just released, if any"""
+        parked = self.parked.get(slots) if slots is not None else None
+        if not parked:
+            return None
+        job = parked.popleft()
+        if not parked:
+            del self.parked[slots]
+        return job
+
+    async def _run(self, index: int, job: Union[VideoJob, BatchJob], slots: Optional[asyncio.Semaphore]):
+        metrics.stage_seconds.observe(time.monotonic() - job.enqueued_at, stage='queue_wait')
+        self.in_flight += 1
+        try:
+            if slots is not None:
+                async with slots:
+                    await self.handler(job)
+            else:
+                await self.handler(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Worker {index} failed on job for chat {job.chat_id}: {e}")
+        finally:
+            self.in_flight -= 1
+            self.queue.task_done()
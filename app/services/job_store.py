@@ -0,0 +1,325 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from app.config import Config
+from app.utils.logger import logger
+
+# Jobs move through queued -> downloaded -> extracted -> analyzed -> done,
+# and resume after the last stage they completed
+TERMINAL_STAGES = ('done', 'failed')
+
+@dataclass
+class StoredThumbnail:
+    """Stand-in for the Telegram thumbnail (PhotoSize) of a stored video"""
+    file_id: str
+    width: int
+    height: int
+    file_size: Optional[int] = None
+
+@dataclass
+class StoredFile:
+    """Stand-in for the Telegram file object of a job restored from the store"""
+    file_id: str
+    file_unique_id: Optional[str] = None
+    thumbnail: Optional[StoredThumbnail] = None
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'StoredFile':
+        thumbnail = record.get('thumbnail')
+        return cls(
+            record['file_id'], record['file_unique_id'],
+            StoredThumbnail(**json.loads(thumbnail)) if thumbnail else None
+        )
+
+@dataclass
+class MessageRef:
+    """Stand-in for a processing message restored from the store"""
+    chat_id: int
+    message_id: int
+
+class JobStore:
+    """Durable SQLite record of every video job and the stage it reached
+
+    Jobs are keyed on chat and message id, so an update Telegram delivers
+    twice is only processed once. Jobs that were interrupted by a restart
+    are returned by ``interrupted()`` and resume from their last stage.
+
+    When ingest and workers run as separate processes the table is also the
+    work queue: ``lease()`` hands acknowledged jobs to a worker for a limited
+    time, and jobs whose lease runs out are handed to another worker.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(Config.DATABASE_DIR, 'jobs.db')
+        self.retention_seconds = Config.JOB_STORE_RETENTION_HOURS * 3600
+        self.max_attempts = Config.JOB_MAX_ATTEMPTS
+        self.duplicates = 0
+        self.resumed = 0
+        self._inserts = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            '''CREATE TABLE IF NOT EXISTS jobs (
+                job_key TEXT PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                video_info TEXT NOT NULL,
+                media_group_id TEXT,
+                stage TEXT NOT NULL,
+                processing_message_id INTEGER,
+                video_path TEXT,
+                image_path TEXT,
+                analysis TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )'''
+        )
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        for column, definition in (('lease_owner', 'TEXT'), ('lease_expires', 'REAL'), ('thumbnail', 'TEXT')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_stage ON jobs (stage, updated_at)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_file ON jobs (file_unique_id, stage)')
+        self.conn.commit()
+        self.prune()
+
+    @staticmethod
+    def job_key(chat_id: int, message_id: int) -> str:
+        return f"{chat_id}:{message_id}"
+
+    def begin(self, chat_id: int, message_id: int, video_file: Any, video_info: dict,
+              media_group_id: Optional[str] = None) -> bool:
+        """Record a new job; returns False if this message was already seen"""
+        now = time.time()
+        # Keep the thumbnail so resumed and worker jobs can still take the fast path
+        thumbnail = getattr(video_file, 'thumbnail', None)
+        if thumbnail:
+            thumbnail = json.dumps({
+                'file_id': thumbnail.file_id, 'width': thumbnail.width,
+                'height': thumbnail.height, 'file_size': getattr(thumbnail, 'file_size', None)
+            })
+        try:
+            with self._lock:
+                cursor = self.conn.execute(
+                    '''INSERT OR IGNORE INTO jobs (job_key, chat_id, message_id, file_id, file_unique_id,
+                        thumbnail, video_info, media_group_id, stage, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)''',
+                    (
+                        self.job_key(chat_id, message_id), chat_id, message_id, video_file.file_id,
+                        getattr(video_file, 'file_unique_id', None), thumbnail, json.dumps(video_info),
+                        media_group_id, now, now
+                    )
+                )
+                self.conn.commit()
+        except Exception as e:
+            # Never drop a video because bookkeeping failed
+            logger.error(f"Error recording job: {e}")
+            return True
+        if cursor.rowcount == 0:
+            self.duplicates += 1
+            logger.info(f"Skipping duplicate delivery of message {message_id} in chat {chat_id}")
+            return False
+        self._inserts += 1
+        if self._inserts % self.PRUNE_EVERY == 0:
+            self.prune()
+        return True
+
+    def advance(self, chat_id: int, message_id: int, stage: str, **fields):
+        """Move a job to a later stage, saving whatever that stage produced"""
+        columns = {'stage': stage, 'updated_at': time.time(), **fields}
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        try:
+            with self._lock:
+                self.conn.execute(
+                    f'UPDATE jobs SET {assignments} WHERE job_key = ?',
+                    (*columns.values(), self.job_key(chat_id, message_id))
+                )
+                self.conn.commit()
+        except Exception as e:
+            logger.error(f"Error updating job {self.job_key(chat_id, message_id)}: {e}")
+
+    def advance_leased(self, owner: str, chat_id: int, message_id: int, stage: Optional[str], **fields) -> bool:
+        """Save a job's progress only while ``owner`` holds its lease; returns False otherwise
+
+        Without a ``stage`` the fields are saved and the stage is left as is.
+        """
+        columns = {'stage': stage} if stage else {}
+        columns.update(updated_at=time.time(), **fields)
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        with self._lock:
+            cursor = self.conn.execute(
+                f'UPDATE jobs SET {assignments} WHERE job_key = ? AND lease_owner = ?',
+                (*columns.values(), self.job_key(chat_id, message_id), owner)
+            )
+            self.conn.commit()
+        return cursor.rowcount > 0
+
+    def update(self, chat_id: int, message_id: int, **fields):
+        """Save fields without changing the stage"""
+        row = self.get(chat_id, message_id)
+        if row:
+            self.advance(chat_id, message_id, row['stage'], **fields)
+
+    def get(self, chat_id: int, message_id: int) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self.conn.execute(
+                'SELECT * FROM jobs WHERE job_key = ?', (self.job_key(chat_id, message_id),)
+            ).fetchone()
+
+    def interrupted(self) -> List[Dict[str, Any]]:
+        """Jobs left unfinished by the previous run, oldest first
+
+        Each call counts as an attempt; jobs that keep failing to complete
+        are marked failed instead of being retried forever.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT * FROM jobs WHERE stage NOT IN (?, ?) ORDER BY created_at', TERMINAL_STAGES
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job['video_info'] = json.loads(job['video_info'])
+            if job['attempts'] + 1 >= self.max_attempts:
+                self.advance(job['chat_id'], job['message_id'], 'failed', error='too many attempts')
+                logger.warning(f"Giving up on job {job['job_key']} after {job['attempts'] + 1} attempts")
+                continue
+            self.update(job['chat_id'], job['message_id'], attempts=job['attempts'] + 1)
+            jobs.append(job)
+        self.resumed += len(jobs)
+        return jobs
+
+    def unacknowledged(self) -> List[Dict[str, Any]]:
+        """Unfinished jobs that never got a processing message"""
+        with self._lock:
+            rows = self.conn.execute(
+                '''SELECT * FROM jobs WHERE stage NOT IN (?, ?) AND processing_message_id IS NULL
+                   ORDER BY created_at''', TERMINAL_STAGES
+            ).fetchall()
+        jobs = [dict(row) for row in rows]
+        for job in jobs:
+            job['video_info'] = json.loads(job['video_info'])
+        return jobs
+
+    def lease(self, owner: str, lease_seconds: float,
+              limit_for: Optional[Callable[[int], int]] = None) -> List[Dict[str, Any]]:
+        """Hand the oldest waiting job, with any jobs acknowledged in the same
+        processing message, to ``owner`` until its lease expires
+
+        ``limit_for(chat_id)`` caps how many jobs of one chat may be leased at
+        once; a lease that expired counts as a failed attempt.
+        """
+        now = time.time()
+        with self._lock:
+            active = dict(self.conn.execute(
+                '''SELECT chat_id, COUNT(DISTINCT processing_message_id) FROM jobs
+                   WHERE stage NOT IN (?, ?) AND lease_expires >= ? GROUP BY chat_id''',
+                (*TERMINAL_STAGES, now)
+            ).fetchall())
+            candidates = self.conn.execute(
+                '''SELECT chat_id, processing_message_id FROM jobs
+                   WHERE stage NOT IN (?, ?) AND processing_message_id IS NOT NULL
+                     AND (lease_expires IS NULL OR lease_expires < ?)
+                   ORDER BY created_at LIMIT 100''',
+                (*TERMINAL_STAGES, now)
+            ).fetchall()
+            chosen = None
+            for chat_id, processing_message_id in candidates:
+                limit = limit_for(chat_id) if limit_for else 0
+                if not limit or active.get(chat_id, 0) < limit:
+                    chosen = (chat_id, processing_message_id)
+                    break
+            if chosen is None:
+                return []
+            rows = self.conn.execute(
+                '''SELECT * FROM jobs WHERE chat_id = ? AND processing_message_id = ?
+                     AND stage NOT IN (?, ?) ORDER BY message_id''',
+                (*chosen, *TERMINAL_STAGES)
+            ).fetchall()
+            jobs = []
+            for row in rows:
+                job = dict(row)
+                job['video_info'] = json.loads(job['video_info'])
+                if job['lease_owner']:
+                    # The previous worker died or stalled
+                    job['attempts'] += 1
+                    if job['attempts'] >= self.max_attempts:
+                        self.conn.execute(
+                            '''UPDATE jobs SET stage = 'failed', error = 'too many attempts', lease_owner = NULL,
+                               lease_expires = NULL, attempts = ?, updated_at = ? WHERE job_key = ?''',
+                            (job['attempts'], now, job['job_key'])
+                        )
+                        logger.warning(f"Giving up on job {job['job_key']} after {job['attempts']} attempts")
+                        continue
+                self.conn.execute(
+                    'UPDATE jobs SET lease_owner = ?, lease_expires = ?, attempts = ? WHERE job_key = ?',
+                    (owner, now + lease_seconds, job['attempts'], job['job_key'])
+                )
+                job['lease_owner'] = owner
+                jobs.append(job)
+            self.conn.commit()
+        return jobs
+
+    def renew(self, owner: str, job_keys: List[str], lease_seconds: float):
+        """Extend ``owner``'s lease on jobs it is still working on"""
+        if not job_keys:
+            return
+        with self._lock:
+            self.conn.execute(
+                f'''UPDATE jobs SET lease_expires = ? WHERE lease_owner = ?
+                    AND job_key IN ({', '.join('?' * len(job_keys))})''',
+                (time.time() + lease_seconds, owner, *job_keys)
+            )
+            self.conn.commit()
+
+    def release(self, owner: str, job_keys: List[str]):
+        """Give up ``owner``'s leases without counting an attempt, e.g. on shutdown"""
+        if not job_keys:
+            return
+        with self._lock:
+            self.conn.execute(
+                f'''UPDATE jobs SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?
+                    AND job_key IN ({', '.join('?' * len(job_keys))})''',
+                (owner, *job_keys)
+            )
+            self.conn.commit()
+
+    def prune(self):
+        """Forget finished jobs older than the retention period"""
+        if not self.retention_seconds:
+            return
+        try:
+            with self._lock:
+                self.conn.execute(
+                    'DELETE FROM jobs WHERE stage IN (?, ?) AND updated_at < ?',
+                    (*TERMINAL_STAGES, time.time() - self.retention_seconds)
+                )
+                self.conn.commit()
+        except Exception as e:
+            logger.error(f"Error pruning job store: {e}")
+
+    def stats(self) -> dict:
+        """Job counts per stage, plus duplicates skipped and jobs resumed"""
+        with self._lock:
+            counts = dict(self.conn.execute('SELECT stage, COUNT(*) FROM jobs GROUP BY stage').fetchall())
+        return {'stages': counts, 'duplicates': self.duplicates, 'resumed': self.resumed}
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self.conn.close()
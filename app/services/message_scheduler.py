@@ -0,0 +1,294 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+from telegram.error import BadRequest, RetryAfter
+from app.config import Config
+from app.services.metrics import metrics
+from app.utils.logger import logger
+
+class TokenBucket:
+    """Classic token bucket; ``delay`` says how long until a token is available"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+@dataclass
+class _Outbound:
+    method: str
+    kwargs: dict
+    bot: Any
+    final: bool
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+    def resolve(self, result: Any = None):
+        if not self.future.done():
+            self.future.set_result(result)
+
+class _ChatLane:
+    """Pending outbound calls for one chat"""
+
+    def __init__(self, chat_id: int, bucket: TokenBucket):
+        self.chat_id = chat_id
+        self.bucket = bucket
+        self.finals: Deque[_Outbound] = deque()
+        # Latest pending status per message id; older ones are superseded
+        self.statuses: "OrderedDict[int, _Outbound]" = OrderedDict()
+        self.blocked_until = 0.0
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def empty(self) -> bool:
+        return not self.finals and not self.statuses
+
+    def peek(self) -> Optional[_Outbound]:
+        if self.finals:
+            return self.finals[0]
+        if self.statuses:
+            return next(iter(self.statuses.values()))
+        return None
+
+    def final_pending(self, message_id: int) -> bool:
+        return any(pending.kwargs.get('message_id') == message_id for pending in self.finals)
+
+    def pop(self, op: _Outbound):
+        if self.finals and self.finals[0] is op:
+            self.finals.popleft()
+        else:
+            self.statuses.pop(op.kwargs['message_id'], None)
+
+class StreamingEdit:
+    """Turn a reply arriving in pieces into throttled status edits of one message
+
+    An edit is queued once at least ``min_chars`` new characters have arrived
+    and ``interval`` seconds have passed since the previous one. Edits are
+    non-final, so the scheduler coalesces them under flood limits and the
+    final reply always replaces them. Partial text is sent without a parse
+    mode, since half-written Markdown would be rejected.
+    """
+
+    MAX_LENGTH = 4000
+    CURSOR = ' ▌'
+
+    def __init__(self, scheduler: 'MessageScheduler', bot, chat_id: int, message_id: int,
+                 interval: float, min_chars: int):
+        self.scheduler = scheduler
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.min_chars = min_chars
+        self.parts: List[str] = []
+        self.length = 0
+        self.sent_length = 0
+        self.last_edit = 0.0
+        self.edits = 0
+
+    def feed(self, delta: str):
+        """Add newly generated text, queueing an edit if one is due"""
+        self.parts.append(delta)
+        self.length += len(delta)
+        if self.sent_length >= self.MAX_LENGTH or self.length - self.sent_length < self.min_chars:
+            return
+        now = time.monotonic()
+        if now - self.last_edit < self.interval:
+            return
+        text = ''.join(self.parts)
+        self.parts = [text]
+        self.scheduler.edit_message(
+            self.bot, self.chat_id, self.message_id, text[:self.MAX_LENGTH] + self.CURSOR, final=False
+        )
+        self.sent_length = self.length
+        self.last_edit = now
+        self.edits += 1
+        self.scheduler.streamed_edits += 1
+
+class MessageScheduler:
+    """Rate-limited outbound Telegram calls with per-chat token buckets
+
+    Final results and new messages are queued in order and always delivered.
+    Status edits to the same message coalesce, so only the newest pending
+    status is ever sent. RetryAfter pauses the affected chat and the call is
+    retried once the requested delay has passed.
+    """
+
+    IDLE_SECONDS = 60
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(Config.TELEGRAM_GLOBAL_RATE, Config.TELEGRAM_GLOBAL_RATE)
+        self.group_rate = Config.TELEGRAM_GROUP_MESSAGES_PER_MINUTE / 60
+        self.private_rate = Config.TELEGRAM_PRIVATE_RATE
+        self.concurrency = asyncio.Semaphore(Config.REPLY_CONCURRENCY)
+        self.lanes: Dict[int, _ChatLane] = {}
+        self.dropped_statuses = 0
+        self.retry_afters = 0
+        self.streamed_edits = 0
+
+    def _lane(self, chat_id: int) -> _ChatLane:
+        lane = self.lanes.get(chat_id)
+        if lane is None:
+            # Negative ids are groups and channels, which have the tighter per-minute limit
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, max(1.0, Config.TELEGRAM_GROUP_BURST))
+            else:
+                bucket = TokenBucket(self.private_rate, max(1.0, self.private_rate))
+            lane = self.lanes[chat_id] = _ChatLane(chat_id, bucket)
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._run_lane(lane), name=f"outbound-{chat_id}")
+        return lane
+
+    def send_message(self, bot, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Queue a new message; the future resolves to the sent Message"""
+        op = _Outbound('send_message', dict(chat_id=chat_id, text=text, **kwargs), bot, final=True)
+        lane = self._lane(chat_id)
+        lane.finals.append(op)
+        lane.wakeup.set()
+        return op.future
+
+    def edit_message(self, bot, chat_id: int, message_id: int, text: str,
+                     final: bool = True, **kwargs) -> asyncio.Future:
+        """Queue an edit; non-final edits are dropped if a newer one arrives first"""
+        op = _Outbound(
+            'edit_message_text',
+            dict(chat_id=chat_id, message_id=message_id, text=text, **kwargs),
+            bot,
+            final=final
+        )
+        lane = self._lane(chat_id)
+        if not final and lane.final_pending(message_id):
+            # Never let a status overwrite a result that is already on its way
+            self.dropped_statuses += 1
+            op.resolve(None)
+            return op.future
+        stale = lane.statuses.pop(message_id, None)
+        if stale:
+            self.dropped_statuses += 1
+            stale.resolve(None)
+        if final:
+            lane.finals.append(op)
+        else:
+            lane.statuses[message_id] = op
+        lane.wakeup.set()
+        return op.future
+
+    def stream_edits(self, bot, chat_id: int, message_id: int) -> StreamingEdit:
+        """Throttled status edits of one message for a reply that is still being generated"""
+        return StreamingEdit(
+            self, bot, chat_id, message_id, Config.STREAM_EDIT_INTERVAL_SECONDS, Config.STREAM_MIN_CHARS
+        )
+
+    def pending(self) -> int:
+        """Number of outbound calls waiting to be sent"""
+        return sum(len(lane.finals) + len(lane.statuses) for lane in self.lanes.values())
+
+    async def _run_lane(self, lane: _ChatLane):
+        while True:
+            op = lane.peek()
+            if op is None:
+                lane.wakeup.clear()
+                try:
+                    await asyncio.wait_for(lane.wakeup.wait(), timeout=self.IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    if lane.empty():
+                        self.lanes.pop(lane.chat_id, None)
+                        return
+                continue
+
+            now = time.monotonic()
+            wait = max(
+                lane.blocked_until - now,
+                lane.bucket.delay(),
+                self.global_bucket.delay()
+            )
+            if wait > 0:
+                # Sleep, then re-pick: a newer status may have replaced this one meanwhile
+                await asyncio.sleep(wait)
+                continue
+
+            lane.pop(op)
+            lane.bucket.take()
+            self.global_bucket.take()
+            await self._execute(lane, op)
+
+    async def _execute(self, lane: _ChatLane, op: _Outbound):
+        stage = f"telegram_{op.method}"
+        try:
+            async with self.concurrency:
+                with metrics.stage_seconds.time(stage=stage):
+                    result = await getattr(op.bot, op.method)(**op.kwargs)
+            op.resolve(result)
+        except RetryAfter as e:
+            metrics.stage_errors.inc(stage=stage)
+            self.retry_afters += 1
+            retry_after = float(e.retry_after)
+            logger.warning(f"Flood limit hit in chat {lane.chat_id}, retrying in {retry_after}s")
+            lane.blocked_until = time.monotonic() + retry_after
+            self._requeue(lane, op)
+        except BadRequest as e:
+            message = str(e).lower()
+            if 'not modified' in message:
+                op.resolve(None)
+            elif 'parse' in message and op.kwargs.get('parse_mode'):
+                # Model output is not always valid Markdown; resend it as plain text
+                op.kwargs.pop('parse_mode')
+                self._requeue(lane, op)
+            else:
+                metrics.stage_errors.inc(stage=stage)
+                logger.error(f"Telegram rejected {op.method} in chat {lane.chat_id}: {e}")
+                op.resolve(None)
+        except Exception as e:
+            metrics.stage_errors.inc(stage=stage)
+            logger.error(f"Error calling {op.method} in chat {lane.chat_id}: {e}")
+            op.resolve(None)
+
+    def _requeue(self, lane: _ChatLane, op: _Outbound):
+        if op.final:
+            lane.finals.appendleft(op)
+        elif lane.final_pending(op.kwargs['message_id']):
+            # The result was queued while this status was in flight; it must not be overwritten
+            self.dropped_statuses += 1
+            op.resolve(None)
+        elif op.kwargs['message_id'] not in lane.statuses:
+            lane.statuses[op.kwargs['message_id']] = op
+            lane.statuses.move_to_end(op.kwargs['message_id'], last=False)
+        else:
+            # A newer status was queued while this one was in flight
+            self.dropped_statuses += 1
+            op.resolve(None)
+        lane.wakeup.set()
+
+    async def stop(self, timeout: float = 10.0):
+        """Give queued messages a chance to go out, then stop the lanes"""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        tasks = [lane.task for lane in self.lanes.values() if lane.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.lanes.clear()
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending(),
+            'dropped_statuses': self.dropped_statuses,
+            'retry_afters': self.retry_afters,
+            'streamed_edits': self.streamed_edits,
+        }
@@ -0,0 +1,303 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from app.config import Config
+from app.utils.logger import logger
+
+# Latency buckets in seconds, from a cache hit up to a slow model call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels"""
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.values.items())
+        ]
+
+class Gauge(_Metric):
+    """Point-in-time value, read from a callback when the metrics are scraped"""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def render(self) -> List[str]:
+        values = dict(self.values)
+        if self.function:
+            try:
+                values[()] = self.function()
+            except Exception as e:
+                logger.error(f"Error reading gauge {self.name}: {e}")
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+class Histogram(_Metric):
+    """Bucketed distribution with sum and count, split by labels"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label set: per-bucket (non-cumulative) counts, sum
+        self.series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = ([0] * len(self.buckets), [0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall-clock duration of the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self.series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimate a quantile by interpolating within its bucket"""
+        series = self.series.get(self._key(labels))
+        if not series:
+            return None
+        counts = series[0]
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                upper = self.buckets[index]
+                lower = self.buckets[index - 1] if index else 0.0
+                if upper == math.inf:
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return None
+
+    def labelsets(self) -> List[Dict[str, str]]:
+        return [dict(zip(self.labelnames, key)) for key in sorted(self.series)]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """The bot's metrics, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.stage_seconds = self._add(Histogram(
+            'viral_bot_stage_seconds', 'Time spent in each pipeline stage', ['stage']
+        ))
+        self.stage_errors = self._add(Counter(
+            'viral_bot_stage_errors_total', 'Failures by pipeline stage', ['stage']
+        ))
+        self.videos = self._add(Counter(
+            'viral_bot_videos_total', 'Videos by outcome', ['outcome']
+        ))
+        self.bytes = self._add(Counter(
+            'viral_bot_bytes_total', 'Bytes moved by kind', ['kind']
+        ))
+        self.tokens = self._add(Counter(
+            'viral_bot_tokens_total', 'Model tokens by kind', ['kind']
+        ))
+        self.model_calls = self._add(Counter(
+            'viral_bot_model_calls_total', 'Model call attempts by model and result', ['model', 'result']
+        ))
+        self.circuit_state = self._add(Gauge(
+            'viral_bot_circuit_state', 'Model circuit breaker state (0 closed, 1 half-open, 2 open)', ['model']
+        ))
+        self.cache_lookups = self._add(Counter(
+            'viral_bot_cache_lookups_total', 'Analysis cache lookups', ['kind', 'result']
+        ))
+        self.queue_depth = self._add(Gauge('viral_bot_queue_depth', 'Jobs waiting for a worker'))
+        self.in_flight = self._add(Gauge('viral_bot_jobs_in_flight', 'Jobs being processed'))
+        self.outbound_pending = self._add(Gauge('viral_bot_outbound_pending', 'Telegram calls waiting to be sent'))
+        self.storage_bytes = self._add(Gauge('viral_bot_storage_bytes', 'Bytes stored per area at the last sweep', ['area']))
+        self.storage_files = self._add(Gauge('viral_bot_storage_files', 'Files stored per area at the last sweep', ['area']))
+        self.storage_removed = self._add(Counter(
+            'viral_bot_storage_removed_total', 'Stored files removed by area and reason', ['area', 'reason']
+        ))
+        self.started_at = time.time()
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a pipeline stage and count it as an error if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.stage_errors.inc(stage=name)
+            raise
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, stage=name)
+
+    def timed(self, name: str, none_is_error: bool = True):
+        """Decorator form of ``stage``; a None result also counts as an error
+
+        The services report most failures by logging and returning None, so
+        that is treated the same as an exception unless ``none_is_error`` is off.
+        """
+        def decorator(function):
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.stage(name):
+                        result = await function(*args, **kwargs)
+                    if result is None and none_is_error:
+                        self.stage_errors.inc(stage=name)
+                    return result
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    result = function(*args, **kwargs)
+                if result is None and none_is_error:
+                    self.stage_errors.inc(stage=name)
+                return result
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def stage_summary(self) -> List[Tuple[str, int, float, float, int]]:
+        """(stage, count, p50, p95, errors) for every stage seen so far"""
+        summary = []
+        for labels in self.stage_seconds.labelsets():
+            stage = labels['stage']
+            summary.append((
+                stage,
+                self.stage_seconds.count(stage=stage),
+                self.stage_seconds.quantile(0.5, stage=stage) or 0.0,
+                self.stage_seconds.quantile(0.95, stage=stage) or 0.0,
+                int(self.stage_errors.get(stage=stage)),
+            ))
+        return summary
+
+class MetricsServer:
+    """Minimal HTTP server exposing ``/metrics`` for Prometheus to scrape"""
+
+    def __init__(self, registry: MetricsRegistry, host: Optional[str] = None, port: Optional[int] = None):
+        self.registry = registry
+        self.host = host or Config.METRICS_HOST
+        self.port = Config.METRICS_PORT if port is None else port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if not self.port:
+            return
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the request never has a body we care about
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+# Process-wide registry shared by every service
+metrics = MetricsRegistry()
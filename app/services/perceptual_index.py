@@ -0,0 +1,93 @@
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from app.utils.logger import logger
+
+HASH_BITS = 64
+
+def dhash(image_path: str, hash_size: int = 8) -> Optional[int]:
+    """Compute a 64-bit difference hash of an image"""
+    try:
+        with Image.open(image_path) as image:
+            pixels = list(
+                image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata()
+            )
+        value = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(hash_size):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        return value
+    except Exception as e:
+        logger.error(f"Error computing perceptual hash for {image_path}: {e}")
+        return None
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:
+    def _popcount(value: int) -> int:
+        return bin(value).count('1')
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return _popcount(a ^ b)
+
+class PerceptualIndex:
+    """Multi-index hash table for Hamming-radius lookups over 64-bit hashes
+
+    Each hash is split into ``max_distance + 1`` disjoint chunks. By the
+    pigeonhole principle any hash within ``max_distance`` bits of a query
+    agrees with it exactly on at least one chunk, so only the entries sharing
+    a chunk value need a full distance check.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max(0, min(max_distance, HASH_BITS - 1))
+        chunk_count = self.max_distance + 1
+        base, extra = divmod(HASH_BITS, chunk_count)
+        self.chunks: List[Tuple[int, int]] = []
+        shift = 0
+        for index in range(chunk_count):
+            width = base + (1 if index < extra else 0)
+            self.chunks.append((shift, (1 << width) - 1))
+            shift += width
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.chunks]
+        self.entries: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, value: int, key: str):
+        """Index a hash under the given cache key"""
+        if value in self.entries:
+            self.entries[value] = key
+            return
+        self.entries[value] = key
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            table.setdefault((value >> shift) & mask, []).append(value)
+
+    def remove(self, value: int):
+        """Drop a hash from the index"""
+        if self.entries.pop(value, None) is None:
+            return
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            bucket = table.get((value >> shift) & mask)
+            if bucket and value in bucket:
+                bucket.remove(value)
+
+    def nearest(self, value: int) -> Optional[Tuple[int, str, int]]:
+        """Return the hash, key and distance of the closest entry within max_distance"""
+        best_value = None
+        best_distance = self.max_distance + 1
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            bucket = table.get((value >> shift) & mask)
+            if not bucket:
+                continue
+            for candidate in bucket:
+                distance = _popcount(value ^ candidate)
+                if distance < best_distance:
+                    best_value, best_distance = candidate, distance
+                    if distance == 0:
+                        return best_value, self.entries[best_value], 0
+        if best_value is None:
+            return None
+        return best_value, self.entries[best_value], best_distance
@@ -0,0 +1,230 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+import openai
+from app.config import Config
+from app.services.metrics import metrics
+from app.utils.logger import log_event, logger
+
+T = TypeVar('T')
+
+# Errors worth another attempt; anything else (bad request, auth) fails immediately
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one model
+
+    After ``failure_threshold`` retryable failures in a row the circuit opens
+    and calls fail fast for ``cooldown`` seconds. Then a single probe call is
+    let through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def is_open(self) -> bool:
+        """Open and still cooling down"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        """Whether a call may go out now"""
+        if not self.failure_threshold or self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failure_threshold and (self.state == self.HALF_OPEN or self.failures >= self.failure_threshold):
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def _set_state(self, state: int):
+        self.state = state
+        metrics.circuit_state.set(state, model=self.name)
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After or retry-after-ms"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        # HTTP-date form; not used by the OpenAI API
+        return None
+    return None
+
+def _result_label(error: BaseException) -> str:
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+        return 'timeout'
+    if isinstance(error, openai.RateLimitError):
+        return 'rate_limited'
+    return 'error'
+
+class ResilientCaller:
+    """Deadlines, retries with jittered backoff, circuit breaking, hedging and fallback
+
+    ``call`` runs ``attempt(model)`` until it succeeds or the attempts run
+    out. Each attempt gets its own deadline. Between attempts the caller
+    sleeps for a full-jitter exponential backoff, or longer if the server
+    sent Retry-After. With a fallback model, the last attempt (and every
+    attempt while the primary's circuit is open) goes to the fallback.
+    With hedging on, a duplicate request is started if the first has not
+    answered after ``hedge_after`` seconds and whichever finishes first wins.
+    """
+
+    def __init__(self, model: str, fallback_model: Optional[str] = None):
+        self.model = model
+        self.fallback_model = fallback_model or None
+        self.max_attempts = max(1, Config.OPENAI_MAX_ATTEMPTS)
+        self.attempt_timeout = Config.OPENAI_ATTEMPT_TIMEOUT_SECONDS
+        self.backoff_base = Config.OPENAI_BACKOFF_BASE_SECONDS
+        self.backoff_max = Config.OPENAI_BACKOFF_MAX_SECONDS
+        self.hedge_after = Config.OPENAI_HEDGE_AFTER_SECONDS
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.hedges = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = CircuitBreaker(
+                model, Config.OPENAI_BREAKER_FAILURES, Config.OPENAI_BREAKER_COOLDOWN_SECONDS
+            )
+        return breaker
+
+    def _pick_model(self, attempt: int) -> str:
+        """Primary model, or the fallback on the last attempt or while the primary is down"""
+        if not self.fallback_model:
+            return self.model
+        if attempt and attempt == self.max_attempts - 1:
+            return self.fallback_model
+        if self.breaker(self.model).is_open():
+            return self.fallback_model
+        return self.model
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        requested = retry_after(error)
+        return max(delay, requested) if requested is not None else delay
+
+    async def call(self, attempt: Callable[[str], Awaitable[T]], hedge: bool = True,
+                   can_retry: Optional[Callable[[], bool]] = None, timeout_scale: float = 1.0) -> T:
+        """Run ``attempt(model)`` under the retry policy and return its result
+
+        ``can_retry`` is checked after a failed attempt; returning False stops
+        further attempts, e.g. once a streamed reply has been partly shown.
+        ``timeout_scale`` stretches the attempt deadline and hedge delay for
+        requests expected to take longer, such as long batched replies.
+        """
+        last_error: Optional[BaseException] = None
+        for index in range(self.max_attempts):
+            model = self._pick_model(index)
+            breaker = self.breaker(model)
+            if not breaker.allow():
+                # Fail fast rather than queue behind an outage
+                metrics.model_calls.inc(model=model, result='circuit_open')
+                raise CircuitOpenError(f"Circuit for {model} is open")
+            try:
+                result = await self._attempt(attempt, model, hedge, timeout_scale)
+            except asyncio.CancelledError:
+                breaker.probing = False
+                raise
+            except RETRYABLE_ERRORS as e:
+                breaker.record_failure()
+                metrics.model_calls.inc(model=model, result=_result_label(e))
+                last_error = e
+                if index == self.max_attempts - 1 or (can_retry and not can_retry()):
+                    break
+                delay = self.backoff(index, e)
+                log_event('video', "Model call to %s failed (%s), retrying in %.2fs", model,
+                          type(e).__name__, delay, model=model, attempt=index + 1)
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                # The service answered; a bad request is not an outage
+                breaker.record_success()
+                metrics.model_calls.inc(model=model, result='rejected')
+                raise
+            breaker.record_success()
+            metrics.model_calls.inc(model=model, result='ok')
+            return result
+        raise last_error
+
+    async def _attempt(self, attempt: Callable[[str], Awaitable[T]], model: str, hedge: bool,
+                       timeout_scale: float = 1.0) -> T:
+        """One deadline-bound attempt, hedged with a duplicate if it runs long"""
+        deadline = self.attempt_timeout * timeout_scale or None
+        hedge_after = self.hedge_after * timeout_scale
+        if not hedge or not hedge_after or (deadline and hedge_after >= deadline):
+            return await asyncio.wait_for(attempt(model), deadline)
+
+        started = time.monotonic()
+        primary = asyncio.ensure_future(attempt(model))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                self.hedges += 1
+                metrics.model_calls.inc(model=model, result='hedged')
+                tasks.add(asyncio.ensure_future(attempt(model)))
+            remaining = deadline - (time.monotonic() - started) if deadline else None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    return succeeded[0].result()
+                if not tasks:
+                    # Both failed; report the first request's error
+                    raise (primary.exception() if primary.done() else next(iter(done)).exception())
+                remaining = deadline - (time.monotonic() - started) if deadline else None
+            raise asyncio.TimeoutError()
+        finally:
+            for task in tasks | {primary}:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            'hedges': self.hedges,
+            'circuits': {name: breaker.state for name, breaker in self.breakers.items()},
+        }
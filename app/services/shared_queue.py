@@ -0,0 +1,252 @@
+import asyncio
+import hmac
+import json
+import os
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+import httpx
+from app.config import Config
+from app.services.job_store import TERMINAL_STAGES, JobStore
+from app.utils.logger import log_debug, logger
+
+# Job fields a worker may write back; anything else is rejected
+WRITABLE_FIELDS = frozenset({'video_path', 'image_path', 'analysis', 'error'})
+WRITABLE_STAGES = frozenset({'downloaded', 'extracted', 'analyzed', *TERMINAL_STAGES})
+
+class LeaseConflictError(Exception):
+    """A worker wrote to a job whose lease it no longer holds"""
+
+# Group settings shipped with each lease, so workers need no groups file
+GROUP_FIELDS = ('chat_id', 'username', 'name', 'max_concurrency', 'max_video_size_mb',
+                'max_video_duration_seconds', 'prompt', 'daily_token_budget')
+
+class QueueServer:
+    """HTTP front for the ingest process's job store, used by worker processes
+
+    Endpoints (POST, JSON, ``Authorization: Bearer QUEUE_TOKEN``):
+
+    - ``/lease`` ``{"worker", "wait"}``: long-poll for the next job group
+    - ``/renew`` ``{"worker", "job_keys"}``: extend leases on running jobs
+    - ``/release`` ``{"worker", "job_keys"}``: hand unfinished jobs back when the worker
+      shuts down; it is leased nothing more
+    - ``/advance`` ``{"worker", "chat_id", "message_id", "stage", "fields"}``: record
+      progress; answered with 409 Conflict unless ``worker`` holds the job's lease
+    """
+
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, job_store: JobStore, group_for: Callable[[int], Any],
+                 host: Optional[str] = None, port: Optional[int] = None):
+        self.job_store = job_store
+        self.group_for = group_for
+        self.host = host or Config.QUEUE_HOST
+        self.port = Config.QUEUE_PORT if port is None else port
+        self.token = Config.QUEUE_TOKEN
+        self.lease_seconds = Config.QUEUE_LEASE_SECONDS
+        self.available = asyncio.Event()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: Set[asyncio.StreamWriter] = set()
+        # Workers that shut down; a long-poll of theirs still waiting must not take jobs
+        self.retired: Set[str] = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Job queue listening on http://{self.host}:{self.port}")
+        if not self.token and self.host not in ('127.0.0.1', 'localhost', '::1'):
+            logger.warning("Job queue is reachable from other hosts without a QUEUE_TOKEN")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            # Workers keep connections alive; close them so the server can shut down
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def notify(self):
+        """Wake workers waiting in /lease"""
+        self.available.set()
+
+    def _limit_for(self, chat_id: int) -> int:
+        group = self.group_for(chat_id)
+        return group.max_concurrency if group else 0
+
+    async def lease(self, worker: str, wait: float) -> List[Dict[str, Any]]:
+        deadline = time.monotonic() + min(wait, 30)
+        while True:
+            self.available.clear()
+            if worker in self.retired:
+                return []
+            jobs = self.job_store.lease(worker, self.lease_seconds, self._limit_for)
+            remaining = deadline - time.monotonic()
+            if jobs or remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.available.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        for job in jobs:
+            group = self.group_for(job['chat_id'])
+            job['group'] = {name: getattr(group, name) for name in GROUP_FIELDS} if group else None
+        if jobs:
+            log_debug('pipeline', "Leased %d job(s) to %s", len(jobs), worker)
+        return jobs
+
+    def advance(self, worker: str, chat_id: int, message_id: int, stage: Optional[str], fields: Dict[str, Any]):
+        unknown = set(fields) - WRITABLE_FIELDS
+        if unknown or (stage and stage not in WRITABLE_STAGES):
+            raise ValueError(f"Not writable: {sorted(unknown) or stage}")
+        # A worker whose lease expired must not overwrite the job's new owner
+        if not self.job_store.advance_leased(worker, chat_id, message_id, stage, **fields):
+            raise LeaseConflictError(f"Job {JobStore.job_key(chat_id, message_id)} is not leased to {worker}")
+
+    async def _dispatch(self, path: str, request: dict) -> Any:
+        if path == '/lease':
+            return {'jobs': await self.lease(str(request['worker']), float(request.get('wait', 0)))}
+        if path == '/renew':
+            self.job_store.renew(str(request['worker']), [str(key) for key in request['job_keys']], self.lease_seconds)
+            return {}
+        if path == '/release':
+            self.retired.add(str(request['worker']))
+            self.job_store.release(str(request['worker']), [str(key) for key in request['job_keys']])
+            self.notify()
+            return {}
+        if path == '/advance':
+            self.advance(str(request['worker']), int(request['chat_id']), int(request['message_id']),
+                         request.get('stage'), request.get('fields') or {})
+            return {}
+        return None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections.add(writer)
+        try:
+            # Keep-alive: serve requests until the worker closes the connection
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > self.MAX_BODY:
+                    break
+                body = await reader.readexactly(length)
+                parts = request_line.decode('latin-1').split()
+                status, payload = '404 Not Found', {'error': 'not found'}
+                if self.token and not hmac.compare_digest(headers.get('authorization', ''), f"Bearer {self.token}"):
+                    status, payload = '401 Unauthorized', {'error': 'unauthorized'}
+                elif len(parts) >= 2 and parts[0] == 'POST':
+                    try:
+                        result = await self._dispatch(parts[1], json.loads(body or b'{}'))
+                        if result is not None:
+                            status, payload = '200 OK', result
+                    except LeaseConflictError as e:
+                        status, payload = '409 Conflict', {'error': str(e)}
+                    except (KeyError, TypeError, ValueError) as e:
+                        status, payload = '400 Bad Request', {'error': str(e)}
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Error serving job queue: {e}")
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+class QueueClient:
+    """Worker-side client for QueueServer"""
+
+    def __init__(self, url: Optional[str] = None, worker_id: Optional[str] = None):
+        self.url = (url or Config.QUEUE_URL).rstrip('/')
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        headers = {'Authorization': f"Bearer {Config.QUEUE_TOKEN}"} if Config.QUEUE_TOKEN else {}
+        self.http_client = httpx.AsyncClient(base_url=self.url, headers=headers, timeout=httpx.Timeout(60.0))
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        response = await self.http_client.post(path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def lease(self, wait: float) -> List[Dict[str, Any]]:
+        return (await self._post('/lease', {'worker': self.worker_id, 'wait': wait}))['jobs']
+
+    async def renew(self, job_keys: List[str]):
+        await self._post('/renew', {'worker': self.worker_id, 'job_keys': job_keys})
+
+    async def release(self, job_keys: List[str]):
+        await self._post('/release', {'worker': self.worker_id, 'job_keys': job_keys})
+
+    async def advance(self, chat_id: int, message_id: int, stage: Optional[str], fields: Dict[str, Any]):
+        await self._post('/advance', {
+            'worker': self.worker_id, 'chat_id': chat_id, 'message_id': message_id, 'stage': stage, 'fields': fields
+        })
+
+    async def close(self):
+        await self.http_client.aclose()
+
+class RemoteJobStore:
+    """Stands in for JobStore inside a worker, forwarding progress to the ingest process
+
+    Writes are queued and sent in order by a background task, so recording a
+    stage never blocks the pipeline on a network round trip.
+    """
+
+    RETRY_SECONDS = 2.0
+
+    def __init__(self, client: QueueClient):
+        self.client = client
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.sender: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.sender = asyncio.create_task(self._send(), name="job-store-sender")
+
+    def advance(self, chat_id: int, message_id: int, stage: str, **fields):
+        self.updates.put_nowait((chat_id, message_id, stage, fields))
+
+    def update(self, chat_id: int, message_id: int, **fields):
+        self.updates.put_nowait((chat_id, message_id, None, fields))
+
+    async def _send(self):
+        while True:
+            chat_id, message_id, stage, fields = await self.updates.get()
+            while True:
+                try:
+                    await self.client.advance(chat_id, message_id, stage, fields)
+                    break
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 409:
+                        logger.warning(f"Lease on job {chat_id}:{message_id} was lost, update dropped")
+                    else:
+                        logger.error(f"Job queue rejected update for {chat_id}:{message_id}: {e}")
+                    break
+                except httpx.HTTPError as e:
+                    # The ingest process may be restarting; keep the update
+                    logger.warning(f"Error sending job update, retrying: {e}")
+                    await asyncio.sleep(self.RETRY_SECONDS)
+            self.updates.task_done()
+
+    async def flush(self, timeout: float = 10.0):
+        """Wait for queued updates to reach the ingest process"""
+        try:
+            await asyncio.wait_for(self.updates.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.updates.qsize()} job update(s) not delivered")
+
+    def close(self):
+        if self.sender:
+            self.sender.cancel()
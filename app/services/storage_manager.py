@@ -0,0 +1,167 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from app.config import Config
+from app.services.metrics import metrics
+from app.utils.logger import log_debug, logger
+
+def mark_used(path: str):
+    """Record a read of a stored file for LRU eviction
+
+    Only the access time is bumped: covers and cached payloads are compared
+    by modification time elsewhere, and atime alone is unreliable on
+    filesystems mounted with relatime or noatime.
+    """
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+@dataclass
+class StorageArea:
+    """A directory with its own age and size limits (0 disables a limit)"""
+    name: str
+    path: str
+    max_age_seconds: float
+    max_bytes: int
+
+@dataclass
+class SweepResult:
+    files: int = 0
+    bytes: int = 0
+    expired: int = 0
+    evicted: int = 0
+    freed_bytes: int = 0
+
+class StorageManager:
+    """Keep the video and image directories within their age and byte quotas
+
+    A background task sweeps each directory every STORAGE_SWEEP_SECONDS on a
+    worker thread. Files older than the age limit are removed first; if the
+    directory is still over its byte quota, the least recently used files
+    are evicted until it fits. Files touched within STORAGE_GRACE_SECONDS
+    are never removed, so a job's download or cover is safe while it runs.
+    """
+
+    def __init__(self, areas: Optional[List[StorageArea]] = None):
+        max_age_seconds = Config.STORAGE_MAX_AGE_HOURS * 3600
+        self.areas = areas or [
+            StorageArea('videos', Config.VIDEOS_DIR, max_age_seconds, int(Config.STORAGE_MAX_VIDEOS_MB * 1024 * 1024)),
+            StorageArea('images', Config.IMAGES_DIR, max_age_seconds, int(Config.STORAGE_MAX_IMAGES_MB * 1024 * 1024)),
+        ]
+        self.grace_seconds = Config.STORAGE_GRACE_SECONDS
+        self.sweep_seconds = Config.STORAGE_SWEEP_SECONDS
+        self.sweep_task: Optional[asyncio.Task] = None
+        self.last_sweep: Dict[str, SweepResult] = {}
+
+    async def start(self):
+        """Sweep once now, then periodically"""
+        if self.sweep_seconds > 0:
+            self.sweep_task = asyncio.create_task(self._run(), name="storage-sweep")
+
+    async def stop(self):
+        if self.sweep_task:
+            self.sweep_task.cancel()
+            await asyncio.gather(self.sweep_task, return_exceptions=True)
+            self.sweep_task = None
+
+    async def _run(self):
+        while True:
+            await self.sweep()
+            await asyncio.sleep(self.sweep_seconds)
+
+    async def sweep(self) -> Dict[str, SweepResult]:
+        """Enforce every area's quotas without blocking the event loop"""
+        for area in self.areas:
+            try:
+                with metrics.stage('storage_sweep'):
+                    result = await asyncio.to_thread(self.sweep_area, area)
+            except Exception as e:
+                logger.error(f"Error sweeping {area.path}: {e}")
+                continue
+            self.last_sweep[area.name] = result
+            metrics.storage_bytes.set(result.bytes, area=area.name)
+            metrics.storage_files.set(result.files, area=area.name)
+            if result.expired:
+                metrics.storage_removed.inc(result.expired, area=area.name, reason='expired')
+            if result.evicted:
+                metrics.storage_removed.inc(result.evicted, area=area.name, reason='evicted')
+            if result.expired or result.evicted:
+                logger.info(
+                    f"Storage sweep of {area.name}: removed {result.expired} expired and {result.evicted} "
+                    f"evicted files ({result.freed_bytes / (1024 * 1024):.1f}MB), "
+                    f"{result.files} files ({result.bytes / (1024 * 1024):.1f}MB) remain"
+                )
+        return self.last_sweep
+
+    def _scan(self, path: str) -> List[Tuple[float, int, str]]:
+        """(last used, size, path) for every regular file, from a single scandir pass"""
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    # Removed by a job between listing and stat
+                    continue
+                files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+        return files
+
+    def sweep_area(self, area: StorageArea) -> SweepResult:
+        """Expire old files, then evict least recently used ones until under quota"""
+        result = SweepResult()
+        if not os.path.isdir(area.path):
+            return result
+        now = time.time()
+        files = self._scan(area.path)
+        total = sum(size for _, size, _ in files)
+        kept = []
+        for last_used, size, path in files:
+            age = now - last_used
+            if area.max_age_seconds and age > area.max_age_seconds and age > self.grace_seconds:
+                if self._remove(path):
+                    result.expired += 1
+                    result.freed_bytes += size
+                    total -= size
+                    continue
+            kept.append((last_used, size, path))
+        if area.max_bytes and total > area.max_bytes:
+            kept.sort()
+            for index, (last_used, size, path) in enumerate(kept):
+                if total <= area.max_bytes or now - last_used <= self.grace_seconds:
+                    break
+                if self._remove(path):
+                    result.evicted += 1
+                    result.freed_bytes += size
+                    total -= size
+                    kept[index] = None
+            kept = [item for item in kept if item]
+        result.files = len(kept)
+        result.bytes = total
+        return result
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            log_debug('storage', "Removed %s", path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            logger.error(f"Error removing {path}: {e}")
+            return False
+
+    async def discard(self, path: Optional[str], area: str = 'videos'):
+        """Delete a file that is no longer needed, off the event loop"""
+        if path and await asyncio.to_thread(self._remove, path):
+            metrics.storage_removed.inc(area=area, reason='discarded')
+
+    def stats(self) -> Dict[str, SweepResult]:
+        """Results of the most recent sweep of each area"""
+        return dict(self.last_sweep)
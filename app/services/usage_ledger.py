@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+from app.config import Config
+from app.services.metrics import metrics
+from app.utils.logger import logger
+
+# Budget modes, from full service down to answering only from the analysis cache
+NORMAL = 'normal'
+ECONOMY = 'economy'
+CACHE_ONLY = 'cache_only'
+
+def cached_tokens(usage: Any) -> int:
+    """Prompt tokens served from the provider's prompt cache
+
+    Older client versions keep ``prompt_tokens_details`` as a plain dict.
+    """
+    details = getattr(usage, 'prompt_tokens_details', None)
+    if isinstance(details, dict):
+        return int(details.get('cached_tokens') or 0)
+    return int(getattr(details, 'cached_tokens', 0) or 0)
+
+class UsageLedger:
+    """Token usage per group, model and UTC day, with daily budgets
+
+    Every completion is recorded in SQLite, and budgets are checked against
+    the database rather than a per-process total, so worker processes
+    sharing DATABASE_DIR enforce one budget between them. A group that
+    has spent BUDGET_ECONOMY_AT of its daily budget is switched to the
+    economy model and low image detail; once the budget is spent it is
+    only served from the analysis cache until the day rolls over.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(Config.DATABASE_DIR, 'usage.db')
+        self.economy_at = Config.BUDGET_ECONOMY_AT
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            '''CREATE TABLE IF NOT EXISTS usage (
+                day TEXT NOT NULL,
+                group_key TEXT NOT NULL,
+                model TEXT NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, group_key, model)
+            )'''
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def today() -> str:
+        return time.strftime('%Y-%m-%d', time.gmtime())
+
+    def record(self, group_key: Optional[str], model: str, usage: Any):
+        """Add one completion's usage to today's totals"""
+        if usage is None:
+            return
+        group_key = group_key or '-'
+        prompt = int(usage.prompt_tokens or 0)
+        completion = int(usage.completion_tokens or 0)
+        cached = cached_tokens(usage)
+        metrics.tokens.inc(cached, kind='cached')
+        try:
+            with self._lock:
+                self.conn.execute(
+                    '''INSERT INTO usage (day, group_key, model, calls, prompt_tokens, completion_tokens, cached_tokens)
+                       VALUES (?, ?, ?, 1, ?, ?, ?)
+                       ON CONFLICT (day, group_key, model) DO UPDATE SET
+                           calls = calls + 1,
+                           prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                           completion_tokens = completion_tokens + excluded.completion_tokens,
+                           cached_tokens = cached_tokens + excluded.cached_tokens''',
+                    (self.today(), group_key, model, prompt, completion, cached)
+                )
+                self.conn.commit()
+        except Exception as e:
+            logger.error(f"Error recording token usage: {e}")
+
+    def spent(self, group_key: Optional[str]) -> int:
+        """Prompt plus completion tokens used today, by every process sharing the ledger"""
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    '''SELECT SUM(prompt_tokens + completion_tokens) FROM usage
+                       WHERE day = ? AND group_key = ?''',
+                    (self.today(), group_key or '-')
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"Error reading token usage: {e}")
+            return 0
+        return int(row[0] or 0)
+
+    def mode(self, group_key: Optional[str], budget: Optional[int]) -> str:
+        """How a group should be served given today's spend against its budget"""
+        if not budget:
+            return NORMAL
+        spent = self.spent(group_key)
+        if spent >= budget:
+            return CACHE_ONLY
+        if self.economy_at and spent >= budget * self.economy_at:
+            return ECONOMY
+        return NORMAL
+
+    def report(self, day: Optional[str] = None) -> List[Tuple[str, str, int, int, int, int]]:
+        """(group, model, calls, prompt, completion, cached) rows for one day"""
+        with self._lock:
+            return self.conn.execute(
+                '''SELECT group_key, model, calls, prompt_tokens, completion_tokens, cached_tokens
+                   FROM usage WHERE day = ? ORDER BY group_key, model''',
+                (day or self.today(),)
+            ).fetchall()
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self.conn.close()
@@ -1,12 +1,28 @@
 import os
+import re
+import hashlib
+import math
 import asyncio
-import aiofiles
+import shutil
+import subprocess
 import yt_dlp
-from PIL import Image
+from PIL import Image, ImageDraw
 import tempfile
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from app.config import Config
-from app.utils.logger import logger
+from app.services.frame_scoring import pick_best_frame
+from app.services.metrics import metrics
+from app.services.perceptual_index import dhash
+from app.utils.logger import log_debug, logger
+
+def ffmpeg_version() -> Optional[Tuple[int, int]]:
+    """(major, minor) of the installed ffmpeg, or None for git builds and unknown output"""
+    try:
+        output = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    match = re.match(r'ffmpeg version n?(\d+)\.(\d+)', output)
+    return (int(match.group(1)), int(match.group(2))) if match else None
 
 class VideoProcessor:
     """Service for processing videos and extracting cover images"""
@@ -15,68 +31,271 @@ class VideoProcessor:
         self.videos_dir = Config.VIDEOS_DIR
         self.images_dir = Config.IMAGES_DIR
         self.max_size_mb = Config.MAX_VIDEO_SIZE_MB
+        self.ffmpeg_timeout = Config.FFMPEG_TIMEOUT_SECONDS
+        self.cover_seek_seconds = Config.COVER_SEEK_SECONDS
+        self.cover_mode = Config.COVER_MODE
+        self.cover_sampling = Config.COVER_SAMPLING
+        self.cover_candidates = Config.COVER_CANDIDATES
+        self.cover_sample_interval = Config.COVER_SAMPLE_INTERVAL_SECONDS
+        self.sheet_columns = Config.CONTACT_SHEET_COLUMNS
+        self.sheet_rows = Config.CONTACT_SHEET_ROWS
+        self.sheet_tile_size = Config.CONTACT_SHEET_TILE_SIZE
+        self.ffmpeg_limit = asyncio.Semaphore(Config.FFMPEG_CONCURRENCY or os.cpu_count() or 1)
+        # -fps_mode replaced -vsync in ffmpeg 5.1; distro packages such as Ubuntu 22.04's 4.4 predate it
+        version = ffmpeg_version()
+        self.vfr_args = ['-vsync', 'vfr'] if version and version < (5, 1) else ['-fps_mode', 'vfr']
         
         # Create directories if they don't exist
         os.makedirs(self.videos_dir, exist_ok=True)
         os.makedirs(self.images_dir, exist_ok=True)
     
-    async def download_video(self, file_id: str, file_path: str) -> Optional[str]:
-        """Download video from Telegram and save to local storage"""
+    def allocate_video_path(self, file_id: str) -> str:
+        """Return the final storage path for a new video download"""
+        timestamp = int(asyncio.get_event_loop().time())
+        video_filename = f"video_{file_id}_{timestamp}.mp4"
+        return os.path.join(self.videos_dir, video_filename)
+    
+    def allocate_thumbnail_path(self, file_id: str) -> str:
+        """Return the storage path for a Telegram-provided thumbnail"""
+        return os.path.join(self.images_dir, f"thumb_{file_id}.jpg")
+    
+    @metrics.timed('store')
+    async def download_video(self, file_id: str, file_path: str, max_size_mb: Optional[int] = None) -> Optional[str]:
+        """Move a downloaded video into local storage without copying its bytes
+
+        ``max_size_mb`` is the group's own limit, replacing MAX_VIDEO_SIZE_MB.
+        """
         try:
-            # Generate unique filename
-            timestamp = int(asyncio.get_event_loop().time())
-            video_filename = f"video_{file_id}_{timestamp}.mp4"
-            video_path = os.path.join(self.videos_dir, video_filename)
-            
             # Check file size
+            max_size_mb = max_size_mb or self.max_size_mb
             file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-            if file_size_mb > self.max_size_mb:
-                logger.warning(f"Video too large: {file_size_mb:.2f}MB > {self.max_size_mb}MB")
+            if file_size_mb > max_size_mb:
+                logger.warning(f"Video too large: {file_size_mb:.2f}MB > {max_size_mb}MB")
                 return None
             
-            # Copy file to videos directory
-            async with aiofiles.open(file_path, 'rb') as src:
-                async with aiofiles.open(video_path, 'wb') as dst:
-                    await dst.write(await src.read())
+            # Already downloaded straight into the videos directory
+            if self.is_stored(file_path):
+                log_debug('pipeline', "Video stored in place: %s", file_path)
+                return file_path
             
-            logger.info(f"Video downloaded successfully: {video_path}")
+            video_path = self.allocate_video_path(file_id)
+            try:
+                # Atomic rename when source and destination share a filesystem
+                os.replace(file_path, video_path)
+            except OSError:
+                # Cross-device: stream the copy in fixed-size chunks off the event loop
+                await asyncio.to_thread(shutil.copyfile, file_path, video_path)
+                os.remove(file_path)
+            
+            log_debug('pipeline', "Video downloaded successfully: %s", video_path)
             return video_path
             
         except Exception as e:
             logger.error(f"Error downloading video: {e}")
             return None
     
-    def extract_cover_image(self, video_path: str) -> Optional[str]:
+    @metrics.timed('store')
+    async def open_in_place(self, file_path: str, max_size_mb: Optional[int] = None) -> Optional[str]:
+        """Use a file a local Bot API server already wrote to disk, without moving or copying it
+
+        The server owns the file, so it stays outside the videos directory
+        and is never removed by the storage sweep. ``max_size_mb`` is the
+        group's own limit, replacing MAX_VIDEO_SIZE_MB.
+        """
+        max_size_mb = max_size_mb or self.max_size_mb
+        try:
+            file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        except OSError as e:
+            logger.error(f"Error opening {file_path} from the Bot API server: {e}")
+            return None
+        if file_size_mb > max_size_mb:
+            logger.warning(f"Video too large: {file_size_mb:.2f}MB > {max_size_mb}MB")
+            return None
+        log_debug('pipeline', "Video opened in place: %s", file_path)
+        return file_path
+
+    def is_stored(self, path: Optional[str]) -> bool:
+        """Whether a path is one of our own downloads rather than the Bot API server's file"""
+        return bool(path) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.videos_dir)
+
+    def video_name(self, video_path: str) -> str:
+        """Unique stem for images derived from a video"""
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        if not self.is_stored(video_path):
+            # Bot API server files are only unique within their own folder (videos/file_0.mp4, documents/file_0.mp4)
+            name += '_' + hashlib.sha1(os.path.abspath(video_path).encode('utf-8')).hexdigest()[:8]
+        return name
+
+    async def run_ffmpeg(self, args: List[str], timeout: Optional[float] = None) -> Tuple[int, str]:
+        """Run ffmpeg as an asyncio subprocess under the shared concurrency limit"""
+        timeout = timeout or self.ffmpeg_timeout
+        cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error'] + args
+        async with self.ffmpeg_limit:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            except asyncio.TimeoutError:
+                self._kill(process)
+                await process.wait()
+                logger.error(f"ffmpeg timed out after {timeout}s: {' '.join(cmd)}")
+                return -1, f"timed out after {timeout}s"
+            except asyncio.CancelledError:
+                # Job cancelled: don't leave an orphaned ffmpeg behind
+                self._kill(process)
+                await asyncio.shield(process.wait())
+                raise
+            return process.returncode, stderr.decode('utf-8', errors='replace')
+    
+    @staticmethod
+    def _kill(process):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    
+    @metrics.timed('extract')
+    async def extract_cover_image(self, video_path: str, duration: Optional[float] = None) -> Optional[str]:
         """Extract cover image from video using ffmpeg"""
         try:
             # Generate image filename
-            video_name = os.path.splitext(os.path.basename(video_path))[0]
+            video_name = self.video_name(video_path)
             image_filename = f"cover_{video_name}.jpg"
             image_path = os.path.join(self.images_dir, image_filename)
             
-            # Use ffmpeg to extract first frame
-            import subprocess
-            cmd = [
-                'ffmpeg', '-i', video_path, 
-                '-vframes', '1', 
-                '-q:v', '2', 
+            if self.cover_mode == 'contact_sheet':
+                sheet_path = await self.build_contact_sheet(video_path, duration)
+                if sheet_path:
+                    return sheet_path
+                logger.warning("Contact sheet failed, falling back to first frame")
+            elif self.cover_mode == 'best':
+                best_path = await self.extract_best_cover(video_path, image_path, duration)
+                if best_path:
+                    return best_path
+                logger.warning("Best-frame selection failed, falling back to first frame")
+            
+            # -ss before -i seeks on the demuxer instead of decoding up to the offset
+            args = [
+                '-ss', str(self.cover_seek_seconds),
+                '-an', '-sn', '-dn',
+                '-i', video_path,
+                '-vframes', '1',
+                '-q:v', '2',
                 '-y',  # Overwrite output file
                 image_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            returncode, stderr = await self.run_ffmpeg(args)
             
-            if result.returncode == 0 and os.path.exists(image_path):
-                logger.info(f"Cover image extracted: {image_path}")
+            if returncode == 0 and os.path.exists(image_path):
+                log_debug('pipeline', "Cover image extracted: %s", image_path)
                 return image_path
             else:
-                logger.error(f"ffmpeg failed: {result.stderr}")
+                logger.error(f"ffmpeg failed: {stderr}")
                 return None
                     
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error extracting cover image: {e}")
             return None
     
+    async def sample_frames(self, video_path: str, output_dir: str, count: int,
+                            duration: Optional[float] = None) -> List[str]:
+        """Write up to ``count`` evenly spaced frames into output_dir in one ffmpeg pass"""
+        interval = duration / count if duration else self.cover_sample_interval
+        args = []
+        if self.cover_sampling == 'keyframe':
+            # Only decode keyframes; much cheaper on long videos
+            args += ['-skip_frame', 'nokey']
+        args += [
+            '-an', '-sn', '-dn',
+            '-i', video_path,
+            '-vf', f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f})'",
+            *self.vfr_args,
+            '-frames:v', str(count),
+            '-q:v', '2',
+            os.path.join(output_dir, 'frame_%03d.jpg')
+        ]
+        returncode, stderr = await self.run_ffmpeg(args)
+        if returncode != 0:
+            logger.error(f"ffmpeg frame sampling failed: {stderr}")
+            return []
+        return sorted(os.path.join(output_dir, name) for name in os.listdir(output_dir))
+    
+    async def extract_best_cover(self, video_path: str, image_path: str,
+                                 duration: Optional[float] = None) -> Optional[str]:
+        """Sample candidate frames in one ffmpeg pass and keep the best-scoring one"""
+        candidates_dir = tempfile.mkdtemp(prefix='candidates_', dir=self.images_dir)
+        try:
+            candidates = await self.sample_frames(video_path, candidates_dir, self.cover_candidates, duration)
+            if not candidates:
+                return None
+            best = await asyncio.to_thread(pick_best_frame, candidates)
+            if not best:
+                return None
+            os.replace(best, image_path)
+            log_debug('pipeline', "Best cover selected from %d candidates: %s", len(candidates), image_path)
+            return image_path
+        finally:
+            shutil.rmtree(candidates_dir, ignore_errors=True)
+    
+    async def build_contact_sheet(self, video_path: str, duration: Optional[float] = None) -> Optional[str]:
+        """Tile evenly spaced frames into a single contact-sheet image"""
+        frames_dir = tempfile.mkdtemp(prefix='sheet_', dir=self.images_dir)
+        try:
+            count = self.sheet_columns * self.sheet_rows
+            frames = await self.sample_frames(video_path, frames_dir, count, duration)
+            if not frames:
+                return None
+            columns = min(self.sheet_columns, len(frames))
+            rows = math.ceil(len(frames) / columns)
+            video_name = self.video_name(video_path)
+            # The grid is recorded in the file name so the analyzer can describe the layout
+            sheet_path = os.path.join(self.images_dir, f"sheet_{rows}x{columns}_{video_name}.jpg")
+            await asyncio.to_thread(self._compose_sheet, frames, columns, rows, sheet_path)
+            log_debug('pipeline', "Contact sheet built from %d frames: %s", len(frames), sheet_path)
+            return sheet_path
+        except Exception as e:
+            logger.error(f"Error building contact sheet: {e}")
+            return None
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+    
+    def _compose_sheet(self, frames: List[str], columns: int, rows: int, sheet_path: str):
+        """Paste numbered tiles onto one canvas"""
+        tile_width = self.sheet_tile_size
+        tiles = []
+        for frame_path in frames:
+            with Image.open(frame_path) as frame:
+                tile_height = max(1, round(frame.height * tile_width / frame.width))
+                frame.draft('RGB', (tile_width, tile_height))
+                tiles.append(frame.convert('RGB').resize((tile_width, tile_height), Image.LANCZOS))
+        tile_height = max(tile.height for tile in tiles)
+        sheet = Image.new('RGB', (columns * tile_width, rows * tile_height))
+        draw = ImageDraw.Draw(sheet)
+        for index, tile in enumerate(tiles):
+            x = (index % columns) * tile_width
+            y = (index // columns) * tile_height
+            sheet.paste(tile, (x, y))
+            draw.rectangle([x, y, x + 28, y + 20], fill=(0, 0, 0))
+            draw.text((x + 6, y + 4), str(index + 1), fill=(255, 255, 255))
+        sheet.save(sheet_path, format='JPEG', quality=90)
+    
+    @staticmethod
+    def contact_sheet_layout(image_path: str) -> Optional[Tuple[int, int]]:
+        """Return (rows, columns) if image_path is a contact sheet"""
+        match = re.match(r'sheet_(\d+)x(\d+)_', os.path.basename(image_path))
+        return (int(match.group(1)), int(match.group(2))) if match else None
+    
+    def compute_cover_phash(self, image_path: str) -> Optional[int]:
+        """Compute the perceptual hash used for near-duplicate cover detection"""
+        return dhash(image_path)
+    
+    @metrics.timed('process_video')
     async def process_video(self, file_id: str, file_path: str) -> Tuple[Optional[str], Optional[str]]:
         """Process video: download and extract cover image"""
         try:
@@ -86,36 +305,10 @@ class VideoProcessor:
                 return None, None
             
             # Extract cover image
-            image_path = self.extract_cover_image(video_path)
+            image_path = await self.extract_cover_image(video_path)
             
             return video_path, image_path
             
         except Exception as e:
             logger.error(f"Error processing video: {e}")
             return None, None
-    
-    def cleanup_old_files(self, max_age_hours: int = 24):
-        """Clean up old video and image files"""
-        try:
-            import time
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-            
-            # Clean videos
-            for filename in os.listdir(self.videos_dir):
-                file_path = os.path.join(self.videos_dir, filename)
-                if os.path.isfile(file_path):
-                    if current_time - os.path.getmtime(file_path) > max_age_seconds:
-                        os.remove(file_path)
-                        logger.info(f"Cleaned up old video: {filename}")
-            
-            # Clean images
-            for filename in os.listdir(self.images_dir):
-                file_path = os.path.join(self.images_dir, filename)
-                if os.path.isfile(file_path):
-                    if current_time - os.path.getmtime(file_path) > max_age_seconds:
-                        os.remove(file_path)
-                        logger.info(f"Cleaned up old image: {filename}")
-                        
-        except Exception as e:
-            logger.error(f"Error cleaning up old files: {e}") 
\ No newline at end of file
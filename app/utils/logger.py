@@ -1,43 +1,143 @@
+import atexit
+import json
 import logging
 import os
-from datetime import datetime
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, FrozenSet, Optional
 from app.config import Config
 
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'category', 'fields'}
+
+def _parse_categories(value: str) -> FrozenSet[str]:
+    return frozenset(item.strip() for item in value.split(',') if item.strip())
+
+def _parse_sample_rates(value: str) -> Dict[str, float]:
+    """Parse ``category=rate`` pairs, e.g. ``pipeline=0.1,messages=0.01``"""
+    rates = {}
+    for item in value.split(','):
+        if '=' in item:
+            category, rate = item.split('=', 1)
+            rates[category.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+DEBUG_CATEGORIES = _parse_categories(Config.LOG_DEBUG_CATEGORIES)
+SAMPLE_RATES = _parse_sample_rates(Config.LOG_SAMPLE_RATES)
+
+# Background writer started by setup_logger
+_listener: Optional[QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the writer thread, not the event loop"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        category = getattr(record, 'category', None)
+        if category:
+            entry['category'] = category
+        entry.update(getattr(record, 'fields', None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _LazyQueueHandler(QueueHandler):
+    """Hand records to the writer thread without formatting them first
+
+    The stock QueueHandler renders the message on the calling thread so the
+    record can be pickled; records here never leave the process.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
 def setup_logger(name: str = "viral_bot"):
-    """Setup logger for the bot"""
-    
+    """Setup logger for the bot
+
+    Log calls only enqueue the record; a background thread formats it and
+    writes it to a JSON log file that rotates at midnight, and to the console.
+    """
+    global _listener
+
     # Create logs directory if it doesn't exist
     os.makedirs(Config.LOGS_DIR, exist_ok=True)
-    
+
     # Create logger
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    
+    level = logging.DEBUG if DEBUG_CATEGORIES else getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO)
+    logger.setLevel(level)
+    logger.propagate = False
+
     # Prevent duplicate handlers
     if logger.handlers:
         return logger
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
+
     # File handler
-    log_file = os.path.join(Config.LOGS_DIR, f"{name}_{datetime.now().strftime('%Y%m%d')}.log")
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(formatter)
-    
+    log_file = os.path.join(Config.LOGS_DIR, f"{name}.log")
+    file_handler = TimedRotatingFileHandler(
+        log_file, when='midnight', backupCount=Config.LOG_RETENTION_DAYS, encoding='utf-8', delay=True
+    )
+    file_handler.setFormatter(JsonFormatter())
+
     # Console handler
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(formatter)
-    
-    # Add handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
+    console_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    ))
+
+    # Writer thread
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    logger.addHandler(_LazyQueueHandler(records))
+
     return logger
 
+def stop_logging():
+    """Write out every queued record and stop the writer thread
+
+    Runs at exit; call it directly before ``os._exit``, which skips atexit.
+    """
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+def debug_enabled(category: str) -> bool:
+    """Whether debug output for a category is switched on via LOG_DEBUG_CATEGORIES"""
+    return category in DEBUG_CATEGORIES or '*' in DEBUG_CATEGORIES
+
+def sampled(category: str) -> bool:
+    """Whether this occurrence of a category should be logged, per LOG_SAMPLE_RATES"""
+    rate = SAMPLE_RATES.get(category, 1.0)
+    return rate >= 1.0 or random.random() < rate
+
+def log_event(category: str, msg: str, *args, level: int = logging.INFO, **fields):
+    """Log a sampled, structured event; ``fields`` become keys in the JSON record
+
+    ``msg`` is %-formatted with ``args`` on the writer thread, so pass values
+    as arguments rather than building an f-string.
+    """
+    if not logger.isEnabledFor(level) or not sampled(category):
+        return
+    logger.log(level, msg, *args, extra={'category': category, 'fields': fields})
+
+def log_debug(category: str, msg: str, *args, **fields):
+    """Log a debug event; a no-op unless the category is switched on"""
+    if debug_enabled(category):
+        log_event(category, msg, *args, level=logging.DEBUG, **fields)
+
 # Create default logger instance
-logger = setup_logger() 
\ No newline at end of file
+logger = setup_logger()
@@ -7,22 +7,55 @@ extracts cover images, analyzes them with ChatGPT, and sends
 analysis results back to the channel.
 """
 
+import argparse
 import signal
+import subprocess
 import sys
 import os
+from app.config import Config
 from app.models.bot import ViralTelegramBot
-from app.utils.logger import logger
+from app.utils.logger import logger, stop_logging
+
+# Worker processes started by an ingest process
+worker_processes = []
+
+def start_workers(count: int):
+    """Start local worker processes, each with its own metrics port"""
+    for index in range(count):
+        env = dict(os.environ, PROCESS_ROLE='worker', QUEUE_URL=Config.QUEUE_URL)
+        env['METRICS_PORT'] = str(Config.METRICS_PORT + 1 + index if Config.METRICS_PORT else 0)
+        worker_processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--role', 'worker'], env=env
+        ))
+    if count:
+        logger.info(f"Started {count} worker process(es)")
+
+def stop_workers():
+    for process in worker_processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in worker_processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
 
 def main():
     """Main function to run the bot"""
+    parser = argparse.ArgumentParser(description="Viral Telegram Bot")
+    parser.add_argument('--role', choices=('all', 'ingest', 'worker'), default=Config.PROCESS_ROLE,
+                        help="run everything, only receive updates, or only process queued jobs")
+    args = parser.parse_args()
     bot = None
     
     try:
-        logger.info("Starting Viral Telegram Bot...")
+        logger.info(f"Starting Viral Telegram Bot ({args.role})...")
         
         # Create and start bot
-        bot = ViralTelegramBot()
-        bot.application.run_polling(allowed_updates=None)  # Remove await and just call run_polling
+        bot = ViralTelegramBot(args.role)
+        if args.role == 'ingest':
+            start_workers(Config.WORKER_PROCESSES)
+        bot.run()  # Polling or webhook, depending on BOT_MODE
         
     except KeyboardInterrupt:
         logger.info("Received interrupt signal, shutting down...")
@@ -30,6 +63,7 @@ def main():
         logger.error(f"Fatal error: {e}")
         sys.exit(1)
     finally:
+        stop_workers()
         if bot:
             # The original code had await bot.stop(), but bot.stop() is not async.
             # Since the main function is now synchronous, we can't await it.
@@ -41,6 +75,9 @@ def main():
 def signal_handler(signum, frame):
     """Handle shutdown signals"""
     logger.info(f"Received signal {signum}, shutting down...")
+    stop_workers()
+    # os._exit skips atexit, so flush queued log records first
+    stop_logging()
     # Use os._exit to avoid issues with event loop
     os._exit(0)
 
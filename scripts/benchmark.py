@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+Per-Stage Benchmark Suite for Viral Telegram Bot
+
+Generates synthetic videos with ffmpeg's lavfi test sources and times each
+pipeline stage in isolation: storing a download, cover extraction in every
+cover mode, base64 encoding, response formatting, and analyze_image against
+a local stub OpenAI server. The resilience case replays a burst of analyses
+against a stub that injects errors, 429s, slow and hung responses, and
+reports p99 latency and error rate under each call policy. The fetch case
+gets a video from a stub Bot API server, downloaded over HTTP versus opened
+in place in local mode. The webhook case posts recorded video updates to
+the bot's webhook server and times the acknowledgement and the handler.
+Results are written as JSON so runs from different commits can be compared
+with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+# Add parent directory to Python path so we can import app modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+# Container used for each codec
+CODEC_CONTAINERS = {
+    'libx264': 'mp4',
+    'libx265': 'mp4',
+    'mpeg4': 'mp4',
+    'libvpx-vp9': 'webm',
+}
+
+COVER_MODES = [
+    ('first', 'keyframe'),
+    ('best', 'keyframe'),
+    ('best', 'interval'),
+    ('contact_sheet', 'keyframe'),
+]
+
+def generate_video(path: str, size: str, duration: int, codec: str):
+    """Generate a test clip that opens on a black fade-in"""
+    subprocess.run([
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30:duration={duration}',
+        '-vf', 'fade=in:0:45',
+        '-c:v', codec, '-pix_fmt', 'yuv420p',
+        *(['-deadline', 'realtime', '-cpu-used', '8'] if codec == 'libvpx-vp9' else []),
+        path
+    ], check=True)
+
+def summarize(name: str, params: dict, timings: list, **extra) -> dict:
+    """Timing statistics in milliseconds for one benchmark case"""
+    timings_ms = sorted(t * 1000 for t in timings)
+    result = {
+        'bench': name,
+        'params': params,
+        'runs': len(timings_ms),
+        'mean_ms': round(statistics.mean(timings_ms), 3),
+        'p50_ms': round(statistics.median(timings_ms), 3),
+        'p95_ms': round(timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.95))], 3),
+        'p99_ms': round(timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.99))], 3),
+        'min_ms': round(timings_ms[0], 3),
+    }
+    result.update(extra)
+    label = ' '.join(f"{key}={value}" for key, value in params.items())
+    print(f"⏱️  {name:<10} {label:<55} mean {result['mean_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms")
+    return result
+
+async def measure(function, runs: int, setup=None) -> list:
+    """Time ``runs`` awaits of ``function``; ``setup`` runs untimed before each one"""
+    timings = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        await function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+async def bench_store(processor, video_path: str, params: dict, runs: int) -> dict:
+    """download_video: move a finished download into storage"""
+    incoming = os.path.join(os.path.dirname(video_path), 'incoming.bin')
+    stored = []
+
+    async def run():
+        stored.append(await processor.download_video('bench', incoming))
+
+    def setup():
+        shutil.copyfile(video_path, incoming)
+
+    timings = await measure(run, runs, setup)
+    for path in stored:
+        if path and os.path.exists(path):
+            os.remove(path)
+    return summarize('store', params, timings, bytes=os.path.getsize(video_path))
+
+async def bench_extract(processor, video_path: str, duration: int, params: dict, runs: int) -> list:
+    """extract_cover_image in every cover mode"""
+    from app.services.frame_scoring import load_frame, frame_metrics
+    results = []
+    for mode, sampling in COVER_MODES:
+        processor.cover_mode = mode
+        processor.cover_sampling = sampling
+        image_paths = []
+
+        async def run():
+            image_paths.append(await processor.extract_cover_image(video_path, duration))
+
+        timings = await measure(run, runs)
+        image_path = image_paths[-1]
+        metrics = frame_metrics(load_frame(image_path)) if image_path and mode != 'contact_sheet' else None
+        results.append(summarize(
+            'extract', dict(params, mode=mode, sampling=sampling), timings,
+            cover_sharpness=round(float(metrics[0]), 1) if metrics is not None else None,
+            cover_brightness=round(float(metrics[1]), 1) if metrics is not None else None,
+        ))
+    processor.cover_mode = 'first'
+    return results
+
+async def bench_encode(analyzer, image_path: str, params: dict, runs: int) -> list:
+    """encode_image_to_base64, raw and through the preprocessor"""
+    results = []
+
+    async def raw():
+        analyzer.encode_image_to_base64(image_path)
+
+    timings = await measure(raw, runs)
+    results.append(summarize('encode', dict(params, path='raw'), timings, bytes=os.path.getsize(image_path)))
+
+    if analyzer.preprocessor:
+        preprocessor = analyzer.preprocessor
+        payload_path = preprocessor._payload_path(image_path, preprocessor.short_side)
+
+        async def prepared():
+            preprocessor.prepare(image_path)
+
+        def drop_payload():
+            if os.path.exists(payload_path):
+                os.remove(payload_path)
+
+        timings = await measure(prepared, runs, drop_payload)
+        sent_bytes = os.path.getsize(payload_path) * 3 // 4
+        results.append(summarize('encode', dict(params, path='preprocessed'), timings, bytes=sent_bytes))
+        timings = await measure(prepared, runs)
+        results.append(summarize('encode', dict(params, path='preprocessed_cached'), timings, bytes=sent_bytes))
+    return results
+
+async def bench_format(analyzer, runs: int) -> dict:
+    """generate_response_message on a typical analysis"""
+    from stub_openai_server import STUB_REPLY
+    analysis = "\n\n".join([STUB_REPLY] * 4)
+    video_info = {'duration': 42, 'file_size': 12 * 1024 * 1024}
+
+    async def run():
+        await analyzer.generate_response_message(analysis, video_info)
+
+    return summarize('format', {}, await measure(run, runs * 100))
+
+async def bench_analyze(analyzer, stub, image_path: str, runs: int, concurrency: int, overlap_limit: float) -> list:
+    """analyze_image against the stub server, one at a time and overlapped
+
+    The overlapped case fails when ``concurrency`` calls take ``overlap_limit``
+    times as long as running them back to back, i.e. when calls serialize.
+    """
+    results = []
+
+    async def run():
+        await analyzer.analyze_image(image_path)
+
+    stub.reset()
+    timings = await measure(run, runs)
+    results.append(summarize(
+        'analyze', {'stub_latency_ms': round(stub.latency * 1000), 'concurrency': 1}, timings,
+        overhead_ms=round((statistics.mean(timings) - stub.latency) * 1000, 3),
+        request_bytes=stub.request_bytes // max(1, stub.requests),
+    ))
+
+    async def overlapped():
+        await asyncio.gather(*(analyzer.analyze_image(image_path) for _ in range(concurrency)))
+
+    # With requests overlapping, wall time should stay close to a single call
+    stub.reset()
+    timings = await measure(overlapped, runs)
+    serial_ms = concurrency * stub.latency * 1000
+    result = summarize(
+        'analyze', {'stub_latency_ms': round(stub.latency * 1000), 'concurrency': concurrency}, timings,
+        max_in_flight=stub.max_in_flight,
+    )
+    if concurrency > 1 and result['p50_ms'] >= overlap_limit * serial_ms:
+        result['failed'] = (f"{concurrency} overlapped calls took {result['p50_ms']:.0f} ms, "
+                            f"not under {overlap_limit:.0%} of {serial_ms:.0f} ms back to back")
+    results.append(result)
+
+    # Streamed: time until the first text could be shown, against the full reply
+    first_text = []
+
+    async def streamed():
+        started = time.perf_counter()
+        seen = []
+
+        def on_text(delta):
+            if not seen:
+                first_text.append(time.perf_counter() - started)
+            seen.append(delta)
+
+        await analyzer.analyze_image(image_path, on_text=on_text)
+
+    stub.reset()
+    timings = await measure(streamed, runs)
+    results.append(summarize(
+        'analyze', {'stub_latency_ms': round(stub.latency * 1000), 'concurrency': 1, 'stream': True}, timings,
+        first_text_ms=round(statistics.mean(first_text) * 1000, 3) if first_text else None,
+    ))
+    return results
+
+# Call policies compared by the resilience benchmark
+RESILIENCE_POLICIES = {
+    'single': dict(max_attempts=1, hedge_after=0),
+    'retry': dict(max_attempts=3, hedge_after=0),
+    'retry_hedge': dict(max_attempts=3, hedge_after=None),
+}
+
+async def bench_resilience(analyzer, stub, image_path: str, args) -> list:
+    """analyze_image under injected faults, once per call policy"""
+    from app.services.resilience import ResilientCaller
+    results = []
+    faults = dict(
+        error_rate=args.fault_error_rate, rate_limit_rate=args.fault_rate_limit_rate,
+        slow_rate=args.fault_slow_rate, hang_rate=args.fault_hang_rate,
+    )
+    for name, policy in RESILIENCE_POLICIES.items():
+        caller = ResilientCaller(analyzer.model)
+        caller.max_attempts = policy['max_attempts']
+        # Hedge a little past the stub's normal latency, well before a slow reply
+        caller.hedge_after = stub.latency * 2 if policy['hedge_after'] is None else policy['hedge_after']
+        caller.attempt_timeout = args.attempt_timeout
+        caller.backoff_base = 0.05
+        caller.breaker(analyzer.model).failure_threshold = 0
+        analyzer.caller = caller
+        for fault, rate in faults.items():
+            setattr(stub, fault, rate)
+        stub.random.seed(args.seed)
+        stub.reset()
+
+        limit = asyncio.Semaphore(args.concurrency)
+        timings = []
+        failures = 0
+
+        async def one():
+            nonlocal failures
+            async with limit:
+                start = time.perf_counter()
+                if not await analyzer.analyze_image(image_path):
+                    failures += 1
+                timings.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one() for _ in range(args.resilience_calls)))
+        results.append(summarize(
+            'resilience', dict(policy=name, **faults), timings,
+            error_rate=round(failures / len(timings), 4),
+            requests=stub.requests,
+            hedges=caller.hedges,
+        ))
+    for fault in faults:
+        setattr(stub, fault, 0.0)
+    return results
+
+async def bench_fetch(work_dir: str, args) -> list:
+    """fetch_video from a stub Bot API server: HTTP download and store versus opening in place
+
+    The stub lets the download mode serve files past the public 20 MB limit
+    so both modes can be compared at the same sizes.
+    """
+    from app.config import Config
+    from app.models.bot import ViralTelegramBot
+    from app.services.job_queue import VideoJob
+    from app.services.job_store import StoredFile
+    from stub_bot_api_server import StubBotAPIServer
+    sizes = [int(size) for size in args.fetch_sizes.split(',')]
+    Config.TELEGRAM_BOT_TOKEN = Config.TELEGRAM_BOT_TOKEN or '123456:stub'
+    Config.TELEGRAM_GROUP_ID = Config.TELEGRAM_GROUP_ID or '-1'
+    Config.MAX_VIDEO_SIZE_MB = max(sizes) + 1
+    paths = {}
+    for size_mb in sizes:
+        paths[size_mb] = os.path.join(work_dir, f"fetch_{size_mb}mb.mp4")
+        block = os.urandom(1024 * 1024)
+        with open(paths[size_mb], 'wb') as f:
+            for _ in range(size_mb):
+                f.write(block)
+    results = []
+    for local_mode in (False, True):
+        stub = await StubBotAPIServer(local_mode=local_mode, max_download_mb=max(sizes)).start()
+        Config.TELEGRAM_API_URL = stub.api_url
+        Config.TELEGRAM_LOCAL_MODE = local_mode
+        Config.TELEGRAM_MAX_DOWNLOAD_MB = max(sizes)
+        bot = ViralTelegramBot('all')
+        telegram_bot = bot.application.bot
+        await telegram_bot.initialize()
+        try:
+            for size_mb, path in paths.items():
+                file_id = stub.add_file(path)
+                fetched = []
+
+                async def run():
+                    job = VideoJob(chat_id=-1, message_id=1, video_file=StoredFile(file_id),
+                                   video_info={}, bot=telegram_bot)
+                    await bot.fetch_video(job)
+                    fetched.append(job.video_path)
+
+                def setup():
+                    # Drop the previous run's copy so every run stores afresh
+                    for stored in fetched:
+                        if stored and bot.video_processor.is_stored(stored) and os.path.exists(stored):
+                            os.remove(stored)
+
+                stub.bytes_served = 0
+                timings = await measure(run, args.runs, setup)
+                setup()
+                if None in fetched:
+                    raise RuntimeError(f"fetch_video failed for {size_mb} MB in {'local' if local_mode else 'download'} mode")
+                results.append(summarize(
+                    'fetch', {'mode': 'local' if local_mode else 'download', 'size_mb': size_mb}, timings,
+                    bytes_transferred=stub.bytes_served // args.runs,
+                ))
+        finally:
+            await telegram_bot.shutdown()
+            await bot.ai_analyzer.close()
+            await bot.file_client.aclose()
+            bot.analysis_cache.close()
+            bot.job_store.close()
+            await stub.stop()
+    return results
+
+# A video message as Telegram posts it to a webhook, recorded in a test group
+RECORDED_VIDEO_UPDATE = {
+    'update_id': 100000001,
+    'message': {
+        'message_id': 1,
+        'date': 1760000000,
+        'chat': {'id': -1001234567890, 'title': 'Bench group', 'type': 'supergroup'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Bench'},
+        'video': {
+            'duration': 12, 'width': 1080, 'height': 1920, 'mime_type': 'video/mp4', 'file_size': 4194304,
+            'file_id': 'BAACAgUAAx0CbenchVideoFileId', 'file_unique_id': 'AgADbenchUnique',
+        },
+    },
+}
+
+async def bench_webhook(args) -> list:
+    """Recorded updates posted to the webhook server: time to the 200 and until the handler recorded the job"""
+    import httpx
+    import socket
+    from app.config import Config
+    from app.models.bot import ViralTelegramBot
+    from stub_bot_api_server import StubBotAPIServer
+    if args.webhook_updates:
+        with open(args.webhook_updates) as f:
+            recorded = json.load(f)
+        recorded = recorded if isinstance(recorded, list) else [recorded]
+    else:
+        recorded = [RECORDED_VIDEO_UPDATE]
+    stub = await StubBotAPIServer().start()
+    Config.TELEGRAM_API_URL = stub.api_url
+    Config.TELEGRAM_LOCAL_MODE = False
+    Config.TELEGRAM_BOT_TOKEN = Config.TELEGRAM_BOT_TOKEN or '123456:stub'
+    Config.TELEGRAM_GROUP_ID = ','.join(sorted({str(update['message']['chat']['id']) for update in recorded}))
+    Config.BOT_MODE = 'webhook'
+    Config.WEBHOOK_URL = 'https://bench.invalid'
+    Config.COALESCE_WINDOW_SECONDS = 0
+    Config.JOB_QUEUE_SIZE = args.webhook_posts
+    bot = ViralTelegramBot('all')
+    application = bot.application
+    path = Config.WEBHOOK_PATH.strip('/')
+    secret = 'bench-secret'
+    await application.initialize()
+    await application.start()
+    # Port 0 is not supported by PTB's webhook server, so pick a free one
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    await application.updater.start_webhook(
+        listen='127.0.0.1', port=port, url_path=path, webhook_url=f"{Config.WEBHOOK_URL}/{path}", secret_token=secret
+    )
+    acks, handled = [], []
+    try:
+        async with httpx.AsyncClient() as client:
+            for index in range(args.webhook_posts):
+                update = json.loads(json.dumps(recorded[index % len(recorded)]))
+                update['update_id'] += index
+                update['message']['message_id'] = index + 1
+                chat_id = update['message']['chat']['id']
+                start = time.perf_counter()
+                response = await client.post(
+                    f"http://127.0.0.1:{port}/{path}", json=update,
+                    headers={'X-Telegram-Bot-Api-Secret-Token': secret}
+                )
+                acks.append(time.perf_counter() - start)
+                response.raise_for_status()
+                while bot.job_store.get(chat_id, index + 1) is None:
+                    if time.perf_counter() - start > 5:
+                        raise RuntimeError(f"Webhook update {index + 1} never reached the handler")
+                    await asyncio.sleep(0.0005)
+                handled.append(time.perf_counter() - start)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await bot.outbound.stop(timeout=1.0)
+        await application.shutdown()
+        await bot.ai_analyzer.close()
+        await bot.file_client.aclose()
+        bot.analysis_cache.close()
+        bot.job_store.close()
+        await stub.stop()
+    params = {'updates': len(recorded)}
+    return [
+        summarize('webhook', dict(params, until='ack'), acks),
+        summarize('webhook', dict(params, until='handled'), handled),
+    ]
+
+async def run(args, work_dir: str) -> list:
+    from app.config import Config
+    from stub_openai_server import StubOpenAIServer
+
+    stub = await StubOpenAIServer(
+        latency=args.stub_latency, first_token_latency=args.stub_first_token,
+        retry_after=args.fault_retry_after, slow_latency=args.fault_slow_latency, seed=args.seed
+    ).start()
+    Config.OPENAI_BASE_URL = stub.base_url
+    Config.OPENAI_API_KEY = Config.OPENAI_API_KEY or 'stub'
+
+    from app.services.video_processor import VideoProcessor
+    from app.services.ai_analyzer import AIAnalyzer
+    processor = VideoProcessor()
+    analyzer = AIAnalyzer()
+    selected = set(args.only.split(',')) if args.only else None
+
+    def wanted(name: str) -> bool:
+        return selected is None or name in selected
+
+    results = []
+    cover_path = None
+    try:
+        media_stages = [name for name in ('store', 'extract', 'encode') if wanted(name)]
+        for codec in args.codecs.split(',') if media_stages else []:
+            for size in args.sizes.split(','):
+                for duration in (int(d) for d in args.durations.split(',')):
+                    params = {'codec': codec, 'resolution': size, 'duration_s': duration}
+                    video_path = os.path.join(work_dir, f"bench_{codec}_{size}_{duration}.{CODEC_CONTAINERS.get(codec, 'mp4')}")
+                    generate_video(video_path, size, duration, codec)
+                    if wanted('store'):
+                        results.append(await bench_store(processor, video_path, params, args.runs))
+                    if wanted('extract'):
+                        results.extend(await bench_extract(processor, video_path, duration, params, args.runs))
+                    if wanted('encode'):
+                        cover_path = await processor.extract_cover_image(video_path, duration)
+                        results.extend(await bench_encode(analyzer, cover_path, {'resolution': size}, args.runs))
+        if wanted('format'):
+            results.append(await bench_format(analyzer, args.runs))
+        if (wanted('analyze') or wanted('resilience')) and not cover_path:
+            video_path = os.path.join(work_dir, 'bench_analyze.mp4')
+            generate_video(video_path, '1080x1920', 2, 'libx264')
+            cover_path = await processor.extract_cover_image(video_path, 2)
+        if wanted('analyze'):
+            results.extend(await bench_analyze(analyzer, stub, cover_path, args.runs, args.concurrency, args.overlap_limit))
+        if wanted('resilience'):
+            results.extend(await bench_resilience(analyzer, stub, cover_path, args))
+        if wanted('fetch'):
+            results.extend(await bench_fetch(work_dir, args))
+        if wanted('webhook'):
+            results.extend(await bench_webhook(args))
+    finally:
+        await analyzer.close()
+        await stub.stop()
+    return results
+
+def environment() -> dict:
+    """Where and on what the numbers were measured"""
+    def command_output(command):
+        try:
+            return subprocess.run(command, capture_output=True, text=True, check=True).stdout.strip()
+        except Exception:
+            return None
+    ffmpeg_version = command_output(['ffmpeg', '-version'])
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': command_output(['git', 'rev-parse', '--short', 'HEAD']),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+    }
+
+def case_key(result: dict) -> str:
+    return result['bench'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+def compare(baseline_path: str, results: list, threshold: float) -> int:
+    """Print per-case changes against a baseline; returns the number of regressions"""
+    with open(baseline_path) as f:
+        baseline = {case_key(result): result for result in json.load(f)['results']}
+    regressions = 0
+    print(f"\n📈 Compared with {baseline_path} (threshold {threshold:.0%}):")
+    for result in results:
+        before = baseline.get(case_key(result))
+        if not before or not before['p50_ms']:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        marker = '✅'
+        if change > threshold:
+            marker = '❌'
+            regressions += 1
+        elif change < -threshold:
+            marker = '🚀'
+        print(f"{marker} {case_key(result)}: {before['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms ({change:+.1%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the video pipeline')
+    parser.add_argument('--sizes', default='640x360,1080x1920')
+    parser.add_argument('--durations', default='5,30', help='Clip lengths in seconds')
+    parser.add_argument('--codecs', default='libx264,libvpx-vp9')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--only', help='Comma-separated subset: store,extract,encode,format,analyze,resilience,fetch,webhook')
+    parser.add_argument('--stub-latency', type=float, default=0.2, help='Stub OpenAI response delay in seconds')
+    parser.add_argument('--stub-first-token', type=float, help='Stub delay before the first streamed piece')
+    parser.add_argument('--concurrency', type=int, default=8, help='Overlapping analyze_image calls')
+    parser.add_argument('--overlap-limit', type=float, default=0.5,
+                        help='Fail if overlapped calls take this fraction of their back-to-back time')
+    parser.add_argument('--resilience-calls', type=int, default=200, help='Analyses per call policy')
+    parser.add_argument('--attempt-timeout', type=float, default=1.0, help='Per-attempt deadline in the resilience case')
+    parser.add_argument('--fault-error-rate', type=float, default=0.05)
+    parser.add_argument('--fault-rate-limit-rate', type=float, default=0.02)
+    parser.add_argument('--fault-retry-after', type=float, default=0.2)
+    parser.add_argument('--fault-slow-rate', type=float, default=0.05)
+    parser.add_argument('--fault-slow-latency', type=float, default=0.8)
+    parser.add_argument('--fault-hang-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the injected faults')
+    parser.add_argument('--fetch-sizes', default='16,256', help='Video sizes in MB for the fetch case')
+    parser.add_argument('--webhook-posts', type=int, default=50, help='Updates posted in the webhook case')
+    parser.add_argument('--webhook-updates', help='JSON file with recorded updates (one object or a list)')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Relative p50 slowdown counted as a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Keep benchmark files out of the bot's data directories
+        for name in ('VIDEOS_DIR', 'IMAGES_DIR', 'LOGS_DIR', 'DATABASE_DIR'):
+            os.environ[name] = os.path.join(work_dir, name.lower())
+        results = asyncio.run(run(args, work_dir))
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2, ensure_ascii=False)
+    print(f"\n📊 Results written to {args.output}")
+
+    failed = [result for result in results if result.get('failed')]
+    for result in failed:
+        print(f"❌ {case_key(result)}: {result['failed']}")
+    regressions = compare(args.compare, results, args.threshold) if args.compare else 0
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ Run this before starting the bot to ensure everything is properly set up.
 """
 
 import os
+import re
 import sys
 import subprocess
 from pathlib import Path
@@ -31,7 +32,11 @@ def check_ffmpeg():
         result = subprocess.run(['ffmpeg', '-version'], 
                               capture_output=True, text=True, timeout=5)
         if result.returncode == 0:
-            print("✅ ffmpeg is installed")
+            version = result.stdout.split('\n', 1)[0].replace('ffmpeg version ', '').split(' ', 1)[0]
+            print(f"✅ ffmpeg {version} is installed")
+            match = re.match(r'n?(\d+)\.(\d+)', version)
+            if match and (int(match.group(1)), int(match.group(2))) < (5, 1):
+                print("⚠️  ffmpeg older than 5.1: frame sampling falls back to -vsync; 5.1 or newer is recommended")
             return True
         else:
             print("❌ ffmpeg is not working properly")
@@ -52,6 +57,7 @@ def check_python_dependencies():
         ('openai', 'openai'), 
         ('yt-dlp', 'yt_dlp'),
         ('Pillow', 'PIL'),
+        ('numpy', 'numpy'),
         ('python-dotenv', 'dotenv'),
         ('requests', 'requests'),
         ('aiofiles', 'aiofiles')
@@ -140,7 +146,8 @@ def check_bot_token():
         from app.config import Config
         import requests
         
-        url = f"https://api.telegram.org/bot{Config.TELEGRAM_BOT_TOKEN}/getMe"
+        api_url = (Config.TELEGRAM_API_URL or "https://api.telegram.org").rstrip('/')
+        url = f"{api_url}/bot{Config.TELEGRAM_BOT_TOKEN}/getMe"
         response = requests.get(url, timeout=10)
         
         if response.status_code == 200:
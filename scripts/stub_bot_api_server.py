@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Stub Bot API Server for Viral Telegram Bot
+
+A tiny local stand-in for a self-hosted telegram-bot-api server, used by the
+benchmarks and for trying TELEGRAM_API_URL / TELEGRAM_LOCAL_MODE without a
+real server. It answers getMe, getFile, sendMessage, editMessageText and
+getUpdates, and serves registered files.
+
+Like the real server, it has two modes. By default getFile returns a
+relative path that the bot downloads from /file/bot<token>/<path>, and
+files over 20 MB are refused. With ``local_mode`` getFile returns the
+file's absolute path on disk, file downloads are not served, and files up
+to 2000 MB are handed out. ``fetch_latency`` imitates the time the server
+spends fetching a file from Telegram before getFile answers.
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, Optional
+from urllib.parse import parse_qs, unquote
+
+CHUNK_SIZE = 1024 * 1024
+
+class StubBotAPIServer:
+    """In-process HTTP/1.1 server mimicking the Bot API methods the bot uses"""
+
+    def __init__(self, local_mode: bool = False, host: str = '127.0.0.1', port: int = 0,
+                 fetch_latency: float = 0.0, max_download_mb: Optional[int] = None):
+        self.local_mode = local_mode
+        self.host = host
+        self.port = port
+        self.fetch_latency = fetch_latency
+        self.max_download_mb = max_download_mb or (2000 if local_mode else 20)
+        self.files: Dict[str, str] = {}
+        self.messages: Dict[int, dict] = {}
+        self.server = None
+        self.requests = 0
+        self.bytes_served = 0
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def add_file(self, path: str, file_id: Optional[str] = None) -> str:
+        """Make a file on disk available through getFile; returns its file_id"""
+        file_id = file_id or f"stub_file_{len(self.files)}"
+        self.files[file_id] = os.path.abspath(path)
+        return file_id
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        method, path = request_line.decode('latin-1').split()[:2]
+        return method, path, headers, body
+
+    @staticmethod
+    def _params(path: str, headers: dict, body: bytes) -> dict:
+        """Method parameters from the query string and a form or JSON body"""
+        params = {}
+        path, _, query = path.partition('?')
+        if query:
+            params.update({key: values[-1] for key, values in parse_qs(query).items()})
+        if body:
+            if headers.get('content-type', '').startswith('application/json'):
+                params.update(json.loads(body))
+            else:
+                params.update({key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()})
+        return params
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: str, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def _error(self, writer: asyncio.StreamWriter, code: int, description: str):
+        status = {400: '400 Bad Request', 404: '404 Not Found'}[code]
+        await self._respond(writer, status, {'ok': False, 'error_code': code, 'description': description})
+
+    def _message(self, chat_id, text: str, message_id: Optional[int] = None) -> dict:
+        message_id = message_id or len(self.messages) + 1
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'supergroup', 'title': 'Stub group'},
+            'text': text,
+        }
+        self.messages[message_id] = message
+        return message
+
+    async def _call(self, writer: asyncio.StreamWriter, method: str, params: dict):
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+        elif method == 'getFile':
+            path = self.files.get(params.get('file_id', ''))
+            if path is None or not os.path.exists(path):
+                await self._error(writer, 400, 'Bad Request: invalid file_id')
+                return
+            size = os.path.getsize(path)
+            if size > self.max_download_mb * 1024 * 1024:
+                await self._error(writer, 400, 'Bad Request: file is too big')
+                return
+            await asyncio.sleep(self.fetch_latency)
+            result = {
+                'file_id': params['file_id'],
+                'file_unique_id': params['file_id'],
+                'file_size': size,
+                'file_path': path if self.local_mode else f"videos/{params['file_id']}",
+            }
+        elif method == 'sendMessage':
+            result = self._message(params.get('chat_id', 0), params.get('text', ''))
+        elif method == 'editMessageText':
+            result = self._message(params.get('chat_id', 0), params.get('text', ''), int(params.get('message_id', 0)))
+        elif method == 'getUpdates':
+            await asyncio.sleep(min(float(params.get('timeout', 0)), 1.0))
+            result = []
+        else:
+            # setWebhook, deleteWebhook, close, ...
+            result = True
+        await self._respond(writer, '200 OK', {'ok': True, 'result': result})
+
+    async def _serve_file(self, writer: asyncio.StreamWriter, file_path: str):
+        file_id = os.path.basename(unquote(file_path))
+        path = self.files.get(file_id)
+        if self.local_mode or path is None:
+            await self._error(writer, 404, 'Not Found')
+            return
+        size = os.path.getsize(path)
+        writer.write(
+            f"HTTP/1.1 200 OK\r\n"
+            f"Content-Type: application/octet-stream\r\n"
+            f"Content-Length: {size}\r\n"
+            f"Connection: keep-alive\r\n\r\n".encode('latin-1')
+        )
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        self.bytes_served += size
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Keep-alive: serve requests until the client closes the connection
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                self.requests += 1
+                parts = path.partition('?')[0].strip('/').split('/')
+                if len(parts) >= 4 and parts[0] == 'file' and parts[1].startswith('bot'):
+                    await self._serve_file(writer, '/'.join(parts[3:]))
+                elif len(parts) == 2 and parts[0].startswith('bot'):
+                    await self._call(writer, parts[1], self._params(path, headers, body))
+                else:
+                    await self._error(writer, 404, 'Not Found')
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(args):
+    server = await StubBotAPIServer(
+        local_mode=args.local, host=args.host, port=args.port, fetch_latency=args.fetch_latency
+    ).start()
+    for path in args.files:
+        print(f"   {server.add_file(path, os.path.basename(path))} -> {path}")
+    print(f"🧪 Stub Bot API server listening on {server.api_url} ({'local' if args.local else 'remote'} mode)")
+    print(f"   export TELEGRAM_API_URL={server.api_url}")
+    if args.local:
+        print("   export TELEGRAM_LOCAL_MODE=true")
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stub of a self-hosted Telegram Bot API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--local', action='store_true', help='Answer getFile with absolute paths, like --local')
+    parser.add_argument('--fetch-latency', type=float, default=0.0, help='Seconds getFile takes to answer')
+    parser.add_argument('files', nargs='*', help='Files to serve; each file name is its file_id')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
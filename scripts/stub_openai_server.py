@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Stub OpenAI Server for Viral Telegram Bot
+
+A tiny local stand-in for the chat completions endpoint, used by the
+benchmarks so analyze_image can be timed without network access or cost.
+It answers every POST to /v1/chat/completions after a configurable delay
+and records how many requests were in flight at once. Requests with
+``"stream": true`` get the reply as server-sent events: the first piece
+after ``first_token_latency`` and the rest spread over the remaining delay.
+
+Faults can be injected per request for resilience testing: server errors,
+429s with Retry-After, responses slowed to ``slow_latency`` and requests
+that hang without ever answering.
+
+Prompt caching is imitated too: a request whose system message was seen
+before reports that message's tokens as ``cached_tokens``.
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Optional
+
+STUB_REPLY = "📝 版本1：这是一段用于基准测试的占位文案。\n你们觉得呢？A. 太棒了 B. 一般般 C. 想试试"
+
+class StubOpenAIServer:
+    """In-process HTTP/1.1 server mimicking POST /v1/chat/completions"""
+
+    STREAM_PIECES = 20
+
+    def __init__(self, latency: float = 0.2, reply: str = STUB_REPLY, host: str = '127.0.0.1', port: int = 0,
+                 first_token_latency: Optional[float] = None, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, slow_rate: float = 0.0,
+                 slow_latency: float = 5.0, hang_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.first_token_latency = latency / 10 if first_token_latency is None else first_token_latency
+        self.reply = reply
+        self.host = host
+        self.port = port
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.hang_rate = hang_rate
+        self.random = random.Random(seed)
+        self.faults = {'error': 0, 'rate_limit': 0, 'slow': 0, 'hang': 0}
+        self.seen_prefixes = set()
+        self.server = None
+        self.closing: Optional[asyncio.Event] = None
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_bytes = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self.closing = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.closing:
+            # Release hung requests so their handlers finish cleanly
+            self.closing.set()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def reset(self):
+        self.faults = dict.fromkeys(self.faults, 0)
+        self.requests = 0
+        self.max_in_flight = 0
+        self.request_bytes = 0
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        method, path = request_line.decode('latin-1').split()[:2]
+        return method, path, headers, body
+
+    def _usage(self, request: dict) -> dict:
+        prompt_chars = sum(
+            len(part.get('text', '')) if isinstance(part, dict) else len(str(part))
+            for message in request.get('messages', [])
+            for part in (message['content'] if isinstance(message.get('content'), list) else [message.get('content', '')])
+        )
+        system = ''.join(
+            message['content'] for message in request.get('messages', [])
+            if message.get('role') == 'system' and isinstance(message.get('content'), str)
+        )
+        cached = len(system) // 4 if system in self.seen_prefixes else 0
+        if system:
+            self.seen_prefixes.add(system)
+        return {
+            'prompt_tokens': prompt_chars // 4,
+            'completion_tokens': len(self.reply) // 2,
+            'total_tokens': prompt_chars // 4 + len(self.reply) // 2,
+            'prompt_tokens_details': {'cached_tokens': cached},
+        }
+
+    def _completion(self, request: dict) -> dict:
+        return {
+            'id': f'chatcmpl-stub-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.reply},
+                'finish_reason': 'stop',
+            }],
+            'usage': self._usage(request),
+        }
+
+    def _chunk(self, request: dict, delta: dict, finish_reason: Optional[str] = None) -> dict:
+        return {
+            'id': f'chatcmpl-stub-{self.requests}',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+
+    async def _stream(self, writer: asyncio.StreamWriter, request: dict, latency: float):
+        """Send the reply as chunked server-sent events, like the real streaming API"""
+        async def event(payload):
+            data = b'data: ' + (payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode('utf-8')) + b'\n\n'
+            writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b'\r\n')
+            await writer.drain()
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+        )
+        size = max(1, -(-len(self.reply) // self.STREAM_PIECES))
+        pieces = [self.reply[start:start + size] for start in range(0, len(self.reply), size)]
+        gap = max(0.0, latency - self.first_token_latency) / max(1, len(pieces) - 1)
+        await asyncio.sleep(self.first_token_latency)
+        await event(self._chunk(request, {'role': 'assistant', 'content': ''}))
+        for index, piece in enumerate(pieces):
+            if index:
+                await asyncio.sleep(gap)
+            await event(self._chunk(request, {'content': piece}))
+        await event(self._chunk(request, {}, 'stop'))
+        if (request.get('stream_options') or {}).get('include_usage'):
+            usage_chunk = self._chunk(request, {})
+            usage_chunk['choices'] = []
+            usage_chunk['usage'] = self._usage(request)
+            await event(usage_chunk)
+        await event(b'[DONE]')
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _pick_fault(self) -> Optional[str]:
+        """Decide which fault, if any, this request gets"""
+        roll = self.random.random()
+        for fault, rate in (('hang', self.hang_rate), ('error', self.error_rate),
+                            ('rate_limit', self.rate_limit_rate), ('slow', self.slow_rate)):
+            if roll < rate:
+                self.faults[fault] += 1
+                return fault
+            roll -= rate
+        return None
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: str, payload: dict, headers: str = ''):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"{headers}"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Keep-alive: serve requests until the client closes the connection
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if method != 'POST' or not path.endswith('/chat/completions'):
+                    await self._respond(writer, '404 Not Found', {'error': {'message': 'not found'}})
+                    continue
+                self.requests += 1
+                self.request_bytes += len(body)
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    payload = json.loads(body)
+                    fault = self._pick_fault()
+                    latency = self.slow_latency if fault == 'slow' else self.latency
+                    if fault == 'hang':
+                        await self.closing.wait()
+                        break
+                    elif fault == 'error':
+                        await asyncio.sleep(self.first_token_latency)
+                        await self._respond(writer, '500 Internal Server Error',
+                                            {'error': {'message': 'injected failure', 'type': 'server_error'}})
+                    elif fault == 'rate_limit':
+                        await self._respond(writer, '429 Too Many Requests',
+                                            {'error': {'message': 'injected rate limit', 'type': 'rate_limit_error'}},
+                                            f"Retry-After: {self.retry_after:g}\r\n")
+                    elif payload.get('stream'):
+                        await self._stream(writer, payload, latency)
+                    else:
+                        await asyncio.sleep(latency)
+                        await self._respond(writer, '200 OK', self._completion(payload))
+                finally:
+                    self.in_flight -= 1
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(args):
+    server = await StubOpenAIServer(
+        latency=args.latency, host=args.host, port=args.port, first_token_latency=args.first_token_latency,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        slow_rate=args.slow_rate, slow_latency=args.slow_latency, hang_rate=args.hang_rate, seed=args.seed
+    ).start()
+    print(f"🧪 Stub OpenAI server listening on {server.base_url}")
+    print(f"   export OPENAI_BASE_URL={server.base_url}")
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stub of the OpenAI chat completions API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before each response')
+    parser.add_argument('--first-token-latency', type=float, help='Seconds before the first streamed piece')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After sent with each 429')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Fraction answered after --slow-latency')
+    parser.add_argument('--slow-latency', type=float, default=5.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='Fraction that never get an answer')
+    parser.add_argument('--seed', type=int, help='Seed for repeatable fault injection')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()